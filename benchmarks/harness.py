@@ -0,0 +1,287 @@
+"""
+Benchmark dell'harness: pipeline completa di ogni task a latenza di rete zero.
+
+Per ogni task e dimensione genera un dataset sintetico JSONL (replicando i
+test case reali con nuovi ID) ed esegue in un processo nuovo:
+load -> render (prompt) -> generate (provider oracolo in-process) -> score
+(calcolatori tasks/*/metrics.py) -> save (JSON + archivio SQLite) ->
+aggregate (archivio e file) -> charts (opzionale).
+
+Riporta tempo per fase, esempi/secondo e picco RSS, confrontandoli con le
+baseline salvate: esce con codice 1 se il throughput scende o la memoria
+cresce oltre la tolleranza.
+
+Per final_answer i punteggi DeepEval sono sostituiti da un valore fisso:
+si misura l'harness, non il giudice LLM.
+
+Uso:
+    python benchmarks/harness.py
+    python benchmarks/harness.py --tasks routing,rag --sizes 1000,1000000
+    python benchmarks/harness.py --update-baselines
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import cycle
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+from src.data_loader import build_jsonl_index, load_dataset, load_test_cases  # noqa: E402
+from src.logger import ResultLogger  # noqa: E402
+from src.metrics import calculate_cost  # noqa: E402
+from src.result_aggregator import aggregate_store_results, aggregate_task_results  # noqa: E402
+from src.results_store import ResultsStore  # noqa: E402
+from src.task_specs import get_all_tasks, get_task_spec  # noqa: E402
+
+BASELINES_PATH = REPO_ROOT / "benchmarks" / "harness_baselines.json"
+DEFAULT_SIZES = "1000,10000,100000"
+DEFAULT_TOLERANCE = 0.25
+
+STAGES = ("load", "render", "generate", "score", "save", "agg_store", "agg_files", "charts")
+
+
+class OracleClient:
+    """
+    Provider in-process a latenza zero che risponde con la ground truth.
+
+    Stessa firma di ModelInferenceClient.generate più il test case, da cui
+    ricava la risposta: così anche i confronti delle metriche lavorano su
+    risposte corrette e strutturate come quelle reali.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+
+    def generate(self, system_prompt: str, user_prompt: str, test_case: Dict[str, Any], **kwargs):
+        answer = self.spec.reference_answer(test_case)
+        if answer.startswith("{"):
+            # Come molti modelli reali: JSON in un blocco ```json
+            answer = "```json\n" + answer + "\n```"
+        prompt_tokens = (len(system_prompt) + len(user_prompt)) // 4
+        completion_tokens = len(answer) // 4
+        token_usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        return answer, 0.0, token_usage
+
+
+def _create_metrics(spec):
+    """Calcolatore della task; per final_answer senza chiamate DeepEval."""
+    if spec.name != "final_answer":
+        return spec.create_metrics()
+
+    from tasks.final_answer.metrics import FinalAnswerMetricsCalculator
+
+    class OfflineFinalAnswerMetrics(FinalAnswerMetricsCalculator):
+        def __init__(self):
+            self.llm_judge_model = None
+            self.reset()
+
+        def _evaluate_faithfulness(self, actual_output, retrieval_context, threshold):
+            return 1.0
+
+        def _evaluate_answer_relevancy(self, input_query, actual_output, retrieval_context, threshold):
+            return 1.0
+
+    return OfflineFinalAnswerMetrics()
+
+
+def make_synthetic_dataset(task: str, size: int, output_dir: Path) -> Path:
+    """Scrive un dataset JSONL di `size` esempi replicando quelli reali (ID univoci e ordinati)."""
+    spec = get_task_spec(task, tasks_dir=str(REPO_ROOT / "tasks"))
+    jsonl_path = output_dir / f"{task}_{size}.jsonl"
+    source = load_dataset(spec.dataset_path)
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for n, test_case in zip(range(size), cycle(source)):
+            f.write(json.dumps({**test_case, "id": f"syn{n:07d}-{test_case['id']}"}, ensure_ascii=False) + "\n")
+    build_jsonl_index(jsonl_path)
+    return jsonl_path
+
+
+def run_pipeline(task: str, jsonl_path: str, work_dir: str, charts: bool) -> Dict[str, Any]:
+    """Esegue la pipeline completa di una task (in un processo dedicato)."""
+    os.chdir(REPO_ROOT)
+    spec = get_task_spec(task)
+    work_dir = Path(work_dir)
+    stages = {stage: 0.0 for stage in STAGES}
+    perf = time.perf_counter
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = perf()
+        test_cases = load_test_cases(jsonl_path)
+        stages["load"] = perf() - start
+
+        client = OracleClient(spec)
+        metrics = _create_metrics(spec)
+        system_prompt = spec.system_prompt
+        examples = []
+        # Le fasi per esempio sono interlacciate come nei runner: si accumulano i tempi
+        for test_case in test_cases:
+            t0 = perf()
+            user_prompt = spec.render_user_prompt(test_case)
+            t1 = perf()
+            predicted, latency, token_usage = client.generate(system_prompt, user_prompt, test_case)
+            cost = calculate_cost(token_usage["prompt_tokens"], token_usage["completion_tokens"], 0.15, 0.60)
+            t2 = perf()
+            spec.add_prediction(metrics, predicted, test_case, latency, cost)
+            examples.append({
+                "example_id": test_case["id"],
+                "predicted": predicted,
+                "latency": latency,
+                "cost": cost,
+                "prompt_tokens": token_usage["prompt_tokens"],
+                "completion_tokens": token_usage["completion_tokens"],
+            })
+            t3 = perf()
+            stages["render"] += t1 - t0
+            stages["generate"] += t2 - t1
+            stages["score"] += t3 - t2
+
+        start = perf()
+        final_metrics = metrics.get_metrics()
+        stages["score"] += perf() - start
+
+        start = perf()
+        store = ResultsStore(str(work_dir / "verabench.db"))
+        result_logger = ResultLogger(str(work_dir / "results" / task), "bench", store=store)
+        config = {"task": task, "model_name": "oracle", "provider": "oracle", "total_examples": len(test_cases)}
+        result_logger.save_results({"config": config, "metrics": final_metrics}, "oracle", examples=examples)
+        stages["save"] = perf() - start
+
+        start = perf()
+        aggregated = aggregate_store_results(store, task)
+        stages["agg_store"] = perf() - start
+        store.close()
+
+        start = perf()
+        aggregate_task_results(work_dir / "results" / task, task, recursive=True)
+        stages["agg_files"] = perf() - start
+
+        if charts:
+            start = perf()
+            try:
+                from src.bubble_visualizer import visualize_results
+                visualize_results(aggregated, task, work_dir / "charts", preview=True)
+            except ImportError:
+                stages["charts"] = None
+            else:
+                stages["charts"] = perf() - start
+
+    total = sum(value for value in stages.values() if value)
+    return {
+        "task": task,
+        "size": len(test_cases),
+        "stages": stages,
+        "total_seconds": total,
+        "examples_per_sec": len(test_cases) / total if total else 0.0,
+        # ru_maxrss è in KiB su Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "accuracy": final_metrics.get(spec.accuracy_field),
+    }
+
+
+def compare_with_baseline(result: Dict[str, Any], baseline: Optional[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Regressioni rispetto alla baseline (throughput più basso o RSS più alto oltre la tolleranza)."""
+    if not baseline:
+        return []
+    problems = []
+    if result["examples_per_sec"] < baseline["examples_per_sec"] * (1 - tolerance):
+        problems.append(f"throughput {result['examples_per_sec']:.0f}/s < baseline {baseline['examples_per_sec']:.0f}/s")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + tolerance):
+        problems.append(f"RSS {result['peak_rss_mb']:.0f} MB > baseline {baseline['peak_rss_mb']:.0f} MB")
+    return problems
+
+
+def _load_baselines(path: Path) -> Dict[str, Any]:
+    if not path.exists():
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _format_stage(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dell'harness con provider oracolo a latenza zero")
+    parser.add_argument("--tasks", type=str, default=",".join(get_all_tasks()),
+                        help="Task separate da virgola")
+    parser.add_argument("--sizes", type=str, default=DEFAULT_SIZES,
+                        help="Dimensioni dei dataset sintetici separate da virgola (es. 1000,1000000)")
+    parser.add_argument("--charts", action="store_true",
+                        help="Includi il rendering dei grafici (richiede pandas/matplotlib)")
+    parser.add_argument("--baselines", type=str, default=str(BASELINES_PATH), help="File JSON delle baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Regressione tollerata rispetto alla baseline (0.25 = 25%%)")
+    parser.add_argument("--update-baselines", action="store_true",
+                        help="Salva i risultati come nuove baseline invece di confrontarli")
+    parser.add_argument("--output", type=str, default=None, help="Salva i risultati completi in JSON")
+    args = parser.parse_args()
+
+    tasks = [task.strip() for task in args.tasks.split(",") if task.strip()]
+    sizes = [int(size) for size in args.sizes.split(",")]
+    baselines_path = Path(args.baselines)
+    baselines = _load_baselines(baselines_path)
+
+    header = f"{'Task':<14} {'Size':>9} " + " ".join(f"{stage[:9]:>9}" for stage in STAGES)
+    print(header + f" {'ex/s':>10} {'RSS MB':>8}  Status")
+    print("-" * (len(header) + 30))
+
+    results = []
+    failed = False
+    # Un processo nuovo per ogni misura: il picco RSS non si somma tra le run
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="verabench-harness-") as tmp:
+        tmp = Path(tmp)
+        for task in tasks:
+            for size in sizes:
+                work_dir = tmp / f"{task}_{size}"
+                work_dir.mkdir()
+                jsonl_path = make_synthetic_dataset(task, size, work_dir)
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    result = executor.submit(run_pipeline, task, str(jsonl_path), str(work_dir), args.charts).result()
+                results.append(result)
+
+                key = f"{task}:{size}"
+                problems = [] if args.update_baselines else compare_with_baseline(
+                    result, baselines.get(key), args.tolerance)
+                failed = failed or bool(problems)
+                status = "OK" if not problems else "REGRESSIONE (" + "; ".join(problems) + ")"
+                if not args.update_baselines and key not in baselines:
+                    status = "OK (nessuna baseline)"
+                print(f"{task:<14} {size:>9} "
+                      + " ".join(f"{_format_stage(result['stages'][stage]):>9}" for stage in STAGES)
+                      + f" {result['examples_per_sec']:>10.0f} {result['peak_rss_mb']:>8.0f}  {status}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baselines:
+        for result in results:
+            baselines[f"{result['task']}:{result['size']}"] = {
+                "examples_per_sec": round(result["examples_per_sec"], 1),
+                "peak_rss_mb": round(result["peak_rss_mb"], 1),
+            }
+        with open(baselines_path, "w", encoding="utf-8") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+        print(f"\nBaseline aggiornate: {baselines_path}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
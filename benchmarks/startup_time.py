@@ -0,0 +1,131 @@
+"""
+Benchmark del tempo di avvio a freddo dei runner (python -X importtime).
+
+Per ogni main_*.py misura il tempo cumulativo di import dei moduli di primo
+livello e verifica che nessuna dipendenza pesante (SDK provider, wandb,
+librerie di plotting, DeepEval) venga caricata all'import. Esce con codice 1
+se un runner supera il budget o importa un modulo vietato.
+
+Uso:
+    python benchmarks/startup_time.py
+    python benchmarks/startup_time.py --budget-ms 300 --runs 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+RUNNER_MODULES = [
+    "main_routing",
+    "main_tool_calling",
+    "main_rag",
+    "main_judge",
+    "main_final_answer",
+]
+
+# Moduli che devono essere caricati solo quando effettivamente usati
+HEAVY_MODULES = [
+    "openai",
+    "anthropic",
+    "google.generativeai",
+    "wandb",
+    "deepeval",
+    "pandas",
+    "matplotlib",
+    "seaborn",
+    "numpy",
+]
+
+DEFAULT_BUDGET_MS = 500
+
+
+def measure_import(module: str) -> Tuple[float, Dict[str, float], List[str]]:
+    """
+    Importa un modulo in un interprete nuovo con -X importtime.
+
+    Returns:
+        Tupla (ms totali, ms cumulativi per modulo, righe di errore)
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+
+    cumulative: Dict[str, float] = {}
+    errors = []
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            errors.append(line)
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # intestazione
+        name_field = parts[2]
+        name = name_field.strip()
+        cumulative_us = int(parts[1])
+        cumulative[name] = cumulative_us / 1000
+        # I moduli di primo livello non sono indentati: la loro somma è il tempo totale
+        if len(name_field) - len(name_field.lstrip(" ")) == 1:
+            total_us += cumulative_us
+
+    if result.returncode != 0:
+        errors.append(f"exit code {result.returncode}")
+    return total_us / 1000, cumulative, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tempo di avvio dei runner")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="Budget massimo (mediana) per runner in millisecondi")
+    parser.add_argument("--runs", type=int, default=3, help="Misure per runner (si usa la mediana)")
+    parser.add_argument("--top", type=int, default=5, help="Moduli più lenti da mostrare")
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'Runner':<22} {'Median (ms)':>12} {'Budget (ms)':>12}  Status")
+    print("-" * 70)
+
+    for module in RUNNER_MODULES:
+        timings = []
+        cumulative: Dict[str, float] = {}
+        errors: List[str] = []
+        for _ in range(args.runs):
+            total_ms, cumulative, errors = measure_import(module)
+            timings.append(total_ms)
+            if errors:
+                break
+
+        median_ms = statistics.median(timings)
+        heavy = sorted(name for name in cumulative if name in HEAVY_MODULES)
+        problems = []
+        if errors:
+            problems.append("import fallito")
+        if heavy:
+            problems.append(f"moduli pesanti: {', '.join(heavy)}")
+        if median_ms > args.budget_ms:
+            problems.append("oltre budget")
+
+        status = "OK" if not problems else "FAIL (" + "; ".join(problems) + ")"
+        failed = failed or bool(problems)
+        print(f"{module:<22} {median_ms:>12.1f} {args.budget_ms:>12.1f}  {status}")
+
+        slowest = sorted(cumulative.items(), key=lambda item: -item[1])[:args.top]
+        for name, ms in slowest:
+            print(f"    {ms:>9.1f} ms  {name}")
+        for line in errors[-5:]:
+            print(f"    ! {line}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,408 @@
+"""
+Benchmark end-to-end della pipeline di Vera AI.
+
+Concatena i prompt delle task sul percorso di una richiesta utente:
+routing (sceglie l'agente) e tool_calling (produce il tool call) in
+parallelo, poi il tool executor simulato restituisce i dati, il judge li
+valida e final_answer scrive la risposta per WhatsApp.
+
+Ogni stage può usare un modello diverso. Riporta latenza e costo per stage
+e totali: la latenza end-to-end è il percorso critico
+max(routing, tool_calling) + tool + judge + final_answer.
+
+Input: dataset di tool_calling (user_request con tool e parametri attesi).
+"""
+import argparse
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from src.compaction import COMPACTION_MODES, DEFAULT_COMPACTION
+from src.cost_ledger import BudgetExceededError, CostLedger, estimate_request_cost
+from src.data_loader import load_test_cases
+from src.env import load_dotenv
+from src.inference_client import ModelInferenceClient
+from src.logger import ResultLogger, build_tracker
+from src.metrics import calculate_cost, percentile
+from src.model_config import get_model_config
+from src.results_store import ResultsStore
+from src.task_specs import get_task_spec
+from src.tool_executor import MockToolExecutor
+from src.tracing import enable_tracing, get_tracer, span
+from tasks.tool_calling.metrics import ToolCallingMetricsCalculator
+
+STAGES = ("routing", "tool_calling", "judge", "final_answer")
+
+# Modello di default per ogni stage (sovrascrivibile da riga di comando)
+PIPELINE_MODELS = {
+    "routing": "openai/gpt-oss-20b",
+    "tool_calling": "openai/gpt-oss-20b",
+    "judge": "gpt-4o-mini",
+    "final_answer": "gpt-4o-mini",
+}
+
+# Preferenze utente passate a final_answer (il dataset di input non le contiene)
+DEFAULT_USER_PREFERENCES = {
+    "language": "it",
+    "output_format": "concise",
+    "timezone": "Europe/Rome",
+}
+
+
+class PipelineBenchmarkRunner:
+    """Esegue la pipeline routing -> tool_calling -> judge -> final_answer."""
+
+    def __init__(
+        self,
+        seed: int = 42,
+        sample_size: int = None,
+        shard: str = None,
+        tracking: str = "wandb",
+        wandb_mode: str = "online",
+        cost_ledger: CostLedger = None,
+        compaction: str = DEFAULT_COMPACTION,
+    ):
+        load_dotenv()
+        random.seed(seed)
+        self.seed = seed
+        self.sample_size = sample_size
+        self.shard = shard
+        self.compaction = compaction
+
+        # Una spec per stage: prompt, rendering e parsing delle risposte
+        self.specs = {stage: get_task_spec(stage, compaction=compaction) for stage in STAGES}
+        self.test_cases = load_test_cases(self.specs["tool_calling"].dataset_path,
+                                          sample_size=sample_size, shard=shard, seed=seed)
+        self.tool_executor = MockToolExecutor()
+        self._clients: Dict[str, ModelInferenceClient] = {}
+
+        # Spesa e limiti di budget (condiviso tra gli stage)
+        self.cost_ledger = cost_ledger or CostLedger()
+
+        # Setup logging
+        run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.results_store = ResultsStore()
+        self.result_logger = ResultLogger("results/pipeline", run_timestamp, store=self.results_store)
+        self.tracker = build_tracker(
+            tracking, "verabench-pipeline", self.result_logger.results_dir,
+            store=self.results_store, run_timestamp=run_timestamp, wandb_mode=wandb_mode,
+        )
+        if self.tracker.streams_to_store:
+            # Il sink store scrive già la run nell'archivio
+            self.result_logger.store = None
+
+        print(f"Task: Pipeline end-to-end ({' -> '.join(STAGES)})")
+        print(f"Dataset: {len(self.test_cases)} esempi")
+        print(f"Seed: {seed}\n")
+
+    def _client(self, model_key: str) -> ModelInferenceClient:
+        if model_key not in self._clients:
+            model_config = get_model_config(model_key)
+            self._clients[model_key] = ModelInferenceClient(model_config['id'], provider=model_config['provider'])
+        return self._clients[model_key]
+
+    def _run_stage(self, stage: str, model_key: str, user_prompt: str, temperature: float) -> Dict[str, Any]:
+        """Una chiamata al modello dello stage; restituisce risposta, parsing, latenza, costo e token."""
+        spec = self.specs[stage]
+        model_config = get_model_config(model_key)
+        estimate = estimate_request_cost(model_config, spec.system_prompt, user_prompt, spec.max_new_tokens)
+        with span(f"stage.{stage}", cat="pipeline", model=model_key):
+            with self.cost_ledger.charge(model_key, estimate) as charge:
+                response, latency, token_usage = self._client(model_key).generate(
+                    system_prompt=spec.system_prompt,
+                    user_prompt=user_prompt,
+                    max_new_tokens=spec.max_new_tokens,
+                    temperature=temperature,
+                )
+                cost = calculate_cost(
+                    token_usage['prompt_tokens'],
+                    token_usage['completion_tokens'],
+                    model_config['input_price_per_1m'],
+                    model_config['output_price_per_1m'],
+                )
+                charge.settle(cost, token_usage.get("api_key_id"))
+        return {
+            "model": model_key,
+            "response": response,
+            "parsed": spec.parse_response(response),
+            "latency": latency,
+            "cost": cost,
+            "prompt_tokens": token_usage['prompt_tokens'],
+            "completion_tokens": token_usage['completion_tokens'],
+        }
+
+    def run_example(
+        self,
+        test_case: Dict[str, Any],
+        stage_models: Dict[str, str],
+        executor: ThreadPoolExecutor,
+        temperature: float = 0.0,
+    ) -> Dict[str, Any]:
+        """Esegue la pipeline su una richiesta utente."""
+        user_request = test_case['user_request']
+        start = time.perf_counter()
+
+        # routing e tool_calling dipendono solo dalla richiesta: in parallelo
+        routing_future = executor.submit(
+            self._run_stage, "routing", stage_models["routing"],
+            self.specs["routing"].render_user_prompt(test_case), temperature,
+        )
+        tool_future = executor.submit(
+            self._run_stage, "tool_calling", stage_models["tool_calling"],
+            self.specs["tool_calling"].render_user_prompt(test_case), temperature,
+        )
+        stages = {"routing": routing_future.result(), "tool_calling": tool_future.result()}
+        agent = stages["routing"]["parsed"] or "general_assistant"
+        tool_call = stages["tool_calling"]["parsed"]
+
+        retrieved_context: Dict[str, Any] = {"source": agent}
+        tool_latency = 0.0
+        if tool_call is None:
+            retrieved_context["error"] = "tool call non valido"
+        else:
+            tool_start = time.perf_counter()
+            with span("stage.tool", cat="pipeline", tool=tool_call["tool"]):
+                tool_result = self.tool_executor.execute(tool_call["tool"], tool_call.get("parameters"))
+            tool_latency = time.perf_counter() - tool_start
+
+            judge_case = {
+                "user_request": user_request,
+                "tool_call": {"name": tool_call["tool"], "parameters": tool_call.get("parameters") or {}},
+                "tool_result": tool_result,
+            }
+            stages["judge"] = self._run_stage(
+                "judge", stage_models["judge"], self.specs["judge"].render_user_prompt(judge_case), temperature,
+            )
+            judge_output = stages["judge"]["parsed"]
+            if judge_output and judge_output["approved"]:
+                retrieved_context["data"] = tool_result
+            else:
+                retrieved_context["error"] = "risultato non validato dal judge"
+
+        answer_case = {
+            "user_query": user_request,
+            "user_preferences": DEFAULT_USER_PREFERENCES,
+            "retrieved_context": retrieved_context,
+        }
+        stages["final_answer"] = self._run_stage(
+            "final_answer", stage_models["final_answer"],
+            self.specs["final_answer"].render_user_prompt(answer_case), temperature,
+        )
+
+        critical_path = (
+            max(stages["routing"]["latency"], stages["tool_calling"]["latency"])
+            + tool_latency
+            + stages.get("judge", {}).get("latency", 0.0)
+            + stages["final_answer"]["latency"]
+        )
+        return {
+            "example_id": test_case['id'],
+            "predicted": stages["final_answer"]["response"],
+            "latency": critical_path,
+            "wall_latency": time.perf_counter() - start,
+            "cost": sum(stage["cost"] for stage in stages.values()),
+            "prompt_tokens": sum(stage["prompt_tokens"] for stage in stages.values()),
+            "completion_tokens": sum(stage["completion_tokens"] for stage in stages.values()),
+            "agent": agent,
+            "tool_latency": tool_latency,
+            "approved": "data" in retrieved_context,
+            "stages": {
+                stage: {key: value for key, value in result.items() if key != "parsed"}
+                for stage, result in stages.items()
+            },
+        }
+
+    def compute_metrics(self, examples: List[Dict[str, Any]], tool_metrics) -> Dict[str, Any]:
+        """Latenza e costo per stage e totali, più accuratezza del tool call."""
+        if not examples:
+            return {"total_examples": 0, "total_cost": 0.0, "total_latency": 0.0}
+
+        latencies = sorted(example["latency"] for example in examples)
+        total_cost = sum(example["cost"] for example in examples)
+        final_metrics = {
+            "total_examples": len(examples),
+            "end_to_end_latency_mean": sum(latencies) / len(latencies),
+            "end_to_end_latency_p50": percentile(latencies, 50),
+            "end_to_end_latency_p95": percentile(latencies, 95),
+            "wall_latency_mean": sum(example["wall_latency"] for example in examples) / len(examples),
+            "total_latency": sum(latencies),
+            "total_cost": total_cost,
+            "cost_per_example": total_cost / len(examples),
+            "approval_rate": sum(example["approved"] for example in examples) / len(examples),
+        }
+        for stage in STAGES:
+            results = [example["stages"][stage] for example in examples if stage in example["stages"]]
+            stage_latencies = sorted(result["latency"] for result in results)
+            final_metrics[f"{stage}_calls"] = len(results)
+            final_metrics[f"{stage}_latency_mean"] = sum(stage_latencies) / len(stage_latencies) if results else 0.0
+            final_metrics[f"{stage}_latency_p95"] = percentile(stage_latencies, 95) if results else 0.0
+            final_metrics[f"{stage}_cost"] = sum(result["cost"] for result in results)
+
+        tool_calling_metrics = tool_metrics.get_metrics()
+        final_metrics["tool_selection_accuracy"] = tool_calling_metrics["tool_selection_accuracy"]
+        final_metrics["parameter_correctness"] = tool_calling_metrics["parameter_correctness"]
+        return final_metrics
+
+    def run(self, stage_models: Dict[str, str], temperature: float = 0.0) -> Dict[str, Any]:
+        """Esegue la pipeline su tutto il dataset con i modelli indicati per stage."""
+        label = "+".join(dict.fromkeys(stage_models[stage] for stage in STAGES))
+        print(f"\n{'='*60}")
+        for stage in STAGES:
+            model_config = get_model_config(stage_models[stage])
+            print(f"{stage:<14} {model_config['name']} ({model_config['provider'].upper()})")
+        print(f"{'='*60}\n")
+
+        # Nessuna run se un limite di budget applicabile è già esaurito
+        for model_key in dict.fromkeys(stage_models.values()):
+            self.cost_ledger.check(model_key)
+
+        config = {
+            "task": "pipeline",
+            "model_id": label,
+            "model_name": label,
+            "provider": "+".join(dict.fromkeys(get_model_config(key)['provider'] for key in stage_models.values())),
+            "stage_models": stage_models,
+            "temperature": temperature,
+            "seed": self.seed,
+            "sample_size": self.sample_size,
+            "shard": self.shard,
+            "total_examples": len(self.test_cases),
+            "compaction": self.compaction,
+        }
+        self.tracker.start_run(f"pipeline_{label}", config, model_key=label)
+
+        tool_metrics = ToolCallingMetricsCalculator()
+        examples = []
+        budget_stopped = False
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipeline-stage") as executor:
+            for i, test_case in enumerate(self.test_cases, 1):
+                try:
+                    with span("pipeline.example", cat="pipeline", test_id=test_case['id']):
+                        example = self.run_example(test_case, stage_models, executor, temperature)
+                except BudgetExceededError as e:
+                    print(f"[!] {e}: run interrotta, salvo i risultati parziali")
+                    budget_stopped = True
+                    break
+                except Exception as e:
+                    print(f"ERRORE test {test_case['id']}: {str(e)}")
+                    continue
+
+                tool_stage = example["stages"]["tool_calling"]
+                tool_metrics.add_prediction(
+                    predicted_response=tool_stage["response"],
+                    expected_tool=test_case['expected_tool'],
+                    expected_parameters=test_case['expected_parameters'],
+                    latency=tool_stage["latency"],
+                    cost=tool_stage["cost"],
+                )
+                examples.append(example)
+                self.tracker.log_example(example)
+
+                print(f"\n[{i}/{len(self.test_cases)}] Request: {test_case['user_request'][:60]}...")
+                print(f"    Agent: {example['agent']} | Tool: {tool_stage['response'][:80]!r}")
+                print(f"    Approvato: {example['approved']} | Latenza: {example['latency']:.3f}s | "
+                      f"Costo: ${example['cost']:.6f}")
+                print(f"    Risposta: {example['predicted'][:150]}{'...' if len(example['predicted']) > 150 else ''}")
+
+        final_metrics = self.compute_metrics(examples, tool_metrics)
+        if budget_stopped:
+            final_metrics['budget_stopped'] = True
+        # Throttling dei controller di concorrenza adattiva, sommato sui modelli delle fasi
+        controllers = [client.concurrency_metrics() for client in self._clients.values()]
+        final_metrics["throttle_events"] = sum(state.get("throttle_events", 0) for state in controllers)
+        final_metrics["ratelimit_wait_seconds"] = sum(state.get("ratelimit_wait_seconds", 0.0) for state in controllers)
+
+        # Log tracking (W&B / JSONL / archivio)
+        self.tracker.log_metrics(final_metrics)
+        self.tracker.finish_run()
+
+        results = {"config": config, "metrics": final_metrics}
+        with span("logging.save_results", cat="logging"):
+            self.result_logger.save_results(results, label, examples=examples)
+
+        self.print_summary(final_metrics)
+        return results
+
+    @staticmethod
+    def print_summary(final_metrics: Dict[str, Any]):
+        """Latenza e costo per stage e totali."""
+        if not final_metrics.get("total_examples"):
+            print("\nNessun esempio completato")
+            return
+        print(f"\n{'='*60}")
+        print("RISULTATI PIPELINE:")
+        print(f"{'Stage':<14} {'Chiamate':>8} {'Lat. media':>11} {'Lat. p95':>10} {'Costo':>11}")
+        for stage in STAGES:
+            print(f"{stage:<14} {final_metrics[f'{stage}_calls']:>8} {final_metrics[f'{stage}_latency_mean']:>10.3f}s "
+                  f"{final_metrics[f'{stage}_latency_p95']:>9.3f}s ${final_metrics[f'{stage}_cost']:>10.6f}")
+        print(f"End-to-end: media {final_metrics['end_to_end_latency_mean']:.3f}s | "
+              f"p50 {final_metrics['end_to_end_latency_p50']:.3f}s | p95 {final_metrics['end_to_end_latency_p95']:.3f}s")
+        print(f"Total Cost: ${final_metrics['total_cost']:.6f} (${final_metrics['cost_per_example']:.6f}/esempio)")
+        print(f"Tool Selection Accuracy: {final_metrics['tool_selection_accuracy']:.2%}")
+        print(f"Approval Rate (judge): {final_metrics['approval_rate']:.2%}")
+        print(f"{'='*60}\n")
+
+
+def main():
+    """Funzione principale."""
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end della pipeline")
+    parser.add_argument("--model", type=str, default=None,
+                        help="Modello per tutti gli stage (es. mock); sovrascritto dalle opzioni per stage")
+    for stage in STAGES:
+        parser.add_argument(f"--{stage.replace('_', '-')}-model", type=str, default=None,
+                            help=f"Modello dello stage {stage} (default: {PIPELINE_MODELS[stage]})")
+    parser.add_argument("--sample", type=int, default=None,
+                        help="Campione stratificato di N esempi dal dataset di tool_calling")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="Esegui solo lo shard i/N del dataset (0-based, es. 0/4)")
+    parser.add_argument("--tracking", type=str, default="wandb",
+                        help="Sink di tracking separati da virgola: wandb, jsonl, store, none")
+    parser.add_argument("--wandb-offline", action="store_true",
+                        help="W&B in modalità offline (sincronizzare poi con: python -m src.logger sync)")
+    parser.add_argument("--compaction", choices=COMPACTION_MODES, default=DEFAULT_COMPACTION,
+                        help="Serializzazione del contesto JSON nei prompt di judge e final_answer")
+    parser.add_argument("--budget-run", type=float, default=None,
+                        help="Limite di spesa in USD per questa esecuzione (tutti gli stage)")
+    parser.add_argument("--budget-model", type=float, default=None,
+                        help="Limite di spesa in USD per ciascun modello")
+    parser.add_argument("--budget-day", type=float, default=None,
+                        help="Limite di spesa giornaliero in USD, condiviso tra processi (results/cost_ledger.json)")
+    parser.add_argument("--trace", action="store_true",
+                        help="Registra gli span per esempio e salva trace.json (Chrome trace / Perfetto)")
+    args = parser.parse_args()
+
+    if args.trace:
+        enable_tracing()
+    stage_models = {
+        stage: getattr(args, f"{stage}_model") or args.model or PIPELINE_MODELS[stage]
+        for stage in STAGES
+    }
+
+    runner = PipelineBenchmarkRunner(
+        sample_size=args.sample,
+        shard=args.shard,
+        tracking=args.tracking,
+        wandb_mode="offline" if args.wandb_offline else "online",
+        cost_ledger=CostLedger(run_budget=args.budget_run, model_budget=args.budget_model,
+                               daily_budget=args.budget_day),
+        compaction=args.compaction,
+    )
+    try:
+        runner.run(stage_models)
+    except Exception as e:
+        print(f"ERRORE pipeline: {str(e)}")
+    # Consegna gli eventi di tracking rimasti in coda
+    runner.tracker.close()
+    if args.trace:
+        trace_path = get_tracer().write(runner.result_logger.results_dir / "trace.json")
+        print(f"Trace salvato in: {trace_path} (apribile con ui.perfetto.dev o chrome://tracing)")
+
+    spend = runner.cost_ledger.summary()
+    print(f"Spesa: ${spend['run_spent']:.4f} (oggi: ${spend['day_spent']:.4f})")
+    print(f"Risultati: {runner.result_logger.results_dir}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,14 +6,25 @@ Testa i modelli selezionati sulla capacità di selezionare tool e parametri corr
 import random
 from datetime import datetime
 from typing import List, Dict, Any
-from dotenv import load_dotenv
-from src.data_loader import load_dataset, load_prompt
+from src.env import load_dotenv
+from src.data_loader import load_prompt, load_test_cases
 from src.model_config import get_model_config
 from src.inference_client import ModelInferenceClient
 from src.metrics import calculate_cost
-from src.logger import ResultLogger, WandBLogger
-from src.result_aggregator import aggregate_task_results
-from src.bubble_visualizer import visualize_results
+from src.logger import ResultLogger, build_tracker
+from src.result_aggregator import aggregate_store_results
+from src.results_store import ResultsStore
+from src.tracing import enable_tracing, get_tracer, span
+from src.profiling import PROFILE_MODES, profile_run
+from src.hedging import HedgingPolicy, hedging_metrics, ledger_recorder
+from src.incremental import load_reference, record_hashes
+from src.cost_ledger import BudgetExceededError, CostLedger, estimate_request_cost
+from src.planner import plan_task, print_plan
+from src.cascade import CASCADE_SIGNALS, DEFAULT_SIGNALS, cascade_cli
+from src.packing import packing_cli
+from src.batch import BATCH_BACKENDS, DEFAULT_POLL_INTERVAL, batch_cli
+from src.task_specs import get_task_spec
+from src.bubble_visualizer import visualize_results, spawn_background_render
 from tasks.tool_calling.metrics import ToolCallingMetricsCalculator
 
 # PHASE 1: Screening iniziale su dataset ridotto (dataset_short.json)
@@ -24,6 +35,9 @@ MODELS_PHASE_1 = [
     # Aggiungere qui tutti i modelli da testare in fase 1
 ]
 
+# Dimensione del campione stratificato per Phase 1 (sostituisce dataset_short.json)
+PHASE_1_SAMPLE_SIZE = 10
+
 # PHASE 2: Valutazione completa su dataset intero (dataset.json)
 MODELS_TO_TEST = [
     "openai/gpt-oss-20b"
@@ -33,21 +47,50 @@ MODELS_TO_TEST = [
 class ToolCallingBenchmarkRunner:
     """Esegue il benchmark per la task di Tool Calling."""
 
-    def __init__(self, seed: int = 42, use_short_dataset: bool = False):
+    def __init__(
+        self,
+        seed: int = 42,
+        use_short_dataset: bool = False,
+        sample_size: int = None,
+        shard: str = None,
+        tracking: str = "wandb",
+        wandb_mode: str = "online",
+        cost_ledger: CostLedger = None,
+        hedge_percentile: float = None,
+        incremental: str = None,
+    ):
         load_dotenv()
         random.seed(seed)
         self.seed = seed
         self.use_short_dataset = use_short_dataset
+        self.sample_size = sample_size
+        self.shard = shard
 
         # Carica dataset e prompt dalla cartella task
-        dataset_file = "tasks/tool_calling/dataset_short.json" if use_short_dataset else "tasks/tool_calling/dataset.json"
-        self.test_cases = load_dataset(dataset_file)
+        # Il campionamento stratificato parte sempre dal dataset completo
+        use_short = use_short_dataset and not sample_size
+        dataset_file = "tasks/tool_calling/dataset_short.json" if use_short else "tasks/tool_calling/dataset.json"
+        self.test_cases = load_test_cases(dataset_file, sample_size=sample_size, shard=shard, seed=seed)
         self.system_prompt = load_prompt("tasks/tool_calling/prompt.json")
         
+        # Spesa e limiti di budget (condiviso tra modelli e persistito per il limite giornaliero)
+        self.cost_ledger = cost_ledger or CostLedger()
+        # Hedging: duplicato oltre questo percentile delle latenze osservate (None = disattivato)
+        self.hedge_percentile = hedge_percentile
+        # Run incrementale: run_id di riferimento o "latest" (None = esegue tutti gli esempi)
+        self.incremental = incremental
+        
         # Setup logging
         run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.result_logger = ResultLogger("results/tool_calling", run_timestamp)
-        self.wandb_logger = WandBLogger("verabench-tool-calling")
+        self.results_store = ResultsStore()
+        self.result_logger = ResultLogger("results/tool_calling", run_timestamp, store=self.results_store)
+        self.tracker = build_tracker(
+            tracking, "verabench-tool-calling", self.result_logger.results_dir,
+            store=self.results_store, run_timestamp=run_timestamp, wandb_mode=wandb_mode,
+        )
+        if self.tracker.streams_to_store:
+            # Il sink store scrive già la run nell'archivio
+            self.result_logger.store = None
         
         print(f"Task: Tool Calling")
         print(f"Dataset: {len(self.test_cases)} esempi")
@@ -69,8 +112,16 @@ class ToolCallingBenchmarkRunner:
         print(f"Modello: {model_name} ({provider.upper()})")
         print(f"{'='*60}\n")
         
+        # Nessuna run se un limite di budget applicabile è già esaurito
+        self.cost_ledger.check(model_key)
+        
         # Inizializza
-        client = ModelInferenceClient(model_id, provider=provider)
+        hedging = HedgingPolicy(
+            self.hedge_percentile,
+            # Le risposte scartate sono pagate: il loro costo va nel ledger quando terminano
+            on_discarded=ledger_recorder(self.cost_ledger, model_key, model_config),
+        ) if self.hedge_percentile else None
+        client = ModelInferenceClient(model_id, provider=provider, hedging=hedging)
         metrics = ToolCallingMetricsCalculator()
         
         # Configura W&B
@@ -82,58 +133,100 @@ class ToolCallingBenchmarkRunner:
             "max_new_tokens": max_new_tokens,
             "temperature": temperature,
             "seed": self.seed,
+            "sample_size": self.sample_size,
+            "shard": self.shard,
             "total_examples": len(self.test_cases),
+            "hedge_percentile": self.hedge_percentile,
         }
-        self.wandb_logger.start_run(f"tool_calling_{model_key}", config)
+        self.tracker.start_run(f"tool_calling_{model_key}", config, model_key=model_key)
         
         # Esegui inferenza
+        examples = []
+        budget_stopped = False
+        # Con --incremental riusa i risultati degli esempi con hash invariati
+        reference = load_reference(self.results_store, "tool_calling", model_key, self.incremental) if self.incremental else None
         for i, test_case in enumerate(self.test_cases, 1):
             try:
-                predicted_response, latency, token_usage = client.generate(
-                    system_prompt=self.system_prompt,
-                    user_prompt=test_case['user_request'],
-                    max_new_tokens=max_new_tokens,
-                    temperature=temperature,
-                )
-                
-                cost = calculate_cost(
-                    token_usage['prompt_tokens'],
-                    token_usage['completion_tokens'],
-                    model_config['input_price_per_1m'],
-                    model_config['output_price_per_1m'],
-                )
+                hashes = record_hashes(test_case, self.system_prompt, test_case['user_request'], model_config, max_new_tokens, temperature)
+                reused = reference.reuse(test_case['id'], hashes, model_config) if reference else None
+                if reused is not None:
+                    # Prompt e modello invariati rispetto alla run di riferimento: nessuna chiamata
+                    predicted_response, latency, cost, token_usage = reused
+                else:
+                    # Riserva la stima pessimistica prima della chiamata, poi registra il costo reale
+                    estimate = estimate_request_cost(model_config, self.system_prompt, test_case['user_request'], max_new_tokens)
+                    with self.cost_ledger.charge(model_key, estimate) as charge:
+                        predicted_response, latency, token_usage = client.generate(
+                            system_prompt=self.system_prompt,
+                            user_prompt=test_case['user_request'],
+                            max_new_tokens=max_new_tokens,
+                            temperature=temperature,
+                        )
+                        cost = calculate_cost(
+                            token_usage['prompt_tokens'],
+                            token_usage['completion_tokens'],
+                            model_config['input_price_per_1m'],
+                            model_config['output_price_per_1m'],
+                        )
+                        charge.settle(cost, token_usage.get("api_key_id"))
                 
                 # Print risposta modello
                 print(f"\n[{i}/{len(self.test_cases)}] Request: {test_case['user_request'][:60]}...")
                 print(f"    Expected Tool: {test_case['expected_tool']}")
                 print(f"    Model Response:\n{predicted_response[:200]}{'...' if len(predicted_response) > 200 else ''}")
                 
-                metrics.add_prediction(
-                    predicted_response=predicted_response,
-                    expected_tool=test_case['expected_tool'],
-                    expected_parameters=test_case['expected_parameters'],
-                    latency=latency,
-                    cost=cost,
-                )
+                with span("metrics.add_prediction", cat="metrics"):
+                    metrics.add_prediction(
+                        predicted_response=predicted_response,
+                        expected_tool=test_case['expected_tool'],
+                        expected_parameters=test_case['expected_parameters'],
+                        latency=latency,
+                        cost=cost,
+                    )
+                with span("logging.log_example", cat="logging"):
+                    examples.append({
+                        "example_id": test_case['id'],
+                        "predicted": predicted_response,
+                        "latency": latency,
+                        "cost": cost,
+                        "prompt_tokens": token_usage['prompt_tokens'],
+                        "completion_tokens": token_usage['completion_tokens'],
+                        **hashes,
+                    })
+                    self.tracker.log_example(examples[-1])
                 
                 if i % 10 == 0:
                     current_metrics = metrics.get_metrics()
                     print(f"  → Tool Acc: {current_metrics['tool_selection_accuracy']:.3f} | Param Correct: {current_metrics['parameter_correctness']:.3f}\n")
                 
+            except BudgetExceededError as e:
+                print(f"[!] {e}: run interrotta, salvo i risultati parziali")
+                budget_stopped = True
+                break
             except Exception as e:
                 print(f"ERRORE test {test_case['id']}: {str(e)}")
                 continue
         
         # Metriche finali
         final_metrics = metrics.get_metrics()
+        if budget_stopped:
+            final_metrics['budget_stopped'] = True
+        if reference is not None:
+            final_metrics.update(reference.metrics())
+            print(f"[*] Incrementale rispetto alla run {reference.run_id}: "
+                  f"{reference.reused} esempi riutilizzati, {reference.rerun} rieseguiti")
+        # Stato del controller di concorrenza adattiva (limite, eventi di throttling, attesa)
+        final_metrics.update(client.concurrency_metrics())
+        final_metrics.update(hedging_metrics(client, model_config))
         
-        # Log W&B
-        self.wandb_logger.log_metrics(final_metrics)
-        self.wandb_logger.finish_run()
+        # Log tracking (W&B / JSONL / archivio)
+        self.tracker.log_metrics(final_metrics)
+        self.tracker.finish_run()
         
         # Salva localmente
         results = {"config": config, "metrics": final_metrics}
-        self.result_logger.save_results(results, model_key)
+        with span("logging.save_results", cat="logging"):
+            self.result_logger.save_results(results, model_key, examples=examples)
         
         # Stampa riepilogo
         print(f"\n{'='*60}")
@@ -170,35 +263,129 @@ def main():
 
     parser = argparse.ArgumentParser(description="Benchmark Tool Calling")
     parser.add_argument("--phase1", action="store_true", help="Esegui Phase 1: screening su dataset ridotto")
+    parser.add_argument("--sample", type=int, default=None,
+                        help="Campione stratificato (category/complexity) di N esempi dal dataset completo")
+    parser.add_argument("--shard", type=str, default=None,
+                        help="Esegui solo lo shard i/N del dataset (0-based, es. 0/4)")
+    parser.add_argument("--charts", choices=["inline", "background", "skip"], default="inline",
+                        help="Grafici: a fine run (inline), in un processo separato dopo l'uscita (background) o mai (skip)")
+    parser.add_argument("--preview-charts", action="store_true",
+                        help="Grafici in anteprima a bassa risoluzione")
+    parser.add_argument("--tracking", type=str, default="wandb",
+                        help="Sink di tracking separati da virgola: wandb, jsonl, store, none")
+    parser.add_argument("--wandb-offline", action="store_true",
+                        help="W&B in modalità offline (sincronizzare poi con: python -m src.logger sync)")
+    parser.add_argument("--models", type=str, default=None,
+                        help="Chiavi dei modelli separate da virgola (sostituisce la lista della fase, es. mock)")
+    parser.add_argument("--profile", choices=PROFILE_MODES, default=None,
+                        help="Profila ogni run: cprofile (pstats), sampling (folded stacks) o tracemalloc (memoria)")
+    parser.add_argument("--budget-run", type=float, default=None,
+                        help="Limite di spesa in USD per questa esecuzione (tutti i modelli)")
+    parser.add_argument("--budget-model", type=float, default=None,
+                        help="Limite di spesa in USD per ciascun modello")
+    parser.add_argument("--budget-day", type=float, default=None,
+                        help="Limite di spesa giornaliero in USD, condiviso tra processi (results/cost_ledger.json)")
+    parser.add_argument("--hedge", type=float, default=None,
+                        help="Hedging: duplica le richieste più lente di questo percentile delle latenze (es. 95)")
+    parser.add_argument("--incremental", nargs="?", const="latest", default=None, metavar="RUN_ID",
+                        help="Riesegue solo gli esempi con prompt o modello cambiati rispetto alla run di riferimento "
+                             "(default: l'ultima del modello) e riusa gli altri risultati")
+    parser.add_argument("--trace", action="store_true",
+                        help="Registra gli span per esempio e salva trace.json (Chrome trace / Perfetto)")
+    parser.add_argument("--cascade", type=str, default=None,
+                        help="Valuta la cascata ECONOMICO,FORTE (es. openai/gpt-oss-20b,gpt-4o) con sweep delle soglie")
+    parser.add_argument("--cascade-signals", type=str, default=DEFAULT_SIGNALS,
+                        help=f"Segnali di confidenza per l'escalation: {', '.join(CASCADE_SIGNALS)}")
+    parser.add_argument("--pack-sizes", type=str, default=None,
+                        help="Confronta richieste singole e impacchettate per dimensioni K (es. 1,5,10,25)")
+    parser.add_argument("--batch", nargs="?", const="provider", choices=BATCH_BACKENDS, default=None,
+                        help="Esegui tramite Batch API (prezzo scontato); 'local' usa lo stand-in su file")
+    parser.add_argument("--batch-poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="Secondi tra due poll dello stato del batch")
+    parser.add_argument("--batch-timeout", type=float, default=None,
+                        help="Smetti di attendere dopo N secondi (rilanciando il comando il batch viene ripreso)")
+    parser.add_argument("--plan", action="store_true",
+                        help="Dry run: stima token, costo e tempo per modello senza chiamate API")
+    parser.add_argument("--plan-concurrency", type=int, default=1,
+                        help="Richieste in parallelo ipotizzate dal piano (default: 1, come i runner)")
     args = parser.parse_args()
 
+    if args.trace:
+        enable_tracing()
+    selected_models = [key.strip() for key in args.models.split(",") if key.strip()] if args.models else None
+
     if args.phase1:
-        models = MODELS_PHASE_1
+        models = selected_models or MODELS_PHASE_1
         use_short = True
+        sample_size = args.sample or PHASE_1_SAMPLE_SIZE
         phase_name = "PHASE 1 - SCREENING"
         print("="*60)
         print(f"{phase_name}")
-        print("Dataset: dataset_short.json (10 esempi)")
+        print(f"Dataset: dataset.json (campione stratificato di {sample_size} esempi)")
         print(f"Modelli da testare: {len(models)}")
+        if args.shard:
+            print(f"Shard: {args.shard}")
         print("="*60 + "\n")
     else:
-        models = MODELS_TO_TEST
+        models = selected_models or MODELS_TO_TEST
         use_short = False
+        sample_size = args.sample
         phase_name = "PHASE 2 - VALUTAZIONE COMPLETA"
         print("="*60)
         print(f"{phase_name}")
-        print("Dataset: dataset.json (completo)")
+        print("Dataset: dataset.json (completo)" if not sample_size else f"Dataset: dataset.json (campione stratificato di {sample_size} esempi)")
         print(f"Modelli da testare: {len(models)}")
+        if args.shard:
+            print(f"Shard: {args.shard}")
         print("="*60 + "\n")
 
-    runner = ToolCallingBenchmarkRunner(use_short_dataset=use_short)
+    if args.cascade:
+        test_cases = get_task_spec("tool_calling").load_test_cases(use_short, sample_size, args.shard)
+        cascade_cli("tool_calling", args.cascade, args.cascade_signals, test_cases,
+                    cost_ledger=CostLedger(run_budget=args.budget_run, model_budget=args.budget_model,
+                                           daily_budget=args.budget_day))
+        return
+
+    if args.pack_sizes:
+        test_cases = get_task_spec("tool_calling").load_test_cases(use_short, sample_size, args.shard)
+        packing_cli("tool_calling", models, args.pack_sizes, test_cases,
+                    cost_ledger=CostLedger(run_budget=args.budget_run, model_budget=args.budget_model,
+                                           daily_budget=args.budget_day))
+        return
+
+    if args.batch:
+        test_cases = get_task_spec("tool_calling").load_test_cases(use_short, sample_size, args.shard)
+        batch_cli("tool_calling", models, args.batch, test_cases,
+                  run_config={"seed": 42, "sample_size": sample_size, "shard": args.shard},
+                  poll_interval=args.batch_poll_interval, timeout=args.batch_timeout,
+                  cost_ledger=CostLedger(run_budget=args.budget_run, model_budget=args.budget_model,
+                                         daily_budget=args.budget_day))
+        return
+
+    if args.plan:
+        print_plan(plan_task("tool_calling", models, use_short_dataset=use_short, sample_size=sample_size,
+                             shard=args.shard, concurrency=args.plan_concurrency))
+        return
+
+    runner = ToolCallingBenchmarkRunner(
+        use_short_dataset=use_short,
+        sample_size=sample_size,
+        shard=args.shard,
+        tracking=args.tracking,
+        wandb_mode="offline" if args.wandb_offline else "online",
+        cost_ledger=CostLedger(run_budget=args.budget_run, model_budget=args.budget_model,
+                               daily_budget=args.budget_day),
+        hedge_percentile=args.hedge,
+        incremental=args.incremental,
+    )
 
     # Esegui solo i modelli selezionati
     def run_selected_models():
         results = {}
         for model_key in models:
             try:
-                result = runner.run_single_model(model_key)
+                with profile_run(args.profile, runner.result_logger.results_dir, model_key):
+                    result = runner.run_single_model(model_key)
                 results[model_key] = result
             except Exception as e:
                 print(f"ERRORE {model_key}: {str(e)}")
@@ -206,19 +393,35 @@ def main():
         return results
 
     all_results = run_selected_models()
+    # Consegna gli eventi di tracking rimasti in coda
+    runner.tracker.close()
+    if args.trace:
+        trace_path = get_tracer().write(runner.result_logger.results_dir / "trace.json")
+        print(f"Trace salvato in: {trace_path} (apribile con ui.perfetto.dev o chrome://tracing)")
 
     print("\n" + "="*60)
     print(f"{phase_name} COMPLETATO")
     print(f"Modelli testati: {len(all_results)}")
+    spend = runner.cost_ledger.summary()
+    print(f"Spesa: ${spend['run_spent']:.4f} (oggi: ${spend['day_spent']:.4f})")
     print(f"Risultati: {runner.result_logger.results_dir}/")
     print("="*60)
 
     # Aggrega e visualizza automaticamente
     if all_results:
-        print("\n[*] Aggregando risultati e generando visualizzazioni...")
-        aggregated = aggregate_task_results(runner.result_logger.results_dir, "tool_calling")
-        if aggregated:
-            visualize_results(aggregated, "tool_calling", runner.result_logger.results_dir / "visualizations")
-
+        visualizations_dir = runner.result_logger.results_dir / "visualizations"
+        if args.charts == "skip":
+            print("\n[*] Grafici saltati. Per generarli:")
+            print(f"    python -m src.bubble_visualizer --task tool_calling --store {runner.results_store.db_path} "
+                  f"--run {runner.result_logger.run_timestamp} --output-dir {visualizations_dir}")
+        elif args.charts == "background":
+            spawn_background_render("tool_calling", runner.results_store.db_path, runner.result_logger.run_timestamp,
+                                    visualizations_dir, preview=args.preview_charts)
+            print(f"\n[*] Grafici in generazione in background: {visualizations_dir}")
+        else:
+            print("\n[*] Aggregando risultati e generando visualizzazioni...")
+            aggregated = aggregate_store_results(runner.results_store, "tool_calling", runner.result_logger.run_timestamp)
+            if aggregated:
+                visualize_results(aggregated, "tool_calling", visualizations_dir, preview=args.preview_charts)
 if __name__ == "__main__":
     main()
@@ -0,0 +1,518 @@
+"""
+Esecuzione tramite Batch API (OpenAI, TogetherAI) con stand-in locale su file.
+
+Per le run di phase 2 non sensibili alla latenza le Batch API costano circa
+la metà e hanno limiti di throughput molto più alti. Per ogni (task, modello)
+tutte le richieste sono scritte in un file JSONL nel formato batch di OpenAI
+(custom_id = "<id del test case>#<attempt>", con più attempt per i test di
+consistenza della task judge), il file viene inviato e il batch interrogato
+fino al completamento. I risultati sono associati ai test case tramite
+custom_id, valutati con i calcolatori di metriche della task e salvati come
+una run normale (results/<task>/<timestamp>/ e archivio SQLite) con
+execution="batch" e costo scontato (calculate_cost(..., batch=True)).
+
+Prima dell'invio il CostLedger riserva la somma delle stime delle richieste
+al prezzo batch: un limite --budget-* che verrebbe superato blocca l'invio.
+
+Lo stato del batch (id, backend, file di input) è salvato in
+results/batch/<task>/: rilanciando lo stesso comando dopo un'interruzione o
+un --batch-timeout (--timeout) il batch viene ripreso invece di essere reinviato.
+
+Il backend "local" è uno stand-in su file per provare tutto il flusso
+offline: al primo poll esegue le richieste con ModelInferenceClient (con il
+modello mock nessuna chiamata esterna) e scrive l'output nel formato batch.
+
+    python main_routing.py --batch --models gpt-4o-mini
+    python main_routing.py --batch local --models mock
+    python -m src.batch --task routing --model mock --backend local
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.compaction import COMPACTION_MODES, DEFAULT_COMPACTION
+from src.cost_ledger import CostLedger, estimate_request_cost
+from src.env import load_dotenv
+from src.inference_client import ModelInferenceClient
+from src.logger import ResultLogger
+from src.metrics import BATCH_PRICE_FACTOR, calculate_cost
+from src.model_config import get_model_config
+from src.results_store import ResultsStore
+from src.task_specs import TaskSpec, build_run_config, get_task_spec
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+BATCH_BACKENDS = ("provider", "local")
+# Provider con Batch API compatibile con il formato OpenAI
+BATCH_PROVIDERS = {
+    "openai": None,
+    "togetherai": "https://api.together.xyz/v1",
+}
+BATCH_API_KEYS = {"openai": "OPENAI_API_KEY", "togetherai": "TOGETHERAI_API_KEY"}
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+DEFAULT_POLL_INTERVAL = 30.0
+BATCH_DIR = "results/batch"
+
+
+def batch_custom_id(example_id: Any, attempt: int) -> str:
+    return f"{example_id}#{attempt}"
+
+
+def build_batch_requests(
+    spec: TaskSpec,
+    model_config: Dict[str, Any],
+    test_cases: List[Dict[str, Any]],
+    temperature: float = 0.0,
+) -> List[Dict[str, Any]]:
+    """Una riga JSONL per esecuzione di ogni test case (spec.runs_for) nel formato batch di OpenAI."""
+    return [
+        {
+            "custom_id": batch_custom_id(test_case['id'], attempt),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {
+                "model": model_config['id'],
+                "messages": [
+                    {"role": "system", "content": spec.system_prompt},
+                    {"role": "user", "content": spec.render_user_prompt(test_case)},
+                ],
+                "max_tokens": spec.max_new_tokens,
+                "temperature": temperature,
+            },
+        }
+        for test_case in test_cases
+        for attempt in range(spec.runs_for(test_case))
+    ]
+
+
+def estimate_batch_cost(model_config: Dict[str, Any], requests: List[Dict[str, Any]]) -> float:
+    """Somma delle stime pessimistiche delle richieste al prezzo batch."""
+    total = 0.0
+    for request in requests:
+        body = request["body"]
+        messages = {message["role"]: message["content"] for message in body["messages"]}
+        total += estimate_request_cost(model_config, messages.get("system", ""), messages.get("user", ""),
+                                       body["max_tokens"])
+    return total * BATCH_PRICE_FACTOR
+
+
+def write_jsonl(rows: List[Dict[str, Any]], path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+def parse_batch_output(text: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Risultati per custom_id dal file di output del batch.
+
+    Returns:
+        {custom_id: {"response", "prompt_tokens", "completion_tokens"}} oppure
+        {custom_id: {"error"}} per le richieste fallite
+    """
+    outputs = {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        response = row.get("response") or {}
+        body = response.get("body") or {}
+        if row.get("error") or response.get("status_code", 200) != 200 or not body.get("choices"):
+            outputs[row["custom_id"]] = {"error": row.get("error") or body.get("error") or response.get("status_code")}
+            continue
+        usage = body.get("usage") or {}
+        outputs[row["custom_id"]] = {
+            "response": (body["choices"][0]["message"].get("content") or "").strip(),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+        }
+    return outputs
+
+
+class ProviderBatchBackend:
+    """Batch API di OpenAI / TogetherAI (files + batches dell'SDK openai)."""
+
+    name = "provider"
+
+    def __init__(self, provider: str):
+        if provider not in BATCH_PROVIDERS:
+            raise ValueError(f"Batch API non disponibile per il provider '{provider}'. "
+                             f"Disponibili: {', '.join(BATCH_PROVIDERS)} (oppure --batch local)")
+        api_key = os.getenv(BATCH_API_KEYS[provider])
+        if not api_key:
+            raise ValueError(f"{BATCH_API_KEYS[provider]} non trovato nel file .env")
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key, base_url=BATCH_PROVIDERS[provider])
+
+    def submit(self, input_path: Path) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        return batch.id
+
+    def poll(self, batch_id: str) -> Dict[str, Any]:
+        batch = self.client.batches.retrieve(batch_id)
+        counts = getattr(batch, "request_counts", None)
+        return {
+            "status": batch.status,
+            "output_file_id": getattr(batch, "output_file_id", None),
+            "completed": getattr(counts, "completed", None),
+            "failed": getattr(counts, "failed", None),
+            "total": getattr(counts, "total", None),
+        }
+
+    def fetch(self, batch_id: str, info: Dict[str, Any]) -> str:
+        if not info.get("output_file_id"):
+            return ""
+        return self.client.files.content(info["output_file_id"]).text
+
+
+class LocalBatchBackend:
+    """
+    Stand-in locale della Batch API basato su file.
+
+    submit copia l'input in <root>/<batch_id>/; il primo poll dopo
+    completion_delay secondi esegue le richieste in sequenza con il provider
+    del modello e scrive output.jsonl nel formato batch di OpenAI.
+    """
+
+    name = "local"
+
+    def __init__(self, provider: str, root: str = f"{BATCH_DIR}/local", completion_delay: float = 0.0):
+        self.provider = provider
+        self.root = Path(root)
+        self.completion_delay = completion_delay
+
+    def _status_path(self, batch_id: str) -> Path:
+        return self.root / batch_id / "status.json"
+
+    def _write_status(self, batch_id: str, status: Dict[str, Any]):
+        with open(self._status_path(batch_id), "w", encoding="utf-8") as f:
+            json.dump(status, f, indent=2)
+
+    def submit(self, input_path: Path) -> str:
+        batch_id = f"local_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        (self.root / batch_id).mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(input_path, self.root / batch_id / "input.jsonl")
+        self._write_status(batch_id, {"status": "validating", "created_at": time.time()})
+        return batch_id
+
+    def _process(self, batch_id: str) -> Dict[str, Any]:
+        with open(self.root / batch_id / "input.jsonl", "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+
+        clients: Dict[str, ModelInferenceClient] = {}
+        rows = []
+        for request in requests:
+            body = request["body"]
+            messages = {message["role"]: message["content"] for message in body["messages"]}
+            try:
+                client = clients.setdefault(body["model"], ModelInferenceClient(body["model"], provider=self.provider))
+                response, _, token_usage = client.generate(
+                    system_prompt=messages.get("system", ""),
+                    user_prompt=messages.get("user", ""),
+                    max_new_tokens=body.get("max_tokens", 50),
+                    temperature=body.get("temperature", 0.0),
+                )
+                rows.append({
+                    "id": f"req_{uuid.uuid4().hex[:12]}",
+                    "custom_id": request["custom_id"],
+                    "response": {
+                        "status_code": 200,
+                        "body": {
+                            "choices": [{"index": 0, "message": {"role": "assistant", "content": response}}],
+                            "usage": token_usage,
+                        },
+                    },
+                    "error": None,
+                })
+            except Exception as e:
+                rows.append({"id": f"req_{uuid.uuid4().hex[:12]}", "custom_id": request["custom_id"],
+                             "response": None, "error": {"message": str(e)}})
+
+        write_jsonl(rows, self.root / batch_id / "output.jsonl")
+        failed = sum(1 for row in rows if row["error"])
+        return {"status": "completed", "completed": len(rows) - failed, "failed": failed, "total": len(rows)}
+
+    def poll(self, batch_id: str) -> Dict[str, Any]:
+        with open(self._status_path(batch_id), "r", encoding="utf-8") as f:
+            status = json.load(f)
+        if status["status"] not in TERMINAL_STATUSES and time.time() - status["created_at"] >= self.completion_delay:
+            status.update(self._process(batch_id))
+            self._write_status(batch_id, status)
+        return status
+
+    def fetch(self, batch_id: str, info: Dict[str, Any]) -> str:
+        output_path = self.root / batch_id / "output.jsonl"
+        return output_path.read_text(encoding="utf-8") if output_path.exists() else ""
+
+
+def get_batch_backend(backend: str, provider: str):
+    if backend == "local":
+        return LocalBatchBackend(provider)
+    if backend == "provider":
+        return ProviderBatchBackend(provider)
+    raise ValueError(f"Backend batch '{backend}' non supportato. Disponibili: {', '.join(BATCH_BACKENDS)}")
+
+
+class BatchRunner:
+    """Invia, riprende e valuta il batch di una task per un modello."""
+
+    def __init__(
+        self,
+        task: str,
+        model_key: str,
+        backend: str = "provider",
+        compaction: str = DEFAULT_COMPACTION,
+        temperature: float = 0.0,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        timeout: Optional[float] = None,
+        state_dir: str = BATCH_DIR,
+        cost_ledger: Optional[CostLedger] = None,
+    ):
+        self.task = task
+        self.model_key = model_key
+        self.model_config = get_model_config(model_key)
+        self.spec = get_task_spec(task, compaction=compaction)
+        self.compaction = compaction
+        self.temperature = temperature
+        self.backend = get_batch_backend(backend, self.model_config['provider'])
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.state_dir = Path(state_dir) / task
+        self.cost_ledger = cost_ledger or CostLedger()
+
+    def _state_path(self, requests: List[Dict[str, Any]]) -> Path:
+        # Stesso modello, backend e richieste -> stesso stato (ripresa)
+        digest = hashlib.sha1(
+            json.dumps([self.backend.name, requests], sort_keys=True, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()[:12]
+        return self.state_dir / f"{self.model_key.replace('/', '_')}_{digest}.json"
+
+    @staticmethod
+    def _save_state(path: Path, state: Dict[str, Any]):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+
+    def resume(self, requests: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Stato del batch già inviato e in corso per queste richieste, se esiste."""
+        state_path = self._state_path(requests)
+        if not state_path.exists():
+            return None
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        # Un batch già valutato o non riuscito non si riprende: si invia di nuovo
+        if state["status"] in ("failed", "expired", "cancelled", "scored"):
+            return None
+        print(f"[*] Riprendo il batch {state['batch_id']} ({state['status']})")
+        state["state_path"] = str(state_path)
+        return state
+
+    def submit(self, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Invia un nuovo batch e ne salva lo stato."""
+        state_path = self._state_path(requests)
+        input_path = state_path.with_suffix(".input.jsonl")
+        write_jsonl(requests, input_path)
+        batch_id = self.backend.submit(input_path)
+        state = {
+            "batch_id": batch_id,
+            "backend": self.backend.name,
+            "task": self.task,
+            "model_key": self.model_key,
+            "input_file": str(input_path),
+            "requests": len(requests),
+            "submitted_at": time.time(),
+            "status": "submitted",
+        }
+        self._save_state(state_path, state)
+        print(f"[*] Batch {batch_id} inviato: {len(requests)} richieste")
+        state["state_path"] = str(state_path)
+        return state
+
+    def wait(self, state: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Poll fino a uno stato finale; None se scade il timeout (il batch resta da riprendere)."""
+        state_path = Path(state.pop("state_path"))
+        start = time.time()
+        while True:
+            info = self.backend.poll(state["batch_id"])
+            if info["status"] != state["status"]:
+                print(f"    {state['batch_id']}: {info['status']} "
+                      f"({info.get('completed') or 0}/{info.get('total') or state['requests']})")
+            state["status"] = info["status"]
+            if info["status"] in TERMINAL_STATUSES:
+                state["completed_at"] = time.time()
+            self._save_state(state_path, state)
+            if info["status"] in TERMINAL_STATUSES:
+                return {"state": state, "info": info, "state_path": state_path}
+            if self.timeout is not None and time.time() - start >= self.timeout:
+                print(f"[!] Batch {state['batch_id']} ancora in corso: rilanciare lo stesso comando per riprenderlo")
+                return None
+            time.sleep(self.poll_interval)
+
+    def score(self, test_cases: List[Dict[str, Any]], outputs: Dict[str, Dict[str, Any]], turnaround: float):
+        """Metriche della task ed esempi (uno per attempt) dai risultati del batch."""
+        metrics = self.spec.create_metrics()
+        examples = []
+        for test_case in test_cases:
+            for attempt in range(self.spec.runs_for(test_case)):
+                output = outputs.get(batch_custom_id(test_case['id'], attempt))
+                if output is None or "error" in output:
+                    print(f"ERRORE test {test_case['id']} attempt {attempt}: "
+                          f"{output['error'] if output else 'assente nel batch'}")
+                    continue
+                cost = calculate_cost(
+                    output['prompt_tokens'],
+                    output['completion_tokens'],
+                    self.model_config['input_price_per_1m'],
+                    self.model_config['output_price_per_1m'],
+                    batch=True,
+                )
+                # Nessuna latenza per richiesta: ogni esempio riporta il tempo di completamento del batch
+                self.spec.add_prediction(metrics, output['response'], test_case, turnaround, cost)
+                examples.append({
+                    "example_id": test_case['id'],
+                    "attempt": attempt,
+                    "predicted": output['response'],
+                    "latency": turnaround,
+                    "cost": cost,
+                    "prompt_tokens": output['prompt_tokens'],
+                    "completion_tokens": output['completion_tokens'],
+                })
+        return metrics.get_metrics(), examples
+
+    def run(self, test_cases: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Invia o riprende il batch, attende e valuta; None se il batch è ancora in corso."""
+        requests = build_batch_requests(self.spec, self.model_config, test_cases, self.temperature)
+        state = self.resume(requests)
+        # Un nuovo batch riserva l'intera stima prima dell'invio (BudgetExceededError se sfora un limite);
+        # uno ripreso è già inviato e registra solo il costo reale
+        estimate = 0.0 if state else estimate_batch_cost(self.model_config, requests)
+        with self.cost_ledger.charge(self.model_key, estimate) as charge:
+            done = self.wait(state or self.submit(requests))
+            if done is None:
+                # Riserva rilasciata: la spesa si registra quando il batch viene ripreso e valutato
+                return None
+            state, info = done["state"], done["info"]
+            if info["status"] != "completed":
+                print(f"[!] Batch {state['batch_id']} terminato con stato '{info['status']}': "
+                      f"valuto i risultati parziali")
+
+            outputs = parse_batch_output(self.backend.fetch(state["batch_id"], info))
+            turnaround = state["completed_at"] - state["submitted_at"]
+            final_metrics, examples = self.score(test_cases, outputs, turnaround)
+            charge.settle(sum(example["cost"] for example in examples))
+        return {"state": state, "state_path": done["state_path"], "metrics": final_metrics, "examples": examples}
+
+
+def batch_cli(
+    task: str,
+    model_keys: List[str],
+    backend: str,
+    test_cases: List[Dict[str, Any]],
+    run_config: Optional[Dict[str, Any]] = None,
+    compaction: str = DEFAULT_COMPACTION,
+    poll_interval: float = DEFAULT_POLL_INTERVAL,
+    timeout: Optional[float] = None,
+    cost_ledger: Optional[CostLedger] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Esegue la task in modalità batch per più modelli (usato dai runner con --batch).
+
+    I risultati sono salvati come le run sincrone in results/<task>/<timestamp>/
+    e nell'archivio, con execution="batch" nella config.
+    """
+    load_dotenv()
+    cost_ledger = cost_ledger or CostLedger()
+    store = ResultsStore()
+    result_logger = ResultLogger(f"results/{task}", store=store)
+    all_results = {}
+    try:
+        for model_key in model_keys:
+            try:
+                cost_ledger.check(model_key)
+                runner = BatchRunner(task, model_key, backend, compaction=compaction,
+                                     poll_interval=poll_interval, timeout=timeout, cost_ledger=cost_ledger)
+                outcome = runner.run(test_cases)
+            except Exception as e:
+                print(f"ERRORE {model_key}: {str(e)}")
+                continue
+            if outcome is None:
+                continue
+            if not outcome["examples"]:
+                # Nessuna risposta valida: il prossimo lancio invia un nuovo batch
+                outcome["state"]["status"] = "failed"
+                BatchRunner._save_state(outcome["state_path"], outcome["state"])
+                print(f"ERRORE {model_key}: nessun risultato valido nel batch {outcome['state']['batch_id']}")
+                continue
+
+            final_metrics = outcome["metrics"]
+            batch_cost = sum(example["cost"] for example in outcome["examples"])
+
+            model_config = runner.model_config
+            config = build_run_config(
+                runner.spec,
+                model_config,
+                runner.temperature,
+                **(run_config or {}),
+                total_examples=len(test_cases),
+                execution="batch",
+                batch_backend=backend,
+                batch_id=outcome["state"]["batch_id"],
+            )
+            results = {"config": config, "metrics": final_metrics}
+            result_logger.save_results(results, model_key, examples=outcome["examples"])
+            all_results[model_key] = results
+
+            state = outcome["state"]
+            state["status"] = "scored"
+            state["results_dir"] = str(result_logger.results_dir)
+            BatchRunner._save_state(outcome["state_path"], state)
+
+            print(f"\n{'='*60}")
+            print(f"RISULTATI BATCH {model_config['name']}:")
+            print(f"{runner.spec.accuracy_field}: {final_metrics.get(runner.spec.accuracy_field, 0.0):.2%}")
+            print(f"Richieste valutate: {len(outcome['examples'])}/{state['requests']}")
+            print(f"Total Cost (batch): ${batch_cost:.6f}")
+            print(f"Completamento batch: {state['completed_at'] - state['submitted_at']:.1f}s")
+            print(f"{'='*60}\n")
+    finally:
+        store.close()
+    return all_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Esecuzione di una task tramite Batch API")
+    parser.add_argument("--task", required=True, help="Task da valutare")
+    parser.add_argument("--model", required=True, help="Chiavi dei modelli separate da virgola")
+    parser.add_argument("--backend", choices=BATCH_BACKENDS, default="provider",
+                        help="provider (Batch API di OpenAI/TogetherAI) o local (stand-in su file)")
+    parser.add_argument("--sample", type=int, default=None, help="Campione stratificato di N esempi")
+    parser.add_argument("--shard", type=str, default=None, help="Solo lo shard i/N del dataset")
+    parser.add_argument("--compaction", choices=COMPACTION_MODES, default=DEFAULT_COMPACTION,
+                        help="Compattazione del contesto JSON nei prompt (rag, judge, final_answer)")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Secondi tra due poll")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Smetti di attendere dopo N secondi (il batch si riprende rilanciando)")
+    args = parser.parse_args()
+
+    test_cases = get_task_spec(args.task).load_test_cases(sample_size=args.sample, shard=args.shard)
+    model_keys = [key.strip() for key in args.model.split(",") if key.strip()]
+    batch_cli(args.task, model_keys, args.backend, test_cases,
+              run_config={"sample_size": args.sample, "shard": args.shard},
+              compaction=args.compaction, poll_interval=args.poll_interval, timeout=args.timeout)
+
+
+if __name__ == "__main__":
+    main()
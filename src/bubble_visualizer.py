@@ -13,28 +13,74 @@ Task-specific accuracy metrics:
 - rag: retrieval_accuracy
 - routing: routing_accuracy
 - tool_calling: tool_selection_accuracy
+
+I grafici usano il backend headless Agg e possono essere generati in parallelo
+(un processo per task), in modalità preview (bassa risoluzione o SVG) o in
+background dopo la fine del benchmark.
+
+pandas, matplotlib, seaborn e numpy vengono importati solo al primo grafico
+o DataFrame: importare il modulo (es. per spawn_background_render) è leggero.
 """
+from __future__ import annotations
 
 import json
 import argparse
+import subprocess
+import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-import numpy as np
-
-sns.set_style("whitegrid")
-plt.rcParams['figure.figsize'] = (14, 10)
-plt.rcParams['font.size'] = 10
-
-def load_results(results_path: Path) -> List[Dict[str, Any]]:
-    """Load results from JSON file."""
+from typing import Dict, List, Any, Optional
+from src.pareto import pareto_front, pareto_table, cross_task_scores, export_pareto_table, parse_weights, OBJECTIVES
+
+# Moduli pesanti, caricati da _require_plotting()
+pd = plt = sns = np = None
+
+# Risoluzione dei grafici finali e della modalità preview
+FINAL_DPI = 300
+PREVIEW_DPI = 72
+
+def _require_plotting():
+    """Importa pandas/matplotlib/seaborn/numpy al primo utilizzo."""
+    global pd, plt, sns, np
+    if plt is not None:
+        return
+    import matplotlib
+    matplotlib.use("Agg")  # Backend headless: nessuna GUI, sicuro nei processi worker
+    import pandas
+    import matplotlib.pyplot
+    import seaborn
+    import numpy
+
+    seaborn.set_style("whitegrid")
+    matplotlib.pyplot.rcParams['figure.figsize'] = (14, 10)
+    matplotlib.pyplot.rcParams['font.size'] = 10
+    pd, plt, sns, np = pandas, matplotlib.pyplot, seaborn, numpy
+
+
+def load_results(results_path: Path, task: str = "all") -> List[Dict[str, Any]]:
+    """
+    Load results from an aggregated JSON file or from a results directory.
+
+    Directories (results/ or results/<task>/) are aggregated from the
+    *_results.json files of every run, incrementally via the manifest of
+    src.result_aggregator.
+    """
+    if results_path.is_dir():
+        from src.result_aggregator import aggregate_task_results
+        if task != "all":
+            task_dir = results_path / task if (results_path / task).is_dir() else results_path
+            return aggregate_task_results(task_dir, task, recursive=True)
+        return [
+            entry
+            for task_dir in sorted(path for path in results_path.iterdir() if path.is_dir())
+            for entry in aggregate_task_results(task_dir, task_dir.name, recursive=True)
+        ]
     with open(results_path, 'r', encoding='utf-8') as f:
         return json.load(f)
 
 def create_summary_dataframe(results: List[Dict[str, Any]]) -> pd.DataFrame:
     """Create summary dataframe from results."""
+    _require_plotting()
     summary_data = []
 
     for result in results:
@@ -91,7 +137,30 @@ def calculate_costs(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def create_task_bubble_chart(df: pd.DataFrame, task: str, output_dir: Path):
+def create_task_bubble_chart(
+    df: pd.DataFrame,
+    task: str,
+    output_dir: Path,
+    dpi: int = FINAL_DPI,
+    fmt: str = "png",
+) -> Path:
+    """
+    Crea il bubble chart di una task.
+
+    I punti sono disegnati con una sola chiamata scatter per variante (marker),
+    con dimensioni e colori calcolati in modo vettoriale.
+
+    Args:
+        df: DataFrame riassuntivo (create_summary_dataframe + calculate_costs)
+        task: Task da disegnare
+        output_dir: Directory di output
+        dpi: Risoluzione (ignorata per SVG)
+        fmt: Formato del file ('png' o 'svg')
+
+    Returns:
+        Path del file salvato
+    """
+    _require_plotting()
     task_df = df[df['task'] == task].copy()
 
     # Setup figure
@@ -115,46 +184,59 @@ def create_task_bubble_chart(df: pd.DataFrame, task: str, output_dir: Path):
     max_latency = task_df['avg_latency'].max()
     size_scale = 3000  # Base size for bubbles
 
-    # Plot each combination
-    for _, row in task_df.iterrows():
-        # Normalize latency to bubble size
-        if max_latency > min_latency:
-            norm_latency = (row['avg_latency'] - min_latency) / (max_latency - min_latency)
-        else:
-            norm_latency = 0.5
-        bubble_size = size_scale * (0.3 + norm_latency * 0.7)
-
-        marker = variant_markers.get(row['variant'], 'o')
-        color = model_colors[row['model']]
+    latencies = task_df['avg_latency'].to_numpy(dtype=float)
+    if max_latency > min_latency:
+        norm_latency = (latencies - min_latency) / (max_latency - min_latency)
+    else:
+        norm_latency = np.full(len(task_df), 0.5)
+    task_df['bubble_size'] = size_scale * (0.3 + norm_latency * 0.7)
+    task_df['color'] = task_df['model'].map(model_colors)
+    task_df['marker'] = task_df['variant'].map(lambda variant: variant_markers.get(variant, 'o'))
 
+    # Una scatter per marker (matplotlib non supporta marker diversi nella stessa chiamata)
+    for marker, group in task_df.groupby('marker', sort=False):
         ax.scatter(
-            row['cost_per_example'],
-            row['accuracy'],
-            s=bubble_size,
-            c=[color],
+            group['cost_per_example'].to_numpy(),
+            group['accuracy'].to_numpy(),
+            s=group['bubble_size'].to_numpy(),
+            c=group['color'].tolist(),
             marker=marker,
             alpha=0.6,
             edgecolors='black',
             linewidth=2
         )
 
-        # Add text label (simplified for clarity)
-        label = f"{row['model']}"
-        ax.annotate(
-            label,
-            (row['cost_per_example'], row['accuracy']),
-            fontsize=8,
-            ha='center',
-            va='center',
-            weight='bold',
-            color='white',
-            bbox=dict(boxstyle='round,pad=0.3', facecolor='black', alpha=0.3, edgecolor='none')
+    # Evidenzia le configurazioni Pareto-ottimali (accuracy/costo/latenza)
+    records = task_df.to_dict('records')
+    front_3d = task_df.iloc[pareto_front(records)]
+    for marker, group in front_3d.groupby('marker', sort=False):
+        ax.scatter(
+            group['cost_per_example'].to_numpy(),
+            group['accuracy'].to_numpy(),
+            s=group['bubble_size'].to_numpy() * 1.15,
+            facecolors='none',
+            marker=marker,
+            edgecolors='gold',
+            linewidth=3.5
         )
 
+    # Frontiera 2-D accuracy/costo come linea a gradini
+    front_2d = task_df.iloc[pareto_front(records, OBJECTIVES[:2])].sort_values('cost_per_example')
+    if len(front_2d) > 1:
+        ax.step(front_2d['cost_per_example'], front_2d['accuracy'], where='post',
+                color='darkgoldenrod', linestyle='-', linewidth=1.5, alpha=0.6)
+
+    # Add text labels (simplified for clarity)
+    label_bbox = dict(boxstyle='round,pad=0.3', facecolor='black', alpha=0.3, edgecolor='none')
+    for x, y, label in zip(task_df['cost_per_example'], task_df['accuracy'], task_df['model']):
+        ax.text(x, y, label, fontsize=8, ha='center', va='center', weight='bold',
+                color='white', bbox=label_bbox)
+
     # Set labels and title
     ax.set_xlabel('Cost per Example (USD)', fontsize=13, fontweight='bold')
     ax.set_ylabel('Accuracy (%)', fontsize=13, fontweight='bold')
-    ax.set_title(f'Task: {task.upper()} - Model Performance Analysis\n(Bubble Size = Average Latency)',
+    ax.set_title(f'Task: {task.upper()} - Model Performance Analysis\n'
+                 f'(Bubble Size = Average Latency, Gold Edge = Pareto-Optimal)',
                  fontsize=15, fontweight='bold', pad=20)
 
     # Grid
@@ -204,13 +286,81 @@ def create_task_bubble_chart(df: pd.DataFrame, task: str, output_dir: Path):
                        framealpha=0.95, edgecolor='black', fancybox=True)
     
     # Adjust layout to accommodate legends
-    plt.tight_layout()
+    fig.tight_layout()
     
     # Save figure with extra space for legends
-    output_path = output_dir / f"{task}_bubble_chart.png"
-    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    output_path = output_dir / f"{task}_bubble_chart.{fmt}"
+    fig.savefig(output_path, dpi=dpi, bbox_inches='tight', format=fmt)
     print(f"  [OK] Bubble chart saved: {output_path}")
-    plt.close()
+    plt.close(fig)
+    return output_path
+
+
+def _render_task_chart(args) -> Path:
+    """Entry point dei processi worker: disegna una singola task."""
+    task_df, task, output_dir, dpi, fmt = args
+    return create_task_bubble_chart(task_df, task, output_dir, dpi=dpi, fmt=fmt)
+
+
+def render_task_charts(
+    df: pd.DataFrame,
+    tasks: List[str],
+    output_dir: Path,
+    preview: bool = False,
+    fmt: str = "png",
+    workers: Optional[int] = None,
+) -> List[Path]:
+    """
+    Genera i bubble chart di più task in parallelo (un processo per task).
+
+    Args:
+        df: DataFrame riassuntivo
+        tasks: Task da disegnare
+        output_dir: Directory di output
+        preview: Bassa risoluzione (PREVIEW_DPI) per controlli rapidi
+        fmt: 'png' o 'svg'
+        workers: Numero di processi (default: uno per task)
+
+    Returns:
+        Path dei grafici salvati, nell'ordine di tasks
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    dpi = PREVIEW_DPI if preview else FINAL_DPI
+    jobs = [(df[df['task'] == task], task, output_dir, dpi, fmt) for task in tasks]
+
+    if len(jobs) <= 1 or workers == 1:
+        return [_render_task_chart(job) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=workers or len(jobs)) as executor:
+        return list(executor.map(_render_task_chart, jobs))
+
+
+def spawn_background_render(
+    task: str,
+    store_path: Path,
+    run_timestamp: str,
+    output_dir: Path,
+    preview: bool = False,
+) -> subprocess.Popen:
+    """
+    Avvia la generazione dei grafici in un processo separato e staccato.
+
+    Il benchmark può terminare subito: i grafici vengono scritti in
+    output_dir quando il processo finisce (log in output_dir/render.log).
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    command = [
+        sys.executable, "-m", "src.bubble_visualizer",
+        "--task", task,
+        "--store", str(store_path),
+        "--run", run_timestamp,
+        "--output-dir", str(output_dir),
+    ]
+    if preview:
+        command.append("--preview")
+    # Il figlio ha il suo descrittore del log: quello del padre si chiude subito
+    with open(output_dir / "render.log", "w", encoding="utf-8") as log_file:
+        return subprocess.Popen(command, stdout=log_file, stderr=subprocess.STDOUT, start_new_session=True)
 
 
 def print_task_summary(df: pd.DataFrame, task: str):
@@ -236,6 +386,12 @@ def print_task_summary(df: pd.DataFrame, task: str):
     print(f"  - Speed: {fastest['avg_latency']:.3f}s - {fastest['model']} ({fastest['variant']})")
     print(f"  - Cost per Example: ${cheapest['cost_per_example']:.6f} - {cheapest['model']} ({cheapest['variant']})")
 
+    front = task_df.iloc[pareto_front(task_df.to_dict('records'))]
+    print(f"\n[PARETO] NON-DOMINATED (accuracy/cost/latency):")
+    for _, row in front.sort_values('cost_per_example').iterrows():
+        print(f"  - {row['model']} ({row['variant']}): {row['accuracy']:.1f}% | "
+              f"${row['cost_per_example']:.6f} | {row['avg_latency']:.3f}s")
+
     print(f"\n[DETAIL] ALL RESULTS:")
     print(f"{'Model':<20} {'Variant':<10} {'Accuracy %':<12} {'Latency (s)':<15} {'Cost/Example':<15}")
     print("-" * 80)
@@ -245,7 +401,32 @@ def print_task_summary(df: pd.DataFrame, task: str):
               f"{row['avg_latency']:>13.3f}s ${row['cost_per_example']:>13.6f}")
 
 
-def visualize_results(results_data: List[Dict[str, Any]], task: str, output_dir: Path):
+def export_rankings(df: pd.DataFrame, output_dir: Path, weights: Optional[Dict[str, float]] = None) -> Path:
+    """Esporta la tabella classificata con frontiere di Pareto (pareto_ranking.csv)."""
+    output_path = output_dir / "pareto_ranking.csv"
+    export_pareto_table(pareto_table(df.to_dict('records'), weights), output_path)
+    print(f"  [OK] Pareto ranking saved: {output_path}")
+    return output_path
+
+
+def print_cross_task_ranking(df: pd.DataFrame, weights: Optional[Dict[str, float]] = None):
+    """Stampa lo score pesato cross-task per modello/variante."""
+    print(f"\n{'='*80}")
+    print("[RANKING] WEIGHTED CROSS-TASK SCORE")
+    print(f"{'='*80}\n")
+    print(f"{'Model':<30} {'Variant':<10} {'Score':>8} {'Tasks':>6}")
+    print("-" * 80)
+    for item in cross_task_scores(df.to_dict('records'), weights):
+        print(f"{item['model']:<30} {item['variant']:<10} {item['score']:>8.3f} {item['tasks_covered']:>6}")
+
+
+def visualize_results(
+    results_data: List[Dict[str, Any]],
+    task: str,
+    output_dir: Path,
+    preview: bool = False,
+    fmt: str = "png",
+):
     if not results_data:
         print(f"No results to visualize")
         return
@@ -267,7 +448,8 @@ def visualize_results(results_data: List[Dict[str, Any]], task: str, output_dir:
 
     # Create bubble chart
     print(f"\n[*] Generating bubble chart...")
-    create_task_bubble_chart(df, task, output_dir)
+    create_task_bubble_chart(df, task, output_dir, dpi=PREVIEW_DPI if preview else FINAL_DPI, fmt=fmt)
+    export_rankings(task_df, output_dir)
 
     print(f"\n{'='*80}")
     print("[OK] VISUALIZATION COMPLETED")
@@ -283,13 +465,55 @@ def main():
         "--task",
         type=str,
         required=True,
-        help="Nome della task da visualizzare"
+        help="Nome della task da visualizzare ('all' per tutte le task presenti)"
     )
     parser.add_argument(
         "--results",
         type=str,
-        required=True,
-        help="Path al file JSON dei risultati"
+        default=None,
+        help="Path al file JSON aggregato o a una directory dei risultati (results/ o results/<task>)"
+    )
+    parser.add_argument(
+        "--store",
+        type=str,
+        default=None,
+        help="Path dell'archivio SQLite dei risultati (alternativa a --results)"
+    )
+    parser.add_argument(
+        "--run",
+        type=str,
+        default=None,
+        help="Con --store: timestamp della run da visualizzare (default: tutte)"
+    )
+    parser.add_argument(
+        "--since",
+        type=str,
+        default=None,
+        help="Con --store: considera solo run da questa data (YYYY-MM-DD)"
+    )
+    parser.add_argument(
+        "--preview",
+        action="store_true",
+        help=f"Anteprima veloce a {PREVIEW_DPI} dpi invece di {FINAL_DPI}"
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        choices=["png", "svg"],
+        default="png",
+        help="Formato dei grafici"
+    )
+    parser.add_argument(
+        "--weights",
+        type=str,
+        default=None,
+        help="Pesi per lo score cross-task, es. accuracy=0.5,cost_per_example=0.3,avg_latency=0.2"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Processi per il rendering parallelo delle task"
     )
     parser.add_argument(
         "--output-dir",
@@ -299,8 +523,10 @@ def main():
     )
     
     args = parser.parse_args()
+    if not args.results and not args.store:
+        parser.error("Specificare --results oppure --store")
     
-    results_path = Path(args.results)
+    results_path = Path(args.results or args.store)
     if not results_path.exists():
         print(f"✗ File risultati non trovato: {results_path}")
         return
@@ -315,22 +541,41 @@ def main():
     
     # Load results
     print(f"\n[*] Loading results from: {results_path}")
-    results = load_results(results_path)
+    if args.store:
+        from src.results_store import ResultsStore
+        store = ResultsStore(args.store)
+        task_filter = None if args.task == "all" else args.task
+        results = store.query_runs(task=task_filter, run_timestamp=args.run, since=args.since)
+        store.close()
+    else:
+        results = load_results(results_path, args.task)
     df = create_summary_dataframe(results)
     df = calculate_costs(df)
     
-    # Filter for this task
-    task_df = df[df['task'] == args.task]
-    if task_df.empty:
+    if df.empty:
+        print(f"[X] No results found for task: {args.task}")
+        return
+
+    # Filter for the requested task(s)
+    tasks = sorted(df['task'].unique()) if args.task == "all" else [args.task]
+    if df[df['task'].isin(tasks)].empty:
         print(f"[X] No results found for task: {args.task}")
         return
     
     # Print summary
-    print_task_summary(df, args.task)
+    for task in tasks:
+        print_task_summary(df, task)
     
-    # Create bubble chart
-    print(f"\n[*] Generating bubble chart...")
-    create_task_bubble_chart(df, args.task, output_dir)
+    # Create bubble charts (one process per task)
+    print(f"\n[*] Generating bubble charts...")
+    render_task_charts(df, tasks, output_dir, preview=args.preview, fmt=args.format, workers=args.workers)
+
+    # Frontiere di Pareto e ranking cross-task
+    weights = parse_weights(args.weights) if args.weights else None
+    selected_df = df[df['task'].isin(tasks)]
+    if len(tasks) > 1:
+        print_cross_task_ranking(selected_df, weights)
+    export_rankings(selected_df, output_dir, weights)
     
     print(f"\n{'='*80}")
     print("[OK] ANALYSIS COMPLETED")
@@ -0,0 +1,416 @@
+"""
+Valutazione di una cascata di modelli: prima il modello economico, poi
+escalation al modello forte quando la confidenza è bassa.
+
+Segnali di confidenza (combinati con il minimo, tutti in [0, 1]):
+- parse: 0 se la risposta non rispetta il formato della task, altrimenti 1
+- logprob: probabilità media per token, exp(logprob medio) (solo provider
+  OpenAI-compatibili; ignorato se non disponibile)
+- judge: un verificatore (default: il modello forte) approva la risposta;
+  vale la confidenza dichiarata se approvata, 0 se rifiutata
+- consistency: accordo tra la risposta e CONSISTENCY_SAMPLES campioni a
+  temperatura CONSISTENCY_TEMPERATURE
+
+Si escala quando confidenza < soglia. Il modello forte è interrogato su
+tutti gli esempi, così l'intera curva costo/accuratezza al variare della
+soglia si calcola senza nuove chiamate; costo e latenza di ogni punto
+contano solo le chiamate che la cascata farebbe davvero.
+
+Uso:
+    python main_routing.py --cascade openai/gpt-oss-20b,gpt-4o
+    python -m src.cascade --task tool_calling --cheap openai/gpt-oss-20b --strong gpt-4o --signals parse,consistency
+"""
+import argparse
+import csv
+import json
+import math
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from src.compaction import DEFAULT_COMPACTION
+from src.cost_ledger import BudgetExceededError, CostLedger, estimate_request_cost
+from src.env import load_dotenv
+from src.inference_client import ModelInferenceClient
+from src.metrics import calculate_cost
+from src.model_config import get_model_config
+from src.pareto import pareto_front_2d
+from src.task_specs import TaskSpec, get_task_spec, parse_json_response
+from src.tracing import span
+
+CASCADE_SIGNALS = ("parse", "logprob", "judge", "consistency")
+DEFAULT_SIGNALS = "parse,logprob"
+
+# Soglia oltre ogni confidenza possibile (in [0, 1]): escalation su tutti gli esempi
+ALWAYS_ESCALATE = 1.01
+
+CONSISTENCY_SAMPLES = 3
+CONSISTENCY_TEMPERATURE = 0.7
+
+VERIFIER_SYSTEM_PROMPT = """Sei un verificatore di qualità per Vera AI.
+Ricevi le istruzioni date a un assistente, la richiesta e la risposta dell'assistente.
+Valuta se la risposta è corretta, completa e nel formato richiesto dalle istruzioni.
+
+Rispondi SOLO in JSON:
+{"approved": true/false, "confidence": numero tra 0 e 1}"""
+
+
+def score_prediction(spec: TaskSpec, predicted: str, test_case: Dict[str, Any]) -> float:
+    """Metrica principale della task (accuracy_field) su un singolo esempio."""
+    metrics = spec.create_metrics()
+    spec.add_prediction(metrics, predicted, test_case, 0.0, 0.0)
+    return float(metrics.get_metrics()[spec.accuracy_field])
+
+
+def _answer_key(spec: TaskSpec, response: str) -> str:
+    """Forma canonica della risposta per il confronto tra campioni."""
+    parsed = spec.parse_response(response)
+    if parsed is None:
+        return response.strip()
+    return json.dumps(parsed, sort_keys=True, ensure_ascii=False)
+
+
+class CascadeEvaluator:
+    """
+    Esegue modello economico, segnali di confidenza e modello forte su ogni esempio.
+
+    Args:
+        task: Nome task
+        cheap_model: Chiave del modello economico (risponde per primo)
+        strong_model: Chiave del modello forte (escalation)
+        signals: Segnali di confidenza da CASCADE_SIGNALS
+        judge_model: Verificatore per il segnale judge (default: strong_model)
+        client_factory: Crea il client da una model config (default: ModelInferenceClient)
+        cost_ledger: Registro di spesa e limiti di budget (come nei runner)
+    """
+
+    def __init__(
+        self,
+        task: str,
+        cheap_model: str,
+        strong_model: str,
+        signals: Sequence[str] = ("parse", "logprob"),
+        judge_model: Optional[str] = None,
+        compaction: str = DEFAULT_COMPACTION,
+        client_factory: Callable[[Dict[str, Any]], Any] = None,
+        cost_ledger: Optional[CostLedger] = None,
+    ):
+        unknown = set(signals) - set(CASCADE_SIGNALS)
+        if unknown:
+            raise ValueError(f"Segnali non supportati: {', '.join(sorted(unknown))}. "
+                             f"Disponibili: {', '.join(CASCADE_SIGNALS)}")
+        self.spec = get_task_spec(task, compaction=compaction)
+        self.signals = list(signals)
+        self.model_keys = {"cheap": cheap_model, "strong": strong_model}
+        if "judge" in self.signals:
+            self.model_keys["judge"] = judge_model or strong_model
+        self.model_configs = {role: get_model_config(key) for role, key in self.model_keys.items()}
+        client_factory = client_factory or (
+            lambda config: ModelInferenceClient(config['id'], provider=config['provider'])
+        )
+        self.clients = {role: client_factory(config) for role, config in self.model_configs.items()}
+        self.cost_ledger = cost_ledger or CostLedger()
+
+    def _call(self, role: str, system_prompt: str, user_prompt: str, max_new_tokens: int,
+              temperature: float = 0.0, logprobs: bool = False) -> Dict[str, Any]:
+        config = self.model_configs[role]
+        # Riserva la stima pessimistica prima della chiamata, poi registra il costo reale
+        estimate = estimate_request_cost(config, system_prompt, user_prompt, max_new_tokens)
+        with self.cost_ledger.charge(self.model_keys[role], estimate) as charge:
+            with span(f"cascade.{role}", cat="cascade", model=self.model_keys[role]):
+                response, latency, token_usage = self.clients[role].generate(
+                    system_prompt=system_prompt,
+                    user_prompt=user_prompt,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    logprobs=logprobs,
+                )
+            cost = calculate_cost(token_usage['prompt_tokens'], token_usage['completion_tokens'],
+                                  config['input_price_per_1m'], config['output_price_per_1m'])
+            charge.settle(cost, token_usage.get("api_key_id"))
+        return {"response": response, "latency": latency, "cost": cost, "mean_logprob": token_usage.get("mean_logprob")}
+
+    def _verify(self, user_prompt: str, response: str) -> Dict[str, Any]:
+        """Segnale judge: il verificatore approva la risposta del modello economico?"""
+        verifier_prompt = (
+            f"ISTRUZIONI DELL'ASSISTENTE:\n{self.spec.system_prompt}\n\n"
+            f"RICHIESTA:\n{user_prompt}\n\nRISPOSTA DELL'ASSISTENTE:\n{response}"
+        )
+        result = self._call("judge", VERIFIER_SYSTEM_PROMPT, verifier_prompt, max_new_tokens=50)
+        verdict = parse_json_response(result["response"])
+        if not isinstance(verdict, dict) or not isinstance(verdict.get("approved"), bool):
+            # Verdetto illeggibile: nessuna fiducia nella risposta
+            result["value"] = 0.0
+        elif not verdict["approved"]:
+            result["value"] = 0.0
+        else:
+            confidence = verdict.get("confidence", 1.0)
+            result["value"] = min(max(float(confidence), 0.0), 1.0) if isinstance(confidence, (int, float)) else 1.0
+        return result
+
+    def evaluate_example(self, test_case: Dict[str, Any]) -> Dict[str, Any]:
+        """Risposte di entrambi i modelli, valori dei segnali e confidenza per un esempio."""
+        spec = self.spec
+        user_prompt = spec.render_user_prompt(test_case)
+        cheap = self._call("cheap", spec.system_prompt, user_prompt, spec.max_new_tokens,
+                           logprobs="logprob" in self.signals)
+        cheap["score"] = score_prediction(spec, cheap["response"], test_case)
+
+        signal_values: Dict[str, Optional[float]] = {}
+        signal_cost = 0.0
+        signal_latency = 0.0
+        if "parse" in self.signals:
+            signal_values["parse"] = 0.0 if spec.parse_response(cheap["response"]) is None else 1.0
+        if "logprob" in self.signals:
+            mean_logprob = cheap["mean_logprob"]
+            signal_values["logprob"] = None if mean_logprob is None else math.exp(mean_logprob)
+        if "consistency" in self.signals:
+            reference = _answer_key(spec, cheap["response"])
+            agreeing = 0
+            for _ in range(CONSISTENCY_SAMPLES):
+                sample = self._call("cheap", spec.system_prompt, user_prompt, spec.max_new_tokens,
+                                    temperature=CONSISTENCY_TEMPERATURE)
+                agreeing += _answer_key(spec, sample["response"]) == reference
+                signal_cost += sample["cost"]
+                signal_latency += sample["latency"]
+            signal_values["consistency"] = agreeing / CONSISTENCY_SAMPLES
+        if "judge" in self.signals:
+            verdict = self._verify(user_prompt, cheap["response"])
+            signal_values["judge"] = verdict["value"]
+            signal_cost += verdict["cost"]
+            signal_latency += verdict["latency"]
+
+        available = [value for value in signal_values.values() if value is not None]
+        strong = self._call("strong", spec.system_prompt, user_prompt, spec.max_new_tokens)
+        strong["score"] = score_prediction(spec, strong["response"], test_case)
+
+        return {
+            "example_id": test_case["id"],
+            "cheap": {key: cheap[key] for key in ("response", "score", "cost", "latency")},
+            "strong": {key: strong[key] for key in ("response", "score", "cost", "latency")},
+            "signals": signal_values,
+            "signal_cost": signal_cost,
+            "signal_latency": signal_latency,
+            # Nessun segnale disponibile: la risposta economica è accettata
+            "confidence": min(available) if available else 1.0,
+        }
+
+
+def blend(records: List[Dict[str, Any]], threshold: float) -> Dict[str, Any]:
+    """Metriche della cascata con escalation quando confidenza < soglia."""
+    n = len(records)
+    escalated = [record["confidence"] < threshold for record in records]
+    scores, costs, latencies = [], [], []
+    for record, escalate in zip(records, escalated):
+        cost = record["cheap"]["cost"] + record["signal_cost"]
+        latency = record["cheap"]["latency"] + record["signal_latency"]
+        if escalate:
+            cost += record["strong"]["cost"]
+            latency += record["strong"]["latency"]
+        scores.append(record["strong"]["score"] if escalate else record["cheap"]["score"])
+        costs.append(cost)
+        latencies.append(latency)
+    return {
+        "threshold": threshold,
+        "escalation_rate": sum(escalated) / n,
+        "accuracy": sum(scores) / n,
+        "cost_per_example": sum(costs) / n,
+        "latency_mean": sum(latencies) / n,
+    }
+
+
+def sweep_thresholds(records: List[Dict[str, Any]], thresholds: Optional[List[float]] = None) -> Dict[str, Any]:
+    """
+    Curva costo/accuratezza al variare della soglia, più i riferimenti a modello singolo.
+
+    Senza soglie esplicite usa 0 (mai escalation), ogni valore distinto di
+    confidenza e ALWAYS_ESCALATE (sempre escalation): la curva è esatta.
+    """
+    if thresholds is None:
+        thresholds = sorted({0.0, *(record["confidence"] for record in records), ALWAYS_ESCALATE})
+    curve = [blend(records, threshold) for threshold in thresholds]
+    for i in pareto_front_2d([(point["cost_per_example"], -point["accuracy"]) for point in curve]):
+        curve[i]["pareto"] = True
+    for point in curve:
+        point.setdefault("pareto", False)
+
+    n = len(records)
+    references = {
+        role: {
+            "accuracy": sum(record[role]["score"] for record in records) / n,
+            "cost_per_example": sum(record[role]["cost"] for record in records) / n,
+            "latency_mean": sum(record[role]["latency"] for record in records) / n,
+        }
+        for role in ("cheap", "strong")
+    }
+    return {"curve": curve, "references": references}
+
+
+def run_cascade(
+    task: str,
+    cheap_model: str,
+    strong_model: str,
+    test_cases: List[Dict[str, Any]],
+    signals: Sequence[str] = ("parse", "logprob"),
+    judge_model: Optional[str] = None,
+    thresholds: Optional[List[float]] = None,
+    compaction: str = DEFAULT_COMPACTION,
+    client_factory: Callable[[Dict[str, Any]], Any] = None,
+    cost_ledger: Optional[CostLedger] = None,
+) -> Dict[str, Any]:
+    """Valuta la cascata su tutti gli esempi e calcola la curva delle soglie."""
+    evaluator = CascadeEvaluator(task, cheap_model, strong_model, signals, judge_model, compaction, client_factory,
+                                 cost_ledger)
+    # Nessuna chiamata se un limite di budget applicabile è già esaurito
+    for model_key in dict.fromkeys(evaluator.model_keys.values()):
+        evaluator.cost_ledger.check(model_key)
+    records = []
+    budget_stopped = False
+    for i, test_case in enumerate(test_cases, 1):
+        try:
+            record = evaluator.evaluate_example(test_case)
+        except BudgetExceededError as e:
+            print(f"[!] {e}: cascata interrotta, valuto gli esempi completati")
+            budget_stopped = True
+            break
+        except Exception as e:
+            print(f"ERRORE test {test_case['id']}: {str(e)}")
+            continue
+        records.append(record)
+        signal_text = " ".join(f"{name}={'-' if value is None else f'{value:.2f}'}"
+                               for name, value in record["signals"].items())
+        print(f"[{i}/{len(test_cases)}] {test_case['id']}: cheap {record['cheap']['score']:.2f} | "
+              f"strong {record['strong']['score']:.2f} | confidenza {record['confidence']:.2f} ({signal_text})")
+
+    result = {
+        "task": task,
+        "cheap_model": cheap_model,
+        "strong_model": strong_model,
+        "judge_model": (judge_model or strong_model) if "judge" in signals else None,
+        "signals": list(signals),
+        "records": records,
+    }
+    if budget_stopped:
+        result["budget_stopped"] = True
+    if records:
+        result.update(sweep_thresholds(records, thresholds))
+    return result
+
+
+def print_cascade(result: Dict[str, Any]):
+    """Tabella della curva soglia -> escalation, accuratezza, costo e latenza."""
+    if not result["records"]:
+        print("Nessun esempio valutato")
+        return
+    print(f"\n{'='*60}")
+    print(f"CASCATA {result['task']}: {result['cheap_model']} -> {result['strong_model']} "
+          f"(segnali: {', '.join(result['signals'])})")
+    print(f"{'='*60}")
+    print(f"{'Soglia':>8} {'Escalation':>11} {'Accuratezza':>12} {'Costo/es.':>12} {'Latenza':>9}")
+    for point in result["curve"]:
+        marker = "  *" if point["pareto"] else ""
+        print(f"{point['threshold']:>8.3f} {point['escalation_rate']:>10.1%} {point['accuracy']:>12.3f} "
+              f"{point['cost_per_example']:>12.7f} {point['latency_mean']:>8.3f}s{marker}")
+    for role, label in (("cheap", result["cheap_model"]), ("strong", result["strong_model"])):
+        reference = result["references"][role]
+        print(f"Solo {label}: accuratezza {reference['accuracy']:.3f} | costo/es. ${reference['cost_per_example']:.7f} "
+              f"| latenza {reference['latency_mean']:.3f}s")
+    print("(* = frontiera di Pareto costo/accuratezza)")
+
+
+def save_cascade_results(result: Dict[str, Any], output_dir: Path):
+    """Salva record e curva in JSON e la curva in CSV."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "cascade.json", "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    fields = ["threshold", "escalation_rate", "accuracy", "cost_per_example", "latency_mean", "pareto"]
+    with open(output_dir / "cascade_curve.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(result.get("curve", []))
+
+
+def plot_cascade_curve(result: Dict[str, Any], output_path: Path):
+    """Grafico accuratezza vs costo per esempio, con i due modelli singoli come riferimento."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    curve = sorted(result["curve"], key=lambda point: point["cost_per_example"])
+    fig, ax = plt.subplots(figsize=(10, 7))
+    ax.plot([point["cost_per_example"] for point in curve], [point["accuracy"] for point in curve],
+            marker="o", label="cascata (soglie)")
+    for role, marker in (("cheap", "s"), ("strong", "^")):
+        reference = result["references"][role]
+        ax.scatter([reference["cost_per_example"]], [reference["accuracy"]], marker=marker, s=120, zorder=5,
+                   label=f"solo {result[f'{role}_model']}")
+    ax.set_xlabel("Costo per esempio (USD)")
+    ax.set_ylabel("Accuratezza")
+    ax.set_title(f"{result['task'].upper()} - Cascata {result['cheap_model']} -> {result['strong_model']}")
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(output_path, dpi=150)
+    plt.close(fig)
+
+
+def parse_signals(value: str) -> List[str]:
+    return [signal.strip() for signal in value.split(",") if signal.strip()]
+
+
+def cascade_cli(
+    task: str,
+    models: str,
+    signals: str = DEFAULT_SIGNALS,
+    test_cases: Optional[List[Dict[str, Any]]] = None,
+    judge_model: Optional[str] = None,
+    compaction: str = DEFAULT_COMPACTION,
+    output_dir: Optional[str] = None,
+    chart: bool = True,
+    cost_ledger: Optional[CostLedger] = None,
+):
+    """Esegue, stampa e salva una cascata "cheap,strong" (usato dai runner con --cascade)."""
+    load_dotenv()
+    cheap_model, strong_model = [key.strip() for key in models.split(",")]
+    if test_cases is None:
+        test_cases = get_task_spec(task).load_test_cases()
+    result = run_cascade(task, cheap_model, strong_model, test_cases, parse_signals(signals),
+                         judge_model=judge_model, compaction=compaction, cost_ledger=cost_ledger)
+    print_cascade(result)
+
+    output_dir = Path(output_dir or f"results/cascade/{task}/{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    save_cascade_results(result, output_dir)
+    if chart and result["records"]:
+        try:
+            plot_cascade_curve(result, output_dir / "cascade_curve.png")
+        except ImportError:
+            print("[!] matplotlib non disponibile: grafico saltato")
+    print(f"\nRisultati cascata: {output_dir}/")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cascata economico -> forte con escalation su bassa confidenza")
+    parser.add_argument("--task", required=True, help="Task da valutare")
+    parser.add_argument("--cheap", required=True, help="Modello economico (risponde per primo)")
+    parser.add_argument("--strong", required=True, help="Modello forte (escalation)")
+    parser.add_argument("--signals", type=str, default=DEFAULT_SIGNALS,
+                        help=f"Segnali di confidenza separati da virgola: {', '.join(CASCADE_SIGNALS)}")
+    parser.add_argument("--judge-model", type=str, default=None, help="Verificatore del segnale judge (default: --strong)")
+    parser.add_argument("--sample", type=int, default=None, help="Campione stratificato di N esempi")
+    parser.add_argument("--shard", type=str, default=None, help="Solo lo shard i/N del dataset")
+    parser.add_argument("--output-dir", type=str, default=None, help="Default: results/cascade/<task>/<timestamp>")
+    parser.add_argument("--no-chart", action="store_true", help="Non generare il grafico")
+    parser.add_argument("--budget-run", type=float, default=None, help="Limite di spesa in USD per questa cascata")
+    parser.add_argument("--budget-day", type=float, default=None,
+                        help="Limite di spesa giornaliero in USD, condiviso tra processi (results/cost_ledger.json)")
+    args = parser.parse_args()
+
+    test_cases = get_task_spec(args.task).load_test_cases(sample_size=args.sample, shard=args.shard)
+    cascade_cli(args.task, f"{args.cheap},{args.strong}", args.signals, test_cases,
+                judge_model=args.judge_model, output_dir=args.output_dir, chart=not args.no_chart,
+                cost_ledger=CostLedger(run_budget=args.budget_run, daily_budget=args.budget_day))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+"""
+Compattazione del contesto JSON incorporato nei prompt (RAG, judge, final_answer).
+
+I prompt incorporano JSON serializzato con indent=2: indentazione, chiavi
+ripetute e struttura verbosa aumentano i token in input (costo e latenza).
+Modalità disponibili, dalla meno alla più aggressiva:
+
+- indent: formato originale (json.dumps indent=2), nessuna compattazione
+- minified: JSON senza spazi
+- pruned: minified + rimozione ricorsiva di null, stringhe, liste e dict vuoti
+- tabular: pruned + liste omogenee di oggetti (es. conversation_history,
+  invoices) come tabella {"columns": [...], "rows": [[...], ...]}
+- keydict: tabular + chiavi ripetute sostituite da codici brevi, con la
+  legenda in "_keys"
+
+Il report confronta i token in input per task e modalità (conteggio locale,
+nessuna chiamata API) e, se nell'archivio ci sono run con --compaction,
+la differenza di accuratezza rispetto al formato originale:
+
+    python -m src.compaction report
+    python -m src.compaction report --tasks rag --model gpt-4o-mini
+    python -m src.compaction show --task judge --mode tabular
+"""
+import json
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+COMPACTION_MODES = ("indent", "minified", "pruned", "tabular", "keydict")
+DEFAULT_COMPACTION = "indent"
+
+# Task i cui prompt incorporano contesto JSON
+COMPACTABLE_TASKS = ("rag", "judge", "final_answer")
+
+_MINIFIED = {"separators": (",", ":"), "ensure_ascii": False}
+
+
+def prune(value: Any) -> Any:
+    """Rimuove ricorsivamente null, stringhe, liste e dict vuoti (False e 0 restano)."""
+    if isinstance(value, dict):
+        pruned = {key: prune(item) for key, item in value.items()}
+        return {key: item for key, item in pruned.items() if item not in (None, "", [], {})}
+    if isinstance(value, list):
+        pruned = [prune(item) for item in value]
+        return [item for item in pruned if item not in (None, "", [], {})]
+    return value
+
+
+def tabularize(value: Any) -> Any:
+    """Liste di almeno due oggetti diventano una tabella columns/rows (chiavi mancanti = null)."""
+    if isinstance(value, dict):
+        return {key: tabularize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        items = [tabularize(item) for item in value]
+        if len(items) >= 2 and all(isinstance(item, dict) for item in items):
+            columns = list(dict.fromkeys(key for item in items for key in item))
+            return {"columns": columns, "rows": [[item.get(column) for column in columns] for item in items]}
+        return items
+    return value
+
+
+def _count_keys(value: Any, counts: Counter):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            counts[key] += 1
+            _count_keys(item, counts)
+    elif isinstance(value, list):
+        for item in value:
+            _count_keys(item, counts)
+
+
+def encode_keys(value: Any) -> Any:
+    """
+    Sostituisce le chiavi ripetute con codici brevi (k0, k1, ...).
+
+    Sono codificate solo le chiavi che compaiono almeno due volte e più
+    lunghe del codice; la legenda codice -> chiave è in "_keys" e i dati
+    in "data". Senza chiavi da codificare il valore resta invariato.
+    """
+    counts = Counter()
+    _count_keys(value, counts)
+    codes: Dict[str, str] = {}
+    for key, count in counts.most_common():
+        code = f"k{len(codes)}"
+        if count >= 2 and len(key) > len(code):
+            codes[key] = code
+    if not codes:
+        return value
+
+    def encode(item: Any) -> Any:
+        if isinstance(item, dict):
+            return {codes.get(key, key): encode(child) for key, child in item.items()}
+        if isinstance(item, list):
+            return [encode(child) for child in item]
+        return item
+
+    return {"_keys": {code: key for key, code in codes.items()}, "data": encode(value)}
+
+
+def compact_json(value: Any, mode: str = DEFAULT_COMPACTION) -> str:
+    """Serializza il contesto JSON di un prompt nella modalità di compattazione indicata."""
+    if mode == "indent":
+        return json.dumps(value, indent=2, ensure_ascii=False)
+    if mode == "minified":
+        return json.dumps(value, **_MINIFIED)
+    if mode == "pruned":
+        return json.dumps(prune(value), **_MINIFIED)
+    if mode == "tabular":
+        return json.dumps(tabularize(prune(value)), **_MINIFIED)
+    if mode == "keydict":
+        return json.dumps(encode_keys(tabularize(prune(value))), **_MINIFIED)
+    raise ValueError(f"Compattazione '{mode}' non supportata. Disponibili: {', '.join(COMPACTION_MODES)}")
+
+
+# ----------------------------------------------------------------------
+# Report
+# ----------------------------------------------------------------------
+
+def token_report(
+    tasks: List[str],
+    modes: List[str] = COMPACTION_MODES,
+    model_id: str = "gpt-4o-mini",
+) -> List[Dict[str, Any]]:
+    """Token in input (system + user) dell'intero dataset per task e modalità."""
+    from src.data_loader import load_dataset
+    from src.planner import get_token_counter
+    from src.task_specs import get_task_spec
+
+    count_tokens, _ = get_token_counter(model_id)
+    rows = []
+    for task in tasks:
+        baseline = None
+        for mode in modes:
+            spec = get_task_spec(task, compaction=mode)
+            test_cases = load_dataset(spec.dataset_path)
+            system_tokens = count_tokens(spec.system_prompt)
+            tokens = sum(system_tokens + count_tokens(spec.render_user_prompt(test_case)) for test_case in test_cases)
+            baseline = tokens if baseline is None else baseline
+            rows.append({
+                "task": task,
+                "mode": mode,
+                "examples": len(test_cases),
+                "input_tokens": tokens,
+                "saved_pct": (1 - tokens / baseline) * 100 if baseline else 0.0,
+            })
+    return rows
+
+
+def accuracy_deltas(store, task: str, model: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Accuratezza media per modello e modalità dalle run nell'archivio.
+
+    Returns:
+        {model_name: {mode: accuratezza}}; le run senza 'compaction' in config
+        contano come formato originale (indent)
+    """
+    from src.task_specs import get_task_spec
+
+    accuracy_field = get_task_spec(task).accuracy_field
+    values: Dict[str, Dict[str, List[float]]] = {}
+    for run in store.query_runs(task=task, model=model):
+        accuracy = run["metrics"].get(accuracy_field)
+        if not isinstance(accuracy, (int, float)):
+            continue
+        mode = run["config"].get("compaction") or DEFAULT_COMPACTION
+        values.setdefault(run["model"], {}).setdefault(mode, []).append(accuracy)
+    return {
+        model_name: {mode: sum(scores) / len(scores) for mode, scores in modes.items()}
+        for model_name, modes in values.items()
+    }
+
+
+def print_report(rows: List[Dict[str, Any]], deltas: Dict[str, Dict[str, Dict[str, float]]]):
+    """Stampa token risparmiati per task e, se disponibile, il delta di accuratezza per modello."""
+    print(f"{'Task':<14} {'Modalità':<10} {'Esempi':>7} {'Token input':>12} {'Risparmio':>10}")
+    print("-" * 57)
+    for row in rows:
+        print(f"{row['task']:<14} {row['mode']:<10} {row['examples']:>7} {row['input_tokens']:>12,} "
+              f"{row['saved_pct']:>9.1f}%")
+
+    for task, by_model in deltas.items():
+        compared = {model_name: modes for model_name, modes in by_model.items()
+                    if DEFAULT_COMPACTION in modes and len(modes) > 1}
+        if not compared:
+            continue
+        print(f"\nDelta accuratezza vs {DEFAULT_COMPACTION} - {task}")
+        for model_name, modes in sorted(compared.items()):
+            baseline = modes[DEFAULT_COMPACTION]
+            cells = [f"{mode} {modes[mode] - baseline:+.3f}" for mode in COMPACTION_MODES
+                     if mode in modes and mode != DEFAULT_COMPACTION]
+            print(f"  {model_name:<32} {DEFAULT_COMPACTION} {baseline:.3f} | " + " | ".join(cells))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compattazione del contesto JSON nei prompt")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    report_parser = subparsers.add_parser("report", help="Token risparmiati per task e delta di accuratezza")
+    report_parser.add_argument("--tasks", type=str, default=",".join(COMPACTABLE_TASKS),
+                               help="Task separate da virgola")
+    report_parser.add_argument("--modes", type=str, default=",".join(COMPACTION_MODES),
+                               help="Modalità separate da virgola")
+    report_parser.add_argument("--tokenizer-model", type=str, default="gpt-4o-mini",
+                               help="Modello per il conteggio dei token (tiktoken se installato)")
+    report_parser.add_argument("--model", type=str, default=None, help="Delta di accuratezza solo per questo modello")
+    report_parser.add_argument("--store", type=str, default=None,
+                               help="Archivio SQLite (default: results/verabench.db se esiste)")
+
+    show_parser = subparsers.add_parser("show", help="Mostra lo user prompt di un esempio in una modalità")
+    show_parser.add_argument("--task", type=str, required=True, choices=COMPACTABLE_TASKS)
+    show_parser.add_argument("--mode", type=str, default="tabular", choices=COMPACTION_MODES)
+    show_parser.add_argument("--index", type=int, default=0, help="Indice dell'esempio nel dataset")
+
+    args = parser.parse_args()
+
+    if args.command == "show":
+        from src.data_loader import load_dataset
+        from src.task_specs import get_task_spec
+
+        spec = get_task_spec(args.task, compaction=args.mode)
+        print(spec.render_user_prompt(load_dataset(spec.dataset_path)[args.index]))
+        return
+
+    from src.results_store import DEFAULT_DB_PATH, ResultsStore
+
+    tasks = [task.strip() for task in args.tasks.split(",") if task.strip()]
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    if DEFAULT_COMPACTION not in modes:
+        modes.insert(0, DEFAULT_COMPACTION)
+    rows = token_report(tasks, modes, args.tokenizer_model)
+
+    deltas = {}
+    db_path = args.store or DEFAULT_DB_PATH
+    if Path(db_path).exists():
+        store = ResultsStore(db_path)
+        try:
+            deltas = {task: accuracy_deltas(store, task, args.model) for task in tasks}
+        finally:
+            store.close()
+    print_report(rows, deltas)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Controllo adattivo della concorrenza (AIMD) per provider e modello.
+
+Un limite fisso di richieste in parallelo è troppo prudente o provoca
+throttling, e il livello giusto cambia durante la giornata. Il controller
+di ogni (provider, modello) regola il numero di richieste in volo:
+
+- incremento additivo: +1 sul limite ogni `limit` richieste riuscite
+- decremento moltiplicativo: limite * 0.5 su un 429; i 429 di richieste
+  partite prima dell'ultimo decremento non lo ripetono, così una raffica
+  di 429 dallo stesso sovraccarico conta come un solo evento
+- header x-ratelimit-remaining-requests/tokens e x-ratelimit-reset-*:
+  il limite non supera le richieste rimaste e, a quota esaurita, le nuove
+  richieste attendono il reset
+- retry-after (o backoff esponenziale) prima di ripetere una richiesta 429
+
+ModelInferenceClient usa il controller in generate() e ripete le richieste
+rifiutate con 429; lo stato (limite, picco in volo, eventi di throttling,
+attesa) finisce nelle metriche della run tramite concurrency_metrics().
+"""
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+# Errori di rate limit: codice HTTP 429 o messaggi dei provider
+RATE_LIMIT_PATTERN = re.compile(r"\b429\b|rate.?limit|too many requests|resource.?exhausted", re.IGNORECASE)
+
+INITIAL_LIMIT = 4
+MIN_LIMIT = 1
+MAX_LIMIT = 64
+ADDITIVE_INCREASE = 1.0
+MULTIPLICATIVE_DECREASE = 0.5
+# Backoff senza retry-after: BACKOFF_BASE * 2^(decrementi senza successi in mezzo - 1), al più BACKOFF_MAX secondi
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+MAX_RATE_LIMIT_RETRIES = 5
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Secondi da una durata degli header ("20ms", "1s", "6m0s") o da un numero."""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def _header_int(headers: Mapping[str, str], *names: str) -> Optional[int]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            try:
+                return int(float(value))
+            except ValueError:
+                continue
+    return None
+
+
+def parse_ratelimit_headers(headers: Optional[Mapping[str, str]]) -> Dict[str, Optional[float]]:
+    """
+    Stato del rate limit dagli header di una risposta OpenAI-compatibile.
+
+    Returns:
+        remaining_requests, remaining_tokens, reset_requests, reset_tokens
+        (secondi) e retry_after; None per gli header assenti
+    """
+    headers = {key.lower(): value for key, value in (headers or {}).items()}
+    return {
+        "remaining_requests": _header_int(headers, "x-ratelimit-remaining-requests", "x-ratelimit-remaining"),
+        "remaining_tokens": _header_int(headers, "x-ratelimit-remaining-tokens"),
+        "reset_requests": parse_duration(headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset")),
+        "reset_tokens": parse_duration(headers.get("x-ratelimit-reset-tokens")),
+        "retry_after": parse_duration(headers.get("retry-after")),
+    }
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """True per errori 429 (status dell'SDK o messaggio), anche se avvolti in un altro errore."""
+    while exc is not None:
+        if getattr(exc, "status_code", None) == 429 or RATE_LIMIT_PATTERN.search(str(exc)):
+            return True
+        exc = exc.__cause__
+    return False
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """retry-after (o reset delle richieste) dagli header della risposta 429, se presenti."""
+    while exc is not None:
+        response = getattr(exc, "response", None)
+        if response is not None and getattr(response, "headers", None) is not None:
+            parsed = parse_ratelimit_headers(response.headers)
+            return parsed["retry_after"] or parsed["reset_requests"]
+        exc = exc.__cause__
+    return None
+
+
+class AdaptiveConcurrencyController:
+    """Limite AIMD delle richieste in volo per un (provider, modello), thread-safe."""
+
+    def __init__(
+        self,
+        key: Tuple[str, str],
+        initial_limit: float = INITIAL_LIMIT,
+        min_limit: float = MIN_LIMIT,
+        max_limit: float = MAX_LIMIT,
+    ):
+        self.key = key
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit)
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = float("-inf")
+        self._consecutive_throttles = 0
+
+        self.peak_in_flight = 0
+        self.successes = 0
+        self.throttle_events = 0
+        self.decreases = 0
+        self.wait_seconds = 0.0
+        self.min_limit_seen = self.limit
+        self.remaining_requests: Optional[int] = None
+        self.remaining_tokens: Optional[int] = None
+
+    @contextmanager
+    def slot(self):
+        """
+        Attende un posto libero sotto il limite (e la fine di eventuali pause) per una richiesta.
+
+        Yields:
+            Istante di partenza della richiesta (time.monotonic), da passare a on_throttle()
+        """
+        start = time.monotonic()
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    self._cond.wait(self._paused_until - now)
+                elif self._in_flight < max(self.min_limit, int(self.limit)):
+                    break
+                else:
+                    self._cond.wait()
+            self._in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._in_flight)
+            started_at = time.monotonic()
+            self.wait_seconds += started_at - start
+        try:
+            yield started_at
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def on_success(self):
+        """Incremento additivo: +ADDITIVE_INCREASE sul limite ogni `limit` successi."""
+        with self._cond:
+            self.successes += 1
+            self._consecutive_throttles = 0
+            limit = min(self.max_limit, self.limit + ADDITIVE_INCREASE / self.limit)
+            if self.remaining_requests is not None:
+                limit = min(limit, max(self.min_limit, self.remaining_requests))
+            self.limit = limit
+            self._cond.notify_all()
+
+    def on_throttle(self, retry_after: Optional[float] = None, started_at: Optional[float] = None) -> float:
+        """
+        Decremento moltiplicativo e pausa dopo un 429.
+
+        Args:
+            retry_after: Secondi indicati dal provider (altrimenti backoff esponenziale)
+            started_at: Partenza della richiesta rifiutata; se precede l'ultimo
+                decremento il limite non viene ridotto di nuovo
+
+        Returns:
+            Secondi di pausa prima che le richieste ripartano
+        """
+        with self._cond:
+            now = time.monotonic()
+            self.throttle_events += 1
+            if started_at is None or started_at >= self._last_decrease:
+                self._consecutive_throttles += 1
+                self.limit = max(self.min_limit, self.limit * MULTIPLICATIVE_DECREASE)
+                self.min_limit_seen = min(self.min_limit_seen, self.limit)
+                self._last_decrease = now
+                self.decreases += 1
+            pause = retry_after if retry_after is not None else min(
+                BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._consecutive_throttles - 1)
+            )
+            self._paused_until = max(self._paused_until, now + pause)
+            return pause
+
+    def observe_headers(self, headers: Optional[Mapping[str, str]]):
+        """Aggiorna quota rimasta e pause dagli header x-ratelimit-* di una risposta."""
+        parsed = parse_ratelimit_headers(headers)
+        with self._cond:
+            if parsed["remaining_requests"] is not None:
+                self.remaining_requests = parsed["remaining_requests"]
+            if parsed["remaining_tokens"] is not None:
+                self.remaining_tokens = parsed["remaining_tokens"]
+            # Quota esaurita: nessuna nuova richiesta fino al reset
+            now = time.monotonic()
+            if parsed["remaining_requests"] == 0 and parsed["reset_requests"]:
+                self._paused_until = max(self._paused_until, now + parsed["reset_requests"])
+            if parsed["remaining_tokens"] == 0 and parsed["reset_tokens"]:
+                self._paused_until = max(self._paused_until, now + parsed["reset_tokens"])
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Stato corrente del controller e contatori cumulativi."""
+        with self._cond:
+            snapshot = {
+                "concurrency_limit": round(self.limit, 2),
+                "concurrency_min_limit": round(self.min_limit_seen, 2),
+                "concurrency_peak": self.peak_in_flight,
+                "throttle_events": self.throttle_events,
+                "throttle_decreases": self.decreases,
+                "ratelimit_wait_seconds": round(self.wait_seconds, 3),
+                "ratelimit_remaining_requests": self.remaining_requests,
+                "ratelimit_remaining_tokens": self.remaining_tokens,
+            }
+        return {key: value for key, value in snapshot.items() if value is not None}
+
+
+_controllers: Dict[Tuple[str, str], AdaptiveConcurrencyController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_controller(provider: str, model_id: str) -> AdaptiveConcurrencyController:
+    """Controller condiviso del (provider, modello) nel processo."""
+    key = (provider, model_id)
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AdaptiveConcurrencyController(key)
+        return _controllers[key]
+
+
+def concurrency_metrics(provider: str, model_id: str) -> Dict[str, Any]:
+    """Stato del controller per le metriche della run ({} se il modello non ha un controller)."""
+    with _controllers_lock:
+        controller = _controllers.get((provider, model_id))
+    return controller.snapshot() if controller is not None else {}
@@ -0,0 +1,267 @@
+"""
+Registro dei costi in tempo reale con limiti di budget.
+
+Prima di ogni richiesta si riserva una stima pessimistica del costo (token
+del prompt stimati + max_new_tokens in output); dopo la risposta la riserva
+viene sostituita dal costo reale. Se la riserva farebbe superare un limite
+viene sollevata BudgetExceededError e il runner chiude la run in modo pulito.
+
+Limiti supportati:
+- run: spesa totale di questo processo (tutti i modelli)
+- model: spesa di ciascun modello in questo processo
+- day: spesa del giorno solare su tutti i processi, persistita su file
+  (results/cost_ledger.json) con lock fcntl
+
+Con il pool di API key (src.key_pool) settle() riceve anche l'id della
+chiave usata: la spesa è attribuita per chiave, in memoria e nel file.
+
+Il registro è thread-safe: più worker/task possono condividerlo.
+
+Esempio:
+    ledger = CostLedger(run_budget=5.0, daily_budget=20.0)
+    with ledger.charge("gpt-4o", estimate_request_cost(config, system, user, 500)) as charge:
+        answer, latency, usage = client.generate(...)
+        charge.settle(calculate_cost(...), usage.get("api_key_id"))
+"""
+import fcntl
+import json
+import os
+import threading
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from src.metrics import calculate_cost
+
+DEFAULT_LEDGER_PATH = "results/cost_ledger.json"
+
+
+class BudgetExceededError(RuntimeError):
+    """Una richiesta farebbe superare un limite di budget."""
+
+    def __init__(self, scope: str, limit: float, projected: float):
+        self.scope = scope
+        self.limit = limit
+        self.projected = projected
+        super().__init__(f"Budget {scope} superato: ${projected:.4f} previsti su un limite di ${limit:.4f}")
+
+
+def estimate_request_cost(
+    model_config: Dict[str, Any],
+    system_prompt: str,
+    user_prompt: str,
+    max_new_tokens: int,
+) -> float:
+    """Stima pessimistica del costo di una richiesta (~4 caratteri per token, output massimo)."""
+    prompt_tokens = (len(system_prompt) + len(user_prompt)) // 4 + 1
+    return calculate_cost(
+        prompt_tokens,
+        max_new_tokens,
+        model_config['input_price_per_1m'],
+        model_config['output_price_per_1m'],
+    )
+
+
+class _Charge:
+    """Riserva attiva: settle() registra il costo reale, altrimenti viene rilasciata."""
+
+    def __init__(self, ledger: "CostLedger", model_key: str, reservation_id: int):
+        self.ledger = ledger
+        self.model_key = model_key
+        self.reservation_id = reservation_id
+        self.settled = False
+
+    def settle(self, actual_cost: float, api_key_id: Optional[str] = None):
+        self.ledger.reconcile(self.reservation_id, actual_cost, api_key_id)
+        self.settled = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.settled:
+            self.ledger.release(self.reservation_id)
+        return False
+
+
+class CostLedger:
+    """
+    Registro condiviso di spesa e riserve con limiti per run, modello e giorno.
+
+    Args:
+        path: File JSON della spesa giornaliera (condiviso tra processi)
+        run_budget: Limite in USD per questo processo
+        model_budget: Limite in USD per ciascun modello in questo processo
+        daily_budget: Limite in USD per il giorno solare (tutti i processi)
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_LEDGER_PATH,
+        run_budget: Optional[float] = None,
+        model_budget: Optional[float] = None,
+        daily_budget: Optional[float] = None,
+    ):
+        self.path = Path(path)
+        self.lock_path = Path(str(self.path) + ".lock")
+        self.run_budget = run_budget
+        self.model_budget = model_budget
+        self.daily_budget = daily_budget
+
+        self.run_spent = 0.0
+        self.model_spent: Dict[str, float] = {}
+        self.key_spent: Dict[str, float] = {}
+        self._reservations: Dict[int, tuple] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    # --- persistenza giornaliera ---
+
+    def _read_ledger(self) -> Dict[str, Any]:
+        if not self.path.exists():
+            return {"days": {}}
+        with open(self.path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _file_lock(self, exclusive: bool):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        handle = open(self.lock_path, "a")
+        fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        return handle
+
+    def day_spent(self, day: Optional[str] = None) -> float:
+        """Spesa registrata (tutti i processi) per il giorno indicato (default: oggi)."""
+        day = day or date.today().isoformat()
+        handle = self._file_lock(exclusive=False)
+        try:
+            return self._read_ledger()["days"].get(day, {}).get("total", 0.0)
+        finally:
+            handle.close()
+
+    def _persist(self, model_key: str, cost: float, api_key_id: Optional[str] = None):
+        day = date.today().isoformat()
+        handle = self._file_lock(exclusive=True)
+        try:
+            ledger = self._read_ledger()
+            entry = ledger["days"].setdefault(day, {"total": 0.0, "models": {}})
+            entry["total"] += cost
+            entry["models"][model_key] = entry["models"].get(model_key, 0.0) + cost
+            if api_key_id is not None:
+                keys = entry.setdefault("keys", {})
+                keys[api_key_id] = keys.get(api_key_id, 0.0) + cost
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(ledger, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        finally:
+            handle.close()
+
+    # --- riserve ---
+
+    def _reserved(self, model_key: Optional[str] = None) -> float:
+        return sum(amount for key, amount in self._reservations.values() if model_key is None or key == model_key)
+
+    def reserve(self, model_key: str, estimated_cost: float) -> int:
+        """
+        Riserva la stima di una richiesta; solleva BudgetExceededError se sfora un limite.
+
+        Returns:
+            ID della riserva da passare a reconcile() o release()
+        """
+        day_spent = self.day_spent() if self.daily_budget is not None else 0.0
+        with self._lock:
+            reserved = self._reserved()
+            checks = [
+                ("run", self.run_budget, self.run_spent + reserved),
+                (f"modello {model_key}", self.model_budget,
+                 self.model_spent.get(model_key, 0.0) + self._reserved(model_key)),
+                ("giornaliero", self.daily_budget, day_spent + reserved),
+            ]
+            for scope, limit, committed in checks:
+                if limit is not None and committed + estimated_cost > limit:
+                    raise BudgetExceededError(scope, limit, committed + estimated_cost)
+
+            reservation_id = self._next_id
+            self._next_id += 1
+            self._reservations[reservation_id] = (model_key, estimated_cost)
+            return reservation_id
+
+    def check(self, model_key: str):
+        """Solleva BudgetExceededError se un limite applicabile al modello è già esaurito."""
+        day_spent = self.day_spent() if self.daily_budget is not None else 0.0
+        with self._lock:
+            checks = [
+                ("run", self.run_budget, self.run_spent),
+                (f"modello {model_key}", self.model_budget, self.model_spent.get(model_key, 0.0)),
+                ("giornaliero", self.daily_budget, day_spent),
+            ]
+        for scope, limit, spent in checks:
+            if limit is not None and spent >= limit:
+                raise BudgetExceededError(scope, limit, spent)
+
+    def _add_spent(self, model_key: str, cost: float, api_key_id: Optional[str]):
+        # Da chiamare con self._lock acquisito
+        self.run_spent += cost
+        self.model_spent[model_key] = self.model_spent.get(model_key, 0.0) + cost
+        if api_key_id is not None:
+            self.key_spent[api_key_id] = self.key_spent.get(api_key_id, 0.0) + cost
+
+    def reconcile(self, reservation_id: int, actual_cost: float, api_key_id: Optional[str] = None):
+        """Sostituisce la riserva con il costo reale e lo persiste (attribuito alla chiave, se indicata)."""
+        with self._lock:
+            model_key, _ = self._reservations.pop(reservation_id)
+            self._add_spent(model_key, actual_cost, api_key_id)
+        self._persist(model_key, actual_cost, api_key_id)
+
+    def record(self, model_key: str, actual_cost: float, api_key_id: Optional[str] = None):
+        """
+        Registra una spesa già avvenuta senza riserva né controllo dei limiti
+        (es. le risposte hedged scartate, pagate comunque).
+        """
+        with self._lock:
+            self._add_spent(model_key, actual_cost, api_key_id)
+        self._persist(model_key, actual_cost, api_key_id)
+
+    def release(self, reservation_id: int):
+        """Annulla una riserva (richiesta fallita, nessun costo)."""
+        with self._lock:
+            self._reservations.pop(reservation_id, None)
+
+    def charge(self, model_key: str, estimated_cost: float) -> _Charge:
+        """Context manager: riserva ora, settle() con il costo reale o rilascio all'uscita."""
+        return _Charge(self, model_key, self.reserve(model_key, estimated_cost))
+
+    def summary(self) -> Dict[str, Any]:
+        """Spesa di questo processo e del giorno, con i limiti configurati."""
+        with self._lock:
+            return {
+                "run_spent": self.run_spent,
+                "model_spent": dict(self.model_spent),
+                "key_spent": dict(self.key_spent),
+                "day_spent": self.day_spent(),
+                "run_budget": self.run_budget,
+                "model_budget": self.model_budget,
+                "daily_budget": self.daily_budget,
+            }
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Spesa registrata nel cost ledger")
+    parser.add_argument("--ledger", type=str, default=DEFAULT_LEDGER_PATH, help="File del ledger")
+    parser.add_argument("--days", type=int, default=7, help="Giorni da mostrare")
+    args = parser.parse_args()
+
+    ledger = CostLedger(args.ledger)
+    days = ledger._read_ledger()["days"]
+    for day in sorted(days)[-args.days:]:
+        print(f"{day}  ${days[day]['total']:.4f}")
+        for model_key, spent in sorted(days[day]["models"].items(), key=lambda item: -item[1]):
+            print(f"    {model_key:<45} ${spent:.4f}")
+        for key_id, spent in sorted(days[day].get("keys", {}).items(), key=lambda item: -item[1]):
+            print(f"    key {key_id:<41} ${spent:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,35 @@
 """
 Modulo per caricare dataset e prompt.
 """
+import argparse
+import hashlib
 import json
-from typing import List, Dict, Any
+import mmap
+import os
+import random
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Sequence, Tuple
+
+# Chiavi usate per la stratificazione (solo quelle presenti nel dataset)
+STRATIFY_KEYS = ("category", "complexity")
+
+# Suffisso dell'indice sidecar dei dataset JSONL (es. dataset.jsonl.idx)
+JSONL_INDEX_SUFFIX = ".idx"
+JSONL_INDEX_VERSION = 1
 
 
 def load_dataset(dataset_path: str) -> List[Dict[str, str]]:
-    """Carica i test cases dal dataset JSON in ordine deterministico."""
+    """
+    Carica i test cases dal dataset in ordine deterministico.
+
+    Supporta sia il formato JSON monolitico ({"test_cases": [...]}) sia il
+    formato JSONL con indice sidecar (file con estensione .jsonl).
+    """
+    if str(dataset_path).endswith('.jsonl'):
+        with JsonlDataset(dataset_path) as dataset:
+            return list(dataset)
+
     with open(dataset_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     # Ordina per ID per garantire ordine deterministico
@@ -14,8 +37,385 @@ def load_dataset(dataset_path: str) -> List[Dict[str, str]]:
     return test_cases
 
 
+def iter_dataset(dataset_path: str) -> Iterator[Dict[str, Any]]:
+    """Itera i test cases in ordine di ID; lazy per i dataset JSONL."""
+    if str(dataset_path).endswith('.jsonl'):
+        with JsonlDataset(dataset_path) as dataset:
+            yield from dataset
+    else:
+        yield from load_dataset(dataset_path)
+
+
 def load_prompt(prompt_path: str) -> str:
     """Carica il prompt di sistema dal file JSON."""
     with open(prompt_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
     return data['system_prompt']
+
+
+def _seeded_rank(test_case_id: str, seed: int) -> str:
+    """
+    Chiave di ordinamento pseudo-casuale ma stabile per un test case.
+
+    Dipende solo da seed e ID: lo stesso campione viene scelto per tutti i
+    modelli e non cambia se il dataset viene riordinato o esteso.
+    """
+    return hashlib.sha256(f"{seed}:{test_case_id}".encode('utf-8')).hexdigest()
+
+
+def build_id_index(test_cases: Iterable[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Costruisce un indice ID -> test case per lookup O(1)."""
+    index = {}
+    for test_case in test_cases:
+        if test_case['id'] in index:
+            raise ValueError(f"ID duplicato nel dataset: '{test_case['id']}'")
+        index[test_case['id']] = test_case
+    return index
+
+
+class IndexedTestCases(list):
+    """
+    Test cases selezionati (in ordine di ID) con lookup O(1) per ID.
+
+    È ciò che load_test_cases restituisce per dataset JSON e JSONL: si usa
+    come una lista e in più espone get(id), come JsonlDataset.get. L'indice
+    è costruito alla creazione: la selezione va trattata in sola lettura.
+    """
+
+    def __init__(self, test_cases: Iterable[Dict[str, Any]] = ()):
+        super().__init__(test_cases)
+        self._index = build_id_index(self)
+
+    def get(self, test_case_id: str) -> Dict[str, Any]:
+        """Lookup O(1) di un test case per ID."""
+        if test_case_id not in self._index:
+            raise KeyError(f"Test case '{test_case_id}' non presente nella selezione")
+        return self._index[test_case_id]
+
+    def ids(self) -> List[str]:
+        """ID dei test cases in ordine."""
+        return [test_case['id'] for test_case in self]
+
+
+def stratified_sample(
+    test_cases: Sequence[Dict[str, Any]],
+    sample_size: int,
+    seed: int = 42,
+    stratify_keys: Sequence[str] = STRATIFY_KEYS,
+) -> List[Dict[str, Any]]:
+    """
+    Campionamento stratificato deterministico per category/complexity.
+
+    Ogni strato riceve una quota proporzionale alla sua dimensione (metodo del
+    resto maggiore, minimo 1 esempio per strato quando possibile). All'interno
+    di uno strato gli esempi sono scelti per rank seeded sull'ID; a parità di
+    resto gli esempi avanzati vanno a strati in ordine seeded.
+
+    Args:
+        test_cases: Test cases da campionare
+        sample_size: Numero di esempi desiderati
+        seed: Seed del campionamento
+        stratify_keys: Campi usati per definire gli strati (ignorati se assenti)
+
+    Returns:
+        Sottoinsieme dei test cases ordinato per ID
+    """
+    if sample_size <= 0:
+        raise ValueError("sample_size deve essere > 0")
+    if sample_size >= len(test_cases):
+        return sorted(test_cases, key=lambda x: x['id'])
+
+    strata: Dict[Tuple, List[Dict[str, Any]]] = defaultdict(list)
+    for test_case in test_cases:
+        stratum = tuple(test_case.get(key) for key in stratify_keys)
+        strata[stratum].append(test_case)
+
+    # Strati in ordine stabile (None non è confrontabile con str)
+    ordered_strata = sorted(strata.items(), key=lambda item: tuple(str(v) for v in item[0]))
+    total = len(test_cases)
+
+    # Quote proporzionali con metodo del resto maggiore
+    quotas = {}
+    remainders = []
+    for stratum, members in ordered_strata:
+        exact = sample_size * len(members) / total
+        quotas[stratum] = int(exact)
+        remainders.append((exact - int(exact), stratum))
+
+    # Garantisce almeno un esempio per strato se il budget lo consente
+    if sample_size >= len(ordered_strata):
+        for stratum, _ in ordered_strata:
+            if quotas[stratum] == 0:
+                quotas[stratum] = 1
+
+    assigned = sum(quotas.values())
+    # A parità di resto gli esempi avanzati vanno a strati scelti dal seed (sort stabile
+    # dopo uno shuffle seeded), non in ordine alfabetico: altrimenti con più strati che
+    # esempi ogni seed terrebbe gli stessi strati
+    random.Random(seed).shuffle(remainders)
+    remainders.sort(key=lambda item: -item[0])
+    for _, stratum in remainders:
+        if assigned >= sample_size:
+            break
+        if quotas[stratum] < len(strata[stratum]):
+            quotas[stratum] += 1
+            assigned += 1
+
+    # Se le quote minime hanno sforato, togli dagli strati più grandi
+    while assigned > sample_size:
+        largest = max(quotas, key=lambda s: (quotas[s], tuple(str(v) for v in s)))
+        quotas[largest] -= 1
+        assigned -= 1
+
+    sample = []
+    for stratum, members in ordered_strata:
+        ranked = sorted(members, key=lambda x: _seeded_rank(x['id'], seed))
+        sample.extend(ranked[:quotas[stratum]])
+
+    return sorted(sample, key=lambda x: x['id'])
+
+
+def parse_shard(shard: str) -> Tuple[int, int]:
+    """
+    Converte una stringa 'i/N' in (indice, numero_shard).
+
+    L'indice è 0-based: '0/4' ... '3/4'.
+    """
+    try:
+        index_str, count_str = shard.split('/')
+        index, count = int(index_str), int(count_str)
+    except ValueError:
+        raise ValueError(f"Shard '{shard}' non valido. Formato atteso: i/N (es. 0/4)")
+    if count <= 0 or not 0 <= index < count:
+        raise ValueError(f"Shard '{shard}' non valido: serve 0 <= i < N")
+    return index, count
+
+
+def shard_test_cases(
+    test_cases: Iterable[Dict[str, Any]],
+    shard_index: int,
+    num_shards: int,
+) -> List[Dict[str, Any]]:
+    """
+    Restituisce la porzione di test cases assegnata a uno shard.
+
+    L'assegnazione dipende solo dall'hash dell'ID, quindi è stabile tra
+    macchine diverse e non cambia per gli esempi esistenti se il dataset cresce.
+    """
+    if num_shards == 1:
+        return list(test_cases)
+    return [
+        test_case for test_case in test_cases
+        if int(hashlib.sha256(test_case['id'].encode('utf-8')).hexdigest(), 16) % num_shards == shard_index
+    ]
+
+
+def select_test_cases(
+    test_cases: List[Dict[str, Any]],
+    sample_size: Optional[int] = None,
+    shard: Optional[str] = None,
+    seed: int = 42,
+) -> List[Dict[str, Any]]:
+    """
+    Applica campionamento stratificato e sharding (in quest'ordine).
+
+    Il campione è calcolato sull'intero dataset prima dello sharding, così
+    l'unione degli shard coincide con il campione di una run su una macchina.
+    """
+    if sample_size:
+        test_cases = stratified_sample(test_cases, sample_size, seed=seed)
+    if shard:
+        shard_index, num_shards = parse_shard(shard)
+        test_cases = shard_test_cases(test_cases, shard_index, num_shards)
+    return test_cases
+
+
+def load_test_cases(
+    dataset_path: str,
+    sample_size: Optional[int] = None,
+    shard: Optional[str] = None,
+    seed: int = 42,
+) -> IndexedTestCases:
+    """
+    Carica solo i test cases selezionati da campionamento e sharding.
+
+    Se il file JSON non esiste ma c'è il gemello .jsonl, usa quello: la
+    selezione avviene sui record dell'indice e vengono letti da disco solo
+    gli esempi scelti. Per entrambi i formati il risultato espone get(id).
+    """
+    path = Path(dataset_path)
+    if path.suffix == '.json' and not path.exists() and path.with_suffix('.jsonl').exists():
+        path = path.with_suffix('.jsonl')
+
+    if path.suffix != '.jsonl':
+        return IndexedTestCases(
+            select_test_cases(load_dataset(str(path)), sample_size=sample_size, shard=shard, seed=seed)
+        )
+
+    with JsonlDataset(path) as dataset:
+        selected = select_test_cases(dataset.index_records(), sample_size=sample_size, shard=shard, seed=seed)
+        return IndexedTestCases(dataset.get(record['id']) for record in selected)
+
+
+class JsonlDataset:
+    """
+    Dataset JSONL (un test case per riga) letto via mmap.
+
+    Un indice sidecar (<file>.jsonl.idx) contiene per ogni test case ID,
+    offset e lunghezza in byte, più i campi di stratificazione. L'indice viene
+    ricostruito automaticamente se manca o se il file dati è cambiato.
+    L'iterazione è lazy e in ordine di ID: in memoria resta solo l'indice.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.index_path = Path(str(self.path) + JSONL_INDEX_SUFFIX)
+        self.entries = self._load_or_build_index()
+        self._positions = {entry[0]: pos for pos, entry in enumerate(self.entries)}
+        self._file = open(self.path, 'rb')
+        # mmap non accetta file vuoti
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.entries else None
+
+    def _load_or_build_index(self) -> List[list]:
+        """Carica l'indice sidecar, ricostruendolo se assente o obsoleto."""
+        stat = os.stat(self.path)
+        if self.index_path.exists():
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if (index.get('version') == JSONL_INDEX_VERSION
+                    and index.get('source_size') == stat.st_size
+                    and index.get('source_mtime_ns') == stat.st_mtime_ns):
+                return index['entries']
+        return build_jsonl_index(self.path)['entries']
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, test_case_id: str) -> bool:
+        return test_case_id in self._positions
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for entry in self.entries:
+            yield self._read(entry)
+
+    def _read(self, entry: list) -> Dict[str, Any]:
+        _, offset, length = entry[:3]
+        return json.loads(self._mmap[offset:offset + length])
+
+    def get(self, test_case_id: str) -> Dict[str, Any]:
+        """Lookup O(1) di un test case per ID."""
+        if test_case_id not in self._positions:
+            raise KeyError(f"Test case '{test_case_id}' non trovato in {self.path}")
+        return self._read(self.entries[self._positions[test_case_id]])
+
+    def ids(self) -> List[str]:
+        """ID di tutti i test cases in ordine."""
+        return [entry[0] for entry in self.entries]
+
+    def index_records(self) -> List[Dict[str, Any]]:
+        """
+        Record leggeri (id + campi di stratificazione) presi dall'indice.
+
+        Possono essere passati direttamente a stratified_sample/shard_test_cases
+        senza leggere i test cases completi.
+        """
+        return [
+            {'id': entry[0], **{key: value for key, value in zip(STRATIFY_KEYS, entry[3:])}}
+            for entry in self.entries
+        ]
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def build_jsonl_index(jsonl_path: str, dataset_info: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Scansiona un file JSONL e scrive l'indice sidecar (ordinato per ID).
+
+    Il file viene letto riga per riga, senza caricarlo tutto in memoria.
+    """
+    jsonl_path = Path(jsonl_path)
+    entries = []
+    offset = 0
+    with open(jsonl_path, 'rb') as f:
+        for line in f:
+            length = len(line)
+            if line.strip():
+                test_case = json.loads(line)
+                entries.append([
+                    test_case['id'], offset, length,
+                    *(test_case.get(key) for key in STRATIFY_KEYS),
+                ])
+            offset += length
+
+    entries.sort(key=lambda entry: entry[0])
+    for previous, current in zip(entries, entries[1:]):
+        if previous[0] == current[0]:
+            raise ValueError(f"ID duplicato nel dataset: '{current[0]}'")
+
+    stat = os.stat(jsonl_path)
+    index = {
+        'version': JSONL_INDEX_VERSION,
+        'source_size': stat.st_size,
+        'source_mtime_ns': stat.st_mtime_ns,
+        'fields': ['id', 'offset', 'length', *STRATIFY_KEYS],
+        'dataset_info': dataset_info or {},
+        'entries': entries,
+    }
+    with open(str(jsonl_path) + JSONL_INDEX_SUFFIX, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    return index
+
+
+def convert_json_to_jsonl(json_path: str, jsonl_path: Optional[str] = None) -> Path:
+    """
+    Converte un dataset JSON (tasks/*/dataset.json) in JSONL + indice.
+
+    Returns:
+        Path del file JSONL creato
+    """
+    json_path = Path(json_path)
+    jsonl_path = Path(jsonl_path) if jsonl_path else json_path.with_suffix('.jsonl')
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    with open(jsonl_path, 'w', encoding='utf-8') as f:
+        for test_case in sorted(data['test_cases'], key=lambda x: x['id']):
+            f.write(json.dumps(test_case, ensure_ascii=False) + '\n')
+
+    build_jsonl_index(jsonl_path, dataset_info=data.get('dataset_info'))
+    return jsonl_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Utility per i dataset VERABENCH")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    convert_parser = subparsers.add_parser("convert", help="Converte dataset JSON in JSONL con indice")
+    convert_parser.add_argument("datasets", nargs="+", help="File dataset.json da convertire")
+
+    index_parser = subparsers.add_parser("index", help="Ricostruisce l'indice di dataset JSONL")
+    index_parser.add_argument("datasets", nargs="+", help="File .jsonl da indicizzare")
+
+    args = parser.parse_args()
+
+    for dataset_path in args.datasets:
+        if args.command == "convert":
+            output_path = convert_json_to_jsonl(dataset_path)
+            print(f"[OK] {dataset_path} -> {output_path}")
+        else:
+            index = build_jsonl_index(dataset_path)
+            print(f"[OK] {dataset_path}: {len(index['entries'])} test cases indicizzati")
+
+
+if __name__ == "__main__":
+    main()
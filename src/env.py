@@ -0,0 +1,15 @@
+"""
+Caricamento delle variabili dal file .env.
+
+python-dotenv è opzionale a runtime: senza, load_dotenv non fa nulla e le
+API key vanno esportate nell'ambiente. Così i moduli (e i test) si
+importano anche dove il pacchetto non è installato.
+"""
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    def load_dotenv(*args, **kwargs) -> bool:
+        """Nessun file .env caricato (python-dotenv non installato)."""
+        return False
+
+__all__ = ["load_dotenv"]
@@ -0,0 +1,195 @@
+"""
+Richieste hedged per ridurre la latenza di coda.
+
+La latenza di coda dei provider a volte porta un esempio oltre i 30 secondi,
+allungando il tempo totale e sporcando le statistiche di latenza. Con una
+HedgingPolicy, se una richiesta non è completata entro il percentile
+configurato delle latenze osservate, ModelInferenceClient invia un duplicato
+e usa la prima risposta riuscita; l'altra richiesta viene annullata se non
+è ancora partita, altrimenti abbandonata (gli SDK sincroni non si possono
+interrompere) e i suoi token contano come costo extra. Il costo della
+risposta usata è registrato nel CostLedger dal runner; quello delle risposte
+scartate, noto solo quando terminano, da on_discarded (vedi ledger_recorder).
+
+Metriche (hedging_metrics):
+- hedge_requests / hedge_rate: duplicati inviati e frazione di richieste hedged
+- hedge_wins: duplicati che hanno risposto per primi
+- hedge_extra_*_tokens / hedge_extra_cost: token e costo delle risposte scartate
+- latency_first_pXX: latenza della prima risposta (quella usata)
+- latency_primary_pXX: latenza della richiesta originale, come senza hedging
+
+Le prime MIN_SAMPLES richieste non sono hedged (servono latenze osservate).
+
+    python main_routing.py --hedge 95
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from src.metrics import calculate_cost, percentile
+
+MIN_SAMPLES = 10
+LATENCY_WINDOW = 200
+MAX_WORKERS = 32
+
+
+class HedgingPolicy:
+    """Hedging al percentile delle latenze osservate, con contatori thread-safe."""
+
+    def __init__(
+        self,
+        hedge_percentile: float = 95.0,
+        min_samples: int = MIN_SAMPLES,
+        window: int = LATENCY_WINDOW,
+        on_discarded: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        if not 0 < hedge_percentile < 100:
+            raise ValueError("Il percentile di hedging deve essere tra 0 e 100 (esclusi)")
+        self.hedge_percentile = hedge_percentile
+        # Chiamata con il token_usage di ogni risposta scartata (dal thread che la completa)
+        self.on_discarded = on_discarded
+        self.min_samples = min_samples
+        self._observed = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.extra_prompt_tokens = 0
+        self.extra_completion_tokens = 0
+        self.first_latencies = []
+        self.primary_latencies = []
+
+    def hedge_delay(self) -> Optional[float]:
+        """Secondi dopo cui inviare il duplicato (None finché le latenze osservate sono poche)."""
+        with self._lock:
+            if len(self._observed) < self.min_samples:
+                return None
+            return percentile(list(self._observed), self.hedge_percentile)
+
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="hedge")
+            return self._executor
+
+    def _timed(self, call: Callable[[], Tuple[str, float, Dict[str, Any]]]):
+        start = time.perf_counter()
+        result = call()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._observed.append(elapsed)
+        return result, elapsed
+
+    def _record_primary(self, future):
+        if not future.cancelled() and future.exception() is None:
+            with self._lock:
+                self.primary_latencies.append(future.result()[1])
+
+    def _record_discarded(self, future):
+        # Risposta scartata: i suoi token sono pagati comunque
+        if not future.cancelled() and future.exception() is None:
+            token_usage = future.result()[0][2]
+            with self._lock:
+                self.extra_prompt_tokens += token_usage.get('prompt_tokens', 0)
+                self.extra_completion_tokens += token_usage.get('completion_tokens', 0)
+            if self.on_discarded is not None:
+                self.on_discarded(token_usage)
+
+    def run(self, call: Callable[[], Tuple[str, float, Dict[str, Any]]]) -> Tuple[str, float, Dict[str, Any]]:
+        """
+        Esegue call() con hedging.
+
+        Returns:
+            (risposta, latenza della prima risposta, token_usage) con in token_usage
+            "hedged" e "hedge_won"
+        """
+        start = time.perf_counter()
+        delay = self.hedge_delay()
+        with self._lock:
+            self.requests += 1
+
+        if delay is None:
+            (answer, _, token_usage), elapsed = self._timed(call)
+            with self._lock:
+                self.first_latencies.append(elapsed)
+                self.primary_latencies.append(elapsed)
+            return answer, elapsed, {**token_usage, "hedged": False, "hedge_won": False}
+
+        executor = self._pool()
+        primary = executor.submit(self._timed, call)
+        primary.add_done_callback(self._record_primary)
+        done, _ = wait([primary], timeout=delay)
+        futures = [primary]
+        if not done:
+            with self._lock:
+                self.hedges += 1
+            futures.append(executor.submit(self._timed, call))
+
+        winner = None
+        pending = set(futures)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in futures if future in done and future.exception() is None), None)
+        if winner is None:
+            # Entrambe fallite: errore della richiesta originale
+            primary.result()
+
+        for future in futures:
+            if future is not winner:
+                future.cancel()
+                future.add_done_callback(self._record_discarded)
+
+        elapsed = time.perf_counter() - start
+        hedge_won = winner is not primary
+        with self._lock:
+            self.first_latencies.append(elapsed)
+            self.hedge_wins += hedge_won
+        (answer, _, token_usage), _ = winner.result()
+        return answer, elapsed, {**token_usage, "hedged": len(futures) > 1, "hedge_won": hedge_won}
+
+    def metrics(self) -> Dict[str, Any]:
+        """Contatori di hedging e percentili di latenza prima risposta / richiesta originale."""
+        with self._lock:
+            metrics = {
+                "hedge_percentile": self.hedge_percentile,
+                "hedge_requests": self.hedges,
+                "hedge_rate": self.hedges / self.requests if self.requests else 0.0,
+                "hedge_wins": self.hedge_wins,
+                "hedge_extra_prompt_tokens": self.extra_prompt_tokens,
+                "hedge_extra_completion_tokens": self.extra_completion_tokens,
+            }
+            for pct in (50, 95, 99):
+                metrics[f"latency_first_p{pct}"] = percentile(self.first_latencies, pct)
+                metrics[f"latency_primary_p{pct}"] = percentile(self.primary_latencies, pct)
+        return {key: value for key, value in metrics.items() if value is not None}
+
+
+def ledger_recorder(cost_ledger, model_key: str, model_config: Dict[str, Any]) -> Callable[[Dict[str, Any]], None]:
+    """on_discarded che registra nel CostLedger il costo di ogni risposta scartata."""
+    def record(token_usage: Dict[str, Any]):
+        cost = calculate_cost(
+            token_usage.get('prompt_tokens', 0),
+            token_usage.get('completion_tokens', 0),
+            model_config['input_price_per_1m'],
+            model_config['output_price_per_1m'],
+        )
+        cost_ledger.record(model_key, cost, token_usage.get("api_key_id"))
+    return record
+
+
+def hedging_metrics(client, model_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Metriche di hedging del client con il costo extra ai prezzi del modello ({} senza hedging)."""
+    if getattr(client, "hedging", None) is None:
+        return {}
+    metrics = client.hedging.metrics()
+    metrics["hedge_extra_cost"] = calculate_cost(
+        metrics["hedge_extra_prompt_tokens"],
+        metrics["hedge_extra_completion_tokens"],
+        model_config['input_price_per_1m'],
+        model_config['output_price_per_1m'],
+    )
+    return metrics
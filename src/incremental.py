@@ -0,0 +1,143 @@
+"""
+Re-run differenziali basati su hash di contenuto.
+
+Ogni risultato per esempio dei runner porta tre hash (nei campi extra dei
+record dell'archivio):
+
+- example_hash: il test case del dataset (input e risposta attesa)
+- prompt_hash: system prompt, prompt utente renderizzato e max_new_tokens
+  (cambia con prompt.json, la compattazione o il contesto della task)
+- model_hash: id del modello, provider e temperatura
+
+Con --incremental il runner confronta ogni esempio con la run di
+riferimento (l'ultima dello stesso modello sulla task con hash, o quella
+indicata per run_id) e chiama il modello solo se prompt_hash o model_hash
+sono cambiati o l'esempio è nuovo. Le risposte riutilizzate vengono
+rivalutate sul test case attuale, quindi una correzione della sola
+risposta attesa non richiede chiamate; il costo è ricalcolato ai prezzi
+attuali. Le metriche aggregate sono ricalcolate su tutti gli esempi e la
+nuova run (completa) diventa il riferimento per la successiva.
+
+    python main_tool_calling.py --models llama3.1-8b --incremental
+    python main_tool_calling.py --models llama3.1-8b --incremental 42
+"""
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.metrics import calculate_cost
+
+HASH_FIELDS = ("example_hash", "prompt_hash", "model_hash")
+# Run recenti esaminate per trovare un riferimento con gli hash
+MAX_REFERENCE_CANDIDATES = 20
+
+
+def content_hash(value: Any) -> str:
+    """SHA-256 (primi 16 caratteri esadecimali) della forma JSON canonica di value."""
+    canonical = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def record_hashes(
+    test_case: Dict[str, Any],
+    system_prompt: str,
+    user_prompt: str,
+    model_config: Dict[str, Any],
+    max_new_tokens: int,
+    temperature: float,
+) -> Dict[str, str]:
+    """Hash di test case, prompt renderizzato e configurazione del modello di un esempio."""
+    return {
+        "example_hash": content_hash(test_case),
+        "prompt_hash": content_hash([system_prompt, user_prompt, max_new_tokens]),
+        "model_hash": content_hash([model_config['id'], model_config['provider'], temperature]),
+    }
+
+
+class ReferenceRun:
+    """Record per esempio di una run di riferimento con i contatori di riuso."""
+
+    def __init__(self, run_id: int, records: List[Dict[str, Any]]):
+        self.run_id = run_id
+        # Chiave (example_id, attempt): la task judge ripete i test di consistenza
+        self.records = {(str(record['example_id']), record.get('attempt', 0)): record for record in records}
+        self.reused = 0
+        self.rescored = 0
+        self.rerun = 0
+
+    def reuse(
+        self,
+        example_id: Any,
+        hashes: Dict[str, str],
+        model_config: Dict[str, Any],
+        attempt: int = 0,
+    ) -> Optional[Tuple[str, float, float, Dict[str, int]]]:
+        """
+        Risultato riutilizzabile per l'esempio.
+
+        Returns:
+            (risposta, latenza, costo ai prezzi attuali, token_usage), oppure
+            None se l'esempio va rieseguito
+        """
+        record = self.records.get((str(example_id), attempt))
+        if (
+            record is None
+            or record.get('prompt_hash') != hashes['prompt_hash']
+            or record.get('model_hash') != hashes['model_hash']
+        ):
+            self.rerun += 1
+            return None
+        self.reused += 1
+        if record.get('example_hash') != hashes['example_hash']:
+            # Stesso prompt, risposta attesa cambiata: basta rivalutare
+            self.rescored += 1
+        token_usage = {
+            "prompt_tokens": record['prompt_tokens'],
+            "completion_tokens": record['completion_tokens'],
+        }
+        cost = calculate_cost(
+            token_usage['prompt_tokens'],
+            token_usage['completion_tokens'],
+            model_config['input_price_per_1m'],
+            model_config['output_price_per_1m'],
+        )
+        return record['predicted'], record['latency'], cost, token_usage
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "incremental_reference_run_id": self.run_id,
+            "incremental_reused": self.reused,
+            "incremental_rescored": self.rescored,
+            "incremental_rerun": self.rerun,
+        }
+
+
+def _has_hashes(records: List[Dict[str, Any]]) -> bool:
+    return bool(records) and all(field in records[0] for field in HASH_FIELDS)
+
+
+def load_reference(store, task: str, model_key: str, run_id: Optional[str] = None) -> Optional[ReferenceRun]:
+    """
+    Run di riferimento per --incremental.
+
+    Args:
+        store: ResultsStore con le run precedenti
+        task: Nome task
+        model_key: Chiave del modello
+        run_id: Run esplicita (None o "latest": l'ultima del modello sulla task con hash)
+
+    Returns:
+        ReferenceRun, o None se non esiste una run con hash (si eseguono tutti gli esempi)
+    """
+    if run_id and run_id != "latest":
+        records = store.get_records(int(run_id))
+        if not _has_hashes(records):
+            raise ValueError(f"La run {run_id} non ha risultati per esempio con hash")
+        return ReferenceRun(int(run_id), records)
+
+    for run in store.query_runs(task=task, model=model_key, limit=MAX_REFERENCE_CANDIDATES):
+        records = store.get_records(run['run_id'])
+        if _has_hashes(records):
+            return ReferenceRun(run['run_id'], records)
+    print(f"[!] Nessuna run di riferimento con hash per {task}/{model_key}: eseguo tutti gli esempi")
+    return None
@@ -1,51 +1,72 @@
 """
 Client per l'inferenza dei modelli (OpenAI, TogetherAI, Google AI Studio, Anthropic ).
+
+Gli SDK dei provider vengono importati solo quando il provider è usato.
+Le API key dei provider OpenAI-compatibili e Anthropic arrivano dal pool del
+provider (src.key_pool): un client SDK per chiave, scelta a ogni richiesta.
 """
 import os
 import time
-from typing import Dict, Tuple
-from openai import OpenAI
-import google.generativeai as genai
+from contextlib import nullcontext
+from typing import Dict, Optional, Tuple
+
+from src.concurrency import MAX_RATE_LIMIT_RETRIES, get_controller, is_rate_limit_error, retry_after_seconds
+from src.key_pool import get_key_pool, is_invalid_key_error, load_api_keys
+from src.tracing import get_tracer, record_span, span
+
+# Risposta del provider mock: JSON in un blocco ```json per esercitare il parsing delle metriche
+MOCK_RESPONSE = '```json\n{"agent": "mock", "tool": "mock", "parameters": {}, "approved": true, "retrieved_data": {}}\n```'
 
 
 class ModelInferenceClient:
     
-    def __init__(self, model_id: str, provider: str = "cerebras"):
+    def __init__(self, model_id: str, provider: str = "cerebras", adaptive: bool = True, hedging=None):
         """        
         Args:
             model_id: ID del modello
             provider: Provider del modello ("cerebras", "openai", "openrouter", "google", o "nvidia")
+            adaptive: Concorrenza adattiva (AIMD) e retry dei 429, condivisa per (provider, modello);
+                False per osservare il comportamento grezzo del provider (es. load test)
+            hedging: HedgingPolicy opzionale (src.hedging): oltre il percentile di latenza
+                configurato invia un duplicato e usa la prima risposta
         """
         self.model_id = model_id
         self.provider = provider
+        self.hedging = hedging
+        self.controller = get_controller(provider, model_id) if adaptive and provider != "mock" else None
+        self.key_pool = None
+        # Client SDK per key_id del pool
+        self._clients = {}
         
-        if provider == "togetherai":
-            api_key = os.getenv('TOGETHERAI_API_KEY')
-            if not api_key:
-                raise ValueError("TOGETHERAI_API_KEY non trovato nel file .env")
-            self.client = OpenAI(
-                api_key=api_key,
-                base_url="https://api.together.xyz/v1"
-            )
+        if provider == "mock":
+            # Nessun SDK: risposta fissa e latenza zero
+            self.client = None
+            self.mock_response = os.getenv('MOCK_RESPONSE', MOCK_RESPONSE)
+        elif provider == "togetherai":
+            self.key_pool = get_key_pool(provider)
+            from openai import OpenAI
+            self._clients = {
+                key_id: OpenAI(api_key=api_key, base_url="https://api.together.xyz/v1")
+                for key_id, api_key in self.key_pool.keys.items()
+            }
         elif provider == "openai":
-            api_key = os.getenv('OPENAI_API_KEY')
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY non trovato nel file .env")
-            self.client = OpenAI(api_key=api_key)
+            self.key_pool = get_key_pool(provider)
+            from openai import OpenAI
+            self._clients = {key_id: OpenAI(api_key=api_key) for key_id, api_key in self.key_pool.keys.items()}
         elif provider == "anthropic":
-            api_key = os.getenv('ANTHROPIC_API_KEY')
-            if not api_key:
-                raise ValueError("ANTHROPIC_API_KEY non trovato nel file .env")
+            self.key_pool = get_key_pool(provider)
             from anthropic import Anthropic
-            self.client = Anthropic(api_key=api_key)
+            self._clients = {key_id: Anthropic(api_key=api_key) for key_id, api_key in self.key_pool.keys.items()}
         elif provider == "google":
-            api_key = os.getenv('GOOGLE_API_KEY')
-            if not api_key:
-                raise ValueError("GOOGLE_API_KEY non trovato nel file .env")
-            genai.configure(api_key=api_key)
+            # genai.configure è globale al processo: nessuna rotazione, si usa la prima chiave
+            import google.generativeai as genai
+            genai.configure(api_key=load_api_keys(provider)[0])
+            self.genai = genai
             self.client = None  # Google usa API diversa
         else:
-            raise ValueError(f"Provider '{provider}' non supportato. Usa 'togetherai', 'openai', 'anthropic', o 'google'.")
+            raise ValueError(f"Provider '{provider}' non supportato. Usa 'togetherai', 'openai', 'anthropic', 'google' o 'mock'.")
+        if self._clients:
+            self.client = next(iter(self._clients.values()))
     
     def generate(
         self,
@@ -54,20 +75,136 @@ class ModelInferenceClient:
         max_new_tokens: int = 50,
         temperature: float = 0.0,
         top_p: float = 0.95,
+        logprobs: bool = False,
     ) -> Tuple[str, float, Dict[str, int]]:
         """
         Genera una risposta dal modello.
+
+        Con il tracing attivo registra lo span "generate" e le sue fasi di rete.
+        Con il controller adattivo la richiesta attende un posto sotto il limite
+        di concorrenza e, se rifiutata con 429, viene ripetuta dopo la pausa.
+        Con il pool di chiavi ogni tentativo usa la chiave scelta dal pool:
+        dopo un 429 va in pausa solo quella chiave, una chiave invalida viene
+        rimossa e la richiesta ripetuta con un'altra.
         Args:
             system_prompt: Prompt di sistema
             user_prompt: Prompt dell'utente
             max_new_tokens: Numero massimo di token da generare
             temperature: Temperatura per il sampling (0.0 per deterministico)
             top_p: Parametro top-p per nucleus sampling
+            logprobs: Richiedi i logprob dei token (solo provider OpenAI-compatibili);
+                se disponibili, token_usage contiene anche "mean_logprob"
         
         Returns:
-            Tupla (risposta, latenza_in_secondi, token_usage)
+            Tupla (risposta, latenza_in_secondi, token_usage); con il pool di chiavi
+            token_usage contiene anche "api_key_id" per l'attribuzione della spesa,
+            con l'hedging "hedged" e "hedge_won" (la latenza è quella della prima risposta)
+        """
+        with span("generate", cat="inference", model=self.model_id, provider=self.provider):
+            if self.hedging is not None:
+                return self.hedging.run(lambda: self._request(
+                    system_prompt, user_prompt, max_new_tokens, temperature, top_p, logprobs,
+                ))
+            return self._request(system_prompt, user_prompt, max_new_tokens, temperature, top_p, logprobs)
+
+    def _request(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        logprobs: bool,
+    ) -> Tuple[str, float, Dict[str, int]]:
+        """Una richiesta con controller di concorrenza, pool di chiavi e retry dei 429."""
+        if self.controller is None and self.key_pool is None:
+            return self._generate(system_prompt, user_prompt, max_new_tokens, temperature, top_p, logprobs)
+
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            started_at = None
+            with self.key_pool.acquire() if self.key_pool is not None else nullcontext() as key_id:
+                try:
+                    with self.controller.slot() if self.controller is not None else nullcontext() as started_at:
+                        result = self._generate(system_prompt, user_prompt, max_new_tokens, temperature, top_p,
+                                                logprobs, key_id)
+                except Exception as e:
+                    if key_id is not None and is_invalid_key_error(e) and attempt < MAX_RATE_LIMIT_RETRIES:
+                        self.key_pool.remove(key_id, "invalida o senza credito")
+                        continue
+                    if self.controller is None or not is_rate_limit_error(e) or attempt == MAX_RATE_LIMIT_RETRIES:
+                        raise
+                    retry_after = retry_after_seconds(e)
+                    # Con altre chiavi libere va in pausa solo la chiave limitata
+                    all_paused = self.key_pool.on_throttle(key_id, retry_after) if key_id is not None else True
+                    self.controller.on_throttle(retry_after if all_paused else 0.0, started_at)
+                    continue
+            if self.controller is not None:
+                self.controller.on_success()
+            if key_id is not None:
+                result[2]["api_key_id"] = key_id
+            return result
+
+    def concurrency_metrics(self) -> Dict[str, float]:
+        """Stato del controller di concorrenza per le metriche della run ({} senza controller)."""
+        return self.controller.snapshot() if self.controller is not None else {}
+
+    def _observe_headers(self, key_id: Optional[str], headers):
+        if key_id is not None:
+            self.key_pool.observe_headers(key_id, headers)
+        # Con più chiavi gli header descrivono la quota di una sola chiave, non del modello
+        if self.controller is not None and (self.key_pool is None or len(self.key_pool) == 1):
+            self.controller.observe_headers(headers)
+
+    def _create_completion(self, key_id: Optional[str] = None, **request) -> object:
+        """
+        Chiama l'endpoint chat completions (con il client SDK della chiave key_id).
+
+        Con il tracing attivo usa la risposta in streaming dell'SDK per separare
+        il tempo fino agli header (connessione + attesa del server) dalla
+        lettura del body; l'SDK non espone la sola fase di connessione.
         """
+        client = self._clients[key_id] if key_id is not None else self.client
+        if get_tracer() is None:
+            if self.controller is None and key_id is None:
+                return client.chat.completions.create(**request)
+            raw_response = client.chat.completions.with_raw_response.create(**request)
+            # Header x-ratelimit-* per il controller di concorrenza e lo stato della chiave
+            self._observe_headers(key_id, raw_response.headers)
+            return raw_response.parse()
+
+        request_start = time.perf_counter_ns()
+        with client.chat.completions.with_streaming_response.create(**request) as raw_response:
+            headers_received = time.perf_counter_ns()
+            self._observe_headers(key_id, raw_response.headers)
+            response = raw_response.parse()
+            body_read = time.perf_counter_ns()
+        record_span("http.connect_to_first_byte", request_start, headers_received, cat="network",
+                    status=raw_response.status_code)
+        record_span("http.read_body", headers_received, body_read, cat="network")
+        return response
+
+    def _generate(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        logprobs: bool = False,
+        key_id: Optional[str] = None,
+    ) -> Tuple[str, float, Dict[str, int]]:
         start_time = time.time()
+
+        if self.provider == "mock":
+            # Stima grossolana dei token (~4 caratteri per token)
+            prompt_tokens = (len(system_prompt) + len(user_prompt)) // 4
+            completion_tokens = len(self.mock_response) // 4
+            token_usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            }
+            return self.mock_response, time.time() - start_time, token_usage
         
         # Google AI Studio usa API diversa
         if self.provider == "google":
@@ -76,17 +213,18 @@ class ModelInferenceClient:
                 full_prompt = f"{system_prompt}\n\n{user_prompt}"
                 
                 # Crea modello Gemini
-                model = genai.GenerativeModel(self.model_id)
+                model = self.genai.GenerativeModel(self.model_id)
                 
                 # Genera risposta
-                response = model.generate_content(
-                    full_prompt,
-                    generation_config=genai.GenerationConfig(
-                        max_output_tokens=max_new_tokens,
-                        temperature=temperature,
-                        top_p=top_p,
+                with span("http.request", cat="network"):
+                    response = model.generate_content(
+                        full_prompt,
+                        generation_config=self.genai.GenerationConfig(
+                            max_output_tokens=max_new_tokens,
+                            temperature=temperature,
+                            top_p=top_p,
+                        )
                     )
-                )
                 
                 latency = time.time() - start_time
                 
@@ -103,7 +241,7 @@ class ModelInferenceClient:
                 return answer, latency, token_usage
                 
             except Exception as e:
-                raise RuntimeError(f"Errore durante la generazione con Google AI Studio: {str(e)}")
+                raise RuntimeError(f"Errore durante la generazione con Google AI Studio: {str(e)}") from e
         
         # OpenAI-compatible providers (Cerebras, OpenAI, TogetherAI, Anthropic)
         messages = [
@@ -111,14 +249,18 @@ class ModelInferenceClient:
             {"role": "user", "content": user_prompt},
         ]
         
+        request = {
+            "messages": messages,
+            "model": self.model_id,
+            "max_tokens": max_new_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+        }
+        if logprobs:
+            request["logprobs"] = True
+        
         try:
-            response = self.client.chat.completions.create(
-                messages=messages,
-                model=self.model_id,
-                max_tokens=max_new_tokens,
-                temperature=temperature,
-                top_p=top_p,
-            )
+            response = self._create_completion(key_id, **request)
             
             latency = time.time() - start_time
             
@@ -132,7 +274,13 @@ class ModelInferenceClient:
                 "total_tokens": response.usage.total_tokens if response.usage else 0,
             }
             
+            # Logprob medio dei token generati (confidenza del modello)
+            choice_logprobs = getattr(response.choices[0], "logprobs", None)
+            if logprobs and choice_logprobs is not None and choice_logprobs.content:
+                token_logprobs = [token.logprob for token in choice_logprobs.content]
+                token_usage["mean_logprob"] = sum(token_logprobs) / len(token_logprobs)
+            
             return answer, latency, token_usage
             
         except Exception as e:
-            raise RuntimeError(f"Errore durante l'inferenza con {self.model_id}: {str(e)}")
+            raise RuntimeError(f"Errore durante l'inferenza con {self.model_id}: {str(e)}") from e
@@ -0,0 +1,213 @@
+"""
+Pool di API key per provider con rotazione e stato di rate limit per chiave.
+
+Ogni chiave di progetto ha una quota separata: distribuire le richieste su
+più chiavi moltiplica i limiti per chiave. Le chiavi si leggono da
+<PROVIDER>_API_KEYS (separate da virgola) oppure, come prima, dalla singola
+<PROVIDER>_API_KEY:
+
+    OPENAI_API_KEYS=sk-progetto-a,sk-progetto-b,sk-progetto-c
+
+Selezione (API_KEY_POOL_STRATEGY nel .env):
+- least_loaded (default): la chiave attiva con meno richieste in volo,
+  a parità quella con più richieste rimaste secondo gli header
+- round_robin: le chiavi attive a turno
+
+Una chiave che riceve un 429 resta in pausa fino al retry-after/reset; una
+chiave invalida (401/403) o senza credito (insufficient_quota) viene
+rimossa dal pool per il resto del processo. Ogni richiesta riporta l'id
+della chiave (token_usage["api_key_id"]) per attribuire la spesa nel cost
+ledger. Gli id non contengono la chiave, solo le ultime 4 cifre.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Mapping, Optional
+
+from src.concurrency import parse_ratelimit_headers
+
+KEY_POOL_STRATEGIES = ("least_loaded", "round_robin")
+DEFAULT_KEY_POOL_STRATEGY = "least_loaded"
+
+# Prefisso delle variabili d'ambiente per provider (<PREFIX>_API_KEY / <PREFIX>_API_KEYS)
+PROVIDER_ENV_PREFIXES = {
+    "togetherai": "TOGETHERAI",
+    "openai": "OPENAI",
+    "anthropic": "ANTHROPIC",
+    "google": "GOOGLE",
+}
+
+# Pausa di una chiave dopo un 429 senza retry-after
+DEFAULT_KEY_PAUSE = 1.0
+
+
+class NoAvailableKeyError(RuntimeError):
+    """Tutte le chiavi del provider sono state rimosse (invalide o senza credito)."""
+
+
+def load_api_keys(provider: str) -> List[str]:
+    """Chiavi del provider da <PREFIX>_API_KEYS o, in alternativa, da <PREFIX>_API_KEY."""
+    prefix = PROVIDER_ENV_PREFIXES[provider]
+    pooled = os.getenv(f"{prefix}_API_KEYS")
+    if pooled:
+        keys = [key.strip() for key in pooled.split(",") if key.strip()]
+    else:
+        keys = [os.getenv(f"{prefix}_API_KEY")] if os.getenv(f"{prefix}_API_KEY") else []
+    if not keys:
+        raise ValueError(f"{prefix}_API_KEY non trovato nel file .env")
+    # Chiavi ripetute contano una volta sola
+    return list(dict.fromkeys(keys))
+
+
+def is_invalid_key_error(exc: BaseException) -> bool:
+    """True per errori di autenticazione (401/403) o credito esaurito, anche se avvolti."""
+    while exc is not None:
+        if getattr(exc, "status_code", None) in (401, 403) or "insufficient_quota" in str(exc):
+            return True
+        exc = exc.__cause__
+    return False
+
+
+class _KeyState:
+    def __init__(self, key_id: str, key: str):
+        self.key_id = key_id
+        self.key = key
+        self.in_flight = 0
+        self.requests = 0
+        self.throttles = 0
+        self.paused_until = 0.0
+        self.remaining_requests: Optional[int] = None
+        self.removed: Optional[str] = None
+
+
+class KeyPool:
+    """Chiavi di un provider con selezione least-loaded o round-robin, thread-safe."""
+
+    def __init__(self, provider: str, keys: List[str], strategy: str = DEFAULT_KEY_POOL_STRATEGY):
+        if strategy not in KEY_POOL_STRATEGIES:
+            raise ValueError(f"Strategia '{strategy}' non supportata. Disponibili: {', '.join(KEY_POOL_STRATEGIES)}")
+        self.provider = provider
+        self.strategy = strategy
+        self._states = [_KeyState(f"{provider}-{index}-{key[-4:]}", key) for index, key in enumerate(keys)]
+        self._cond = threading.Condition()
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    @property
+    def keys(self) -> Dict[str, str]:
+        """{key_id: chiave} di tutte le chiavi del pool (anche rimosse)."""
+        return {state.key_id: state.key for state in self._states}
+
+    def _active(self) -> List[_KeyState]:
+        return [state for state in self._states if state.removed is None]
+
+    def _pick(self, ready: List[_KeyState]) -> _KeyState:
+        if self.strategy == "round_robin":
+            for offset in range(len(self._states)):
+                state = self._states[(self._next + offset) % len(self._states)]
+                if state in ready:
+                    self._next = (self._states.index(state) + 1) % len(self._states)
+                    return state
+        return min(ready, key=lambda state: (
+            state.in_flight,
+            -(state.remaining_requests if state.remaining_requests is not None else float("inf")),
+            state.requests,
+        ))
+
+    @contextmanager
+    def acquire(self):
+        """
+        Sceglie una chiave attiva non in pausa (attende se sono tutte in pausa).
+
+        Yields:
+            key_id della chiave scelta (la chiave è in keys[key_id])
+        """
+        with self._cond:
+            while True:
+                active = self._active()
+                if not active:
+                    raise NoAvailableKeyError(f"Nessuna API key disponibile per {self.provider}: "
+                                              + "; ".join(f"{state.key_id} {state.removed}" for state in self._states))
+                now = time.monotonic()
+                ready = [state for state in active if state.paused_until <= now]
+                if ready:
+                    break
+                self._cond.wait(min(state.paused_until for state in active) - now)
+            state = self._pick(ready)
+            state.in_flight += 1
+            state.requests += 1
+        try:
+            yield state.key_id
+        finally:
+            with self._cond:
+                state.in_flight -= 1
+                self._cond.notify_all()
+
+    def _state(self, key_id: str) -> _KeyState:
+        return next(state for state in self._states if state.key_id == key_id)
+
+    def observe_headers(self, key_id: str, headers: Optional[Mapping[str, str]]):
+        """Richieste rimaste e pausa a quota esaurita dagli header x-ratelimit-* della chiave."""
+        parsed = parse_ratelimit_headers(headers)
+        with self._cond:
+            state = self._state(key_id)
+            if parsed["remaining_requests"] is not None:
+                state.remaining_requests = parsed["remaining_requests"]
+            for remaining, reset in (("remaining_requests", "reset_requests"), ("remaining_tokens", "reset_tokens")):
+                if parsed[remaining] == 0 and parsed[reset]:
+                    state.paused_until = max(state.paused_until, time.monotonic() + parsed[reset])
+
+    def on_throttle(self, key_id: str, retry_after: Optional[float] = None) -> bool:
+        """
+        Mette in pausa la chiave dopo un 429.
+
+        Returns:
+            True se nessun'altra chiave attiva è disponibile subito
+        """
+        with self._cond:
+            state = self._state(key_id)
+            state.throttles += 1
+            now = time.monotonic()
+            state.paused_until = max(state.paused_until, now + (retry_after or DEFAULT_KEY_PAUSE))
+            self._cond.notify_all()
+            return not any(other.paused_until <= now for other in self._active())
+
+    def remove(self, key_id: str, reason: str):
+        """Rimuove una chiave invalida o senza credito."""
+        with self._cond:
+            state = self._state(key_id)
+            if state.removed is None:
+                state.removed = reason
+                print(f"[!] API key {key_id} rimossa dal pool: {reason}")
+            self._cond.notify_all()
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Stato per chiave (senza la chiave)."""
+        with self._cond:
+            return [
+                {
+                    "key_id": state.key_id,
+                    "requests": state.requests,
+                    "throttles": state.throttles,
+                    "in_flight": state.in_flight,
+                    "remaining_requests": state.remaining_requests,
+                    "removed": state.removed,
+                }
+                for state in self._states
+            ]
+
+
+_pools: Dict[str, KeyPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_key_pool(provider: str) -> KeyPool:
+    """Pool condiviso del provider nel processo (le quote sono per chiave, non per modello)."""
+    with _pools_lock:
+        if provider not in _pools:
+            strategy = os.getenv("API_KEY_POOL_STRATEGY", DEFAULT_KEY_POOL_STRATEGY)
+            _pools[provider] = KeyPool(provider, load_api_keys(provider), strategy)
+        return _pools[provider]
@@ -0,0 +1,341 @@
+"""
+Load test dei provider: curve latenza/throughput al variare del carico.
+
+Riproduce i prompt di una task tramite ModelInferenceClient in due modalità:
+- concurrency: closed-loop a gradini (N worker che inviano richieste in
+  sequenza per la durata del gradino)
+- rate: open-loop con arrivi di Poisson a un tasso obiettivo (richieste/s);
+  la latenza parte dall'arrivo programmato, quindi include l'attesa in coda
+  e non soffre di coordinated omission
+
+Per ogni gradino registra throughput, tasso di errori e di 429, p50/p95/p99
+della latenza; individua il punto di saturazione e salva JSON, CSV e il
+grafico latenza-vs-throughput per modello.
+
+Uso:
+    python -m src.loadtest --task routing --models gpt-4o-mini --concurrency 1,2,4,8,16
+    python -m src.loadtest --task rag --models gpt-4o-mini,gpt-4o --rates 1,2,5,10 --duration 60
+"""
+import argparse
+import csv
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import cycle
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from src.concurrency import RATE_LIMIT_PATTERN
+from src.data_loader import load_test_cases
+from src.env import load_dotenv
+from src.inference_client import ModelInferenceClient
+from src.metrics import percentile
+from src.model_config import get_model_config
+from src.task_specs import get_task_spec
+
+# Soglie per il punto di saturazione
+MIN_THROUGHPUT_GAIN = 0.05
+MAX_LATENCY_FACTOR = 2.0
+MAX_ERROR_RATE = 0.05
+
+
+class StepRecorder:
+    """Raccoglie in modo thread-safe gli esiti delle richieste di un gradino."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.rate_limited = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency: Optional[float], error: Optional[str] = None):
+        with self._lock:
+            if error is None:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+                if RATE_LIMIT_PATTERN.search(error):
+                    self.rate_limited += 1
+
+    def summary(self, mode: str, load: float, elapsed: float) -> Dict[str, Any]:
+        total = len(self.latencies) + self.errors
+        return {
+            "mode": mode,
+            "load": load,
+            "requests": total,
+            "successes": len(self.latencies),
+            "elapsed": elapsed,
+            "throughput": len(self.latencies) / elapsed if elapsed > 0 else 0.0,
+            "error_rate": self.errors / total if total else 0.0,
+            "rate_429": self.rate_limited / total if total else 0.0,
+            "p50": percentile(self.latencies, 50),
+            "p95": percentile(self.latencies, 95),
+            "p99": percentile(self.latencies, 99),
+        }
+
+
+def _call(client, system_prompt: str, user_prompt: str, max_new_tokens: int, recorder: StepRecorder, started: float):
+    try:
+        client.generate(system_prompt=system_prompt, user_prompt=user_prompt, max_new_tokens=max_new_tokens)
+        recorder.record(time.perf_counter() - started)
+    except Exception as e:
+        recorder.record(None, str(e))
+
+
+def run_concurrency_step(
+    client,
+    system_prompt: str,
+    prompts: List[str],
+    concurrency: int,
+    duration: float,
+    max_new_tokens: int,
+) -> Dict[str, Any]:
+    """Closed-loop: `concurrency` worker inviano richieste una dopo l'altra per `duration` secondi."""
+    recorder = StepRecorder()
+    prompt_iter = cycle(prompts)
+    prompt_lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            with prompt_lock:
+                user_prompt = next(prompt_iter)
+            _call(client, system_prompt, user_prompt, max_new_tokens, recorder, time.perf_counter())
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker, name=f"loadtest-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder.summary("concurrency", concurrency, time.perf_counter() - start)
+
+
+def run_rate_step(
+    client,
+    system_prompt: str,
+    prompts: List[str],
+    rate: float,
+    duration: float,
+    max_new_tokens: int,
+    max_in_flight: int = 256,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """Open-loop: arrivi di Poisson a `rate` richieste/s per `duration` secondi."""
+    recorder = StepRecorder()
+    rng = random.Random(seed)
+    prompt_iter = cycle(prompts)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="loadtest") as executor:
+        arrival = start
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival - start >= duration:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # La latenza parte dall'arrivo programmato, non dall'invio effettivo
+            executor.submit(_call, client, system_prompt, next(prompt_iter), max_new_tokens, recorder, arrival)
+    return recorder.summary("rate", rate, time.perf_counter() - start)
+
+
+def find_saturation(
+    steps: List[Dict[str, Any]],
+    min_gain: float = MIN_THROUGHPUT_GAIN,
+    latency_factor: float = MAX_LATENCY_FACTOR,
+    max_error_rate: float = MAX_ERROR_RATE,
+) -> Optional[int]:
+    """
+    Indice del gradino di saturazione (l'ultimo "sano" prima del degrado).
+
+    Un gradino è degradato se il tasso di errori supera max_error_rate, se il
+    p95 supera latency_factor volte quello del primo gradino o se il
+    throughput cresce meno di min_gain rispetto al gradino precedente.
+    Restituisce None se nessun gradino degrada (saturazione non raggiunta).
+    """
+    base_p95 = next((step["p95"] for step in steps if step["p95"] is not None), None)
+    for i, step in enumerate(steps):
+        if i == 0:
+            continue
+        previous = steps[i - 1]
+        degraded = (
+            step["error_rate"] > max_error_rate
+            or (base_p95 is not None and step["p95"] is not None and step["p95"] > latency_factor * base_p95)
+            or step["throughput"] < previous["throughput"] * (1 + min_gain)
+        )
+        if degraded:
+            return i - 1
+    return None
+
+
+def run_loadtest(
+    model_key: str,
+    system_prompt: str,
+    prompts: List[str],
+    concurrency_levels: Optional[List[int]] = None,
+    rates: Optional[List[float]] = None,
+    duration: float = 30.0,
+    max_new_tokens: int = 50,
+    client_factory: Callable[[Dict[str, Any]], Any] = None,
+) -> Dict[str, Any]:
+    """Esegue tutti i gradini per un modello e restituisce gradini e saturazione."""
+    model_config = get_model_config(model_key)
+    if client_factory is None:
+        client = ModelInferenceClient(model_config['id'], provider=model_config['provider'], adaptive=False)
+    else:
+        client = client_factory(model_config)
+
+    steps = []
+    for level in concurrency_levels or []:
+        step = run_concurrency_step(client, system_prompt, prompts, level, duration, max_new_tokens)
+        steps.append(step)
+        _print_step(step)
+    for rate in rates or []:
+        step = run_rate_step(client, system_prompt, prompts, rate, duration, max_new_tokens)
+        steps.append(step)
+        _print_step(step)
+
+    # Saturazione calcolata separatamente per ciascuna serie (concorrenza / tasso)
+    saturation = {}
+    for mode in ("concurrency", "rate"):
+        series = [step for step in steps if step["mode"] == mode]
+        if series:
+            knee = find_saturation(series)
+            saturation[mode] = None if knee is None else series[knee]["load"]
+            for i, step in enumerate(series):
+                step["saturation"] = i == knee
+    return {
+        "model": model_key,
+        "model_name": model_config['name'],
+        "provider": model_config['provider'],
+        "steps": steps,
+        "saturation": saturation,
+    }
+
+
+def _fmt_ms(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.0f}"
+
+
+def _print_step(step: Dict[str, Any]):
+    label = f"c={step['load']}" if step["mode"] == "concurrency" else f"{step['load']} req/s"
+    print(f"  {label:<12} {step['requests']:>6} req  {step['throughput']:>7.2f} ok/s  "
+          f"err {step['error_rate']:>6.1%}  429 {step['rate_429']:>6.1%}  "
+          f"p50 {_fmt_ms(step['p50']):>6} ms  p95 {_fmt_ms(step['p95']):>6} ms  p99 {_fmt_ms(step['p99']):>6} ms")
+
+
+def save_loadtest_results(results: List[Dict[str, Any]], output_dir: Path):
+    """Salva i risultati in JSON e CSV (una riga per gradino)."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "loadtest.json", "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    fields = ["model", "mode", "load", "requests", "successes", "elapsed", "throughput",
+              "error_rate", "rate_429", "p50", "p95", "p99", "saturation"]
+    with open(output_dir / "loadtest.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        for result in results:
+            for step in result["steps"]:
+                writer.writerow({"model": result["model"], **step})
+
+
+def plot_latency_throughput(results: List[Dict[str, Any]], output_path: Path, task: str):
+    """Grafico p50/p95 vs throughput per modello e serie; i punti di saturazione sono cerchiati."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(12, 8))
+    for result in results:
+        for mode in result["saturation"]:
+            steps = [step for step in result["steps"] if step["mode"] == mode and step["p50"] is not None]
+            if not steps:
+                continue
+            label = f"{result['model_name']} ({mode})"
+            throughput = [step["throughput"] for step in steps]
+            line, = ax.plot(throughput, [step["p50"] * 1000 for step in steps], marker="o", label=f"{label} p50")
+            ax.plot(throughput, [step["p95"] * 1000 for step in steps], marker="^", linestyle="--",
+                    color=line.get_color(), label=f"{label} p95")
+            for step in steps:
+                if step["saturation"]:
+                    ax.scatter([step["throughput"]], [step["p95"] * 1000], s=250, facecolors="none",
+                               edgecolors=line.get_color(), linewidths=2, zorder=5)
+
+    ax.set_xlabel("Throughput (richieste riuscite/s)")
+    ax.set_ylabel("Latenza (ms)")
+    ax.set_title(f"{task.upper()} - Latenza vs Throughput (cerchio = saturazione)")
+    ax.legend()
+    ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(output_path, dpi=150)
+    plt.close(fig)
+
+
+def _parse_list(value: Optional[str], cast) -> List:
+    return [cast(item) for item in value.split(",") if item.strip()] if value else []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test dei provider (latenza vs concorrenza/tasso)")
+    parser.add_argument("--task", required=True, help="Task da cui prendere i prompt")
+    parser.add_argument("--models", required=True, help="Chiavi dei modelli separate da virgola")
+    parser.add_argument("--concurrency", type=str, default=None,
+                        help="Gradini di concorrenza closed-loop (es. 1,2,4,8,16)")
+    parser.add_argument("--rates", type=str, default=None,
+                        help="Gradini open-loop in richieste/s con arrivi di Poisson (es. 1,2,5,10)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Durata di ogni gradino in secondi")
+    parser.add_argument("--sample", type=int, default=50, help="Prompt distinti (campione stratificato)")
+    parser.add_argument("--max-new-tokens", type=int, default=None, help="Default: quello della task")
+    parser.add_argument("--output-dir", type=str, default=None, help="Default: results/loadtest/<timestamp>")
+    parser.add_argument("--no-chart", action="store_true", help="Non generare il grafico")
+    args = parser.parse_args()
+
+    concurrency_levels = _parse_list(args.concurrency, int)
+    rates = _parse_list(args.rates, float)
+    if not concurrency_levels and not rates:
+        concurrency_levels = [1, 2, 4, 8, 16]
+
+    load_dotenv()
+    spec = get_task_spec(args.task)
+    test_cases = load_test_cases(spec.dataset_path, sample_size=args.sample)
+    prompts = [spec.render_user_prompt(test_case) for test_case in test_cases]
+    max_new_tokens = args.max_new_tokens or spec.max_new_tokens
+
+    output_dir = Path(args.output_dir or f"results/loadtest/{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    results = []
+    for model_key in _parse_list(args.models, str):
+        print(f"\n{'='*60}\nLoad test {model_key} ({args.task}, {len(prompts)} prompt)\n{'='*60}")
+        try:
+            result = run_loadtest(model_key, spec.system_prompt, prompts, concurrency_levels, rates,
+                                  args.duration, max_new_tokens)
+        except Exception as e:
+            print(f"ERRORE {model_key}: {str(e)}")
+            continue
+        results.append(result)
+        for step in result["steps"]:
+            if step["saturation"]:
+                print(f"  → Saturazione ({step['mode']}) a {step['load']}: {step['throughput']:.2f} ok/s, "
+                      f"p95 {_fmt_ms(step['p95'])} ms")
+        for mode, load in result["saturation"].items():
+            if load is None:
+                print(f"  → Saturazione ({mode}) non raggiunta: aumentare il carico")
+
+    if not results:
+        return
+    save_loadtest_results(results, output_dir)
+    if not args.no_chart:
+        try:
+            plot_latency_throughput(results, output_dir / f"{args.task}_latency_throughput.png", args.task)
+        except ImportError:
+            print("[!] matplotlib non disponibile: grafico saltato")
+    print(f"\nRisultati load test: {output_dir}/")
+
+
+if __name__ == "__main__":
+    main()
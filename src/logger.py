@@ -1,17 +1,37 @@
 """
 Sistema di logging per salvare risultati localmente e su Weights & Biases.
+
+Il tracking degli esperimenti passa da sink intercambiabili (W&B, JSONL
+locale, archivio risultati, no-op) alimentati da TrackingLogger, che
+accoda gli eventi e li consegna a batch da un thread in background: il
+loop di inferenza non si blocca mai su wandb.init o sulla rete.
+
+wandb viene importato solo all'avvio del primo run W&B.
 """
+import argparse
 import json
 import os
+import queue
+import subprocess
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any
-import wandb
+from typing import Dict, Any, List, Optional
+
+from src.tracing import span
 
 class ResultLogger:
-    """Gestisce il salvataggio dei risultati in locale."""
+    """Gestisce il salvataggio dei risultati in locale (JSON + archivio SQLite)."""
     
-    def __init__(self, results_dir: str = "results", run_timestamp: str = None):
+    def __init__(self, results_dir: str = "results", run_timestamp: str = None, store=None):
+        """
+        Args:
+            results_dir: Directory base dei risultati della task
+            run_timestamp: Timestamp della run (default: ora corrente)
+            store: ResultsStore opzionale su cui registrare run, config, record e metriche
+        """
+        self.store = store
         if run_timestamp is None:
             run_timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         
@@ -21,8 +41,20 @@ class ResultLogger:
         
         print(f"Risultati verranno salvati in: {self.results_dir}")
     
-    def save_results(self, results: Dict[str, Any], model_name: str):
-        """Salva i risultati in un file JSON locale."""
+    def save_results(
+        self,
+        results: Dict[str, Any],
+        model_name: str,
+        examples: Optional[List[Dict[str, Any]]] = None,
+    ):
+        """
+        Salva i risultati in un file JSON locale e, se configurato, nell'archivio.
+
+        Args:
+            results: Dict con config e metrics
+            model_name: Chiave del modello
+            examples: Risultati per esempio (example_id, predicted, latency, cost, ...)
+        """
         # Sostituisce / con _ per evitare sottodirectory
         safe_model_name = model_name.replace('/', '_')
         filename = self.results_dir / f"{safe_model_name}_results.json"
@@ -32,35 +64,339 @@ class ResultLogger:
 
         print(f"Risultati salvati in: {filename}")
 
+        if self.store is not None:
+            config = results['config']
+            self.store.save_run(
+                task=config.get('task', self.results_dir.parent.name),
+                model_key=model_name,
+                config=config,
+                metrics=results['metrics'],
+                run_timestamp=self.run_timestamp,
+                records=examples,
+                source_path=str(filename.resolve()),
+            )
+
+
+class TrackingSink:
+    """Interfaccia dei sink di tracking (tutti i metodi sono opzionali)."""
+
+    def start_run(self, model_name: str, config: Dict[str, Any], model_key: Optional[str] = None):
+        pass
+
+    def log_metrics(self, metrics: Dict[str, Any]):
+        pass
+
+    def log_examples(self, examples: List[Dict[str, Any]]):
+        pass
+
+    def finish_run(self):
+        pass
+
+    def close(self):
+        pass
+
 
-class WandBLogger:
-    """Gestisce il logging su Weights & Biases."""
+class NoOpSink(TrackingSink):
+    """Sink che scarta tutti gli eventi."""
+
+
+class WandBLogger(TrackingSink):
+    """Gestisce il logging su Weights & Biases (online o offline)."""
     
-    def __init__(self, project_name: str = "verabench"):
+    def __init__(self, project_name: str = "verabench", mode: str = "online", wandb_dir: Optional[str] = None):
+        """
+        Args:
+            project_name: Progetto W&B
+            mode: 'online' oppure 'offline' (run salvati in locale, da sincronizzare con sync)
+            wandb_dir: Directory in cui W&B salva i run locali
+        """
         self.project_name = project_name
+        self.mode = mode
+        self.wandb_dir = wandb_dir
         self.current_run = None
     
-    def start_run(self, model_name: str, config: Dict[str, Any]):
+    def start_run(self, model_name: str, config: Dict[str, Any], model_key: Optional[str] = None):
         """Inizia un nuovo run su W&B."""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         run_name = f"{model_name}_{timestamp}"
         
+        import wandb
         self.current_run = wandb.init(
             project=self.project_name,
             name=run_name,
             config=config,
             reinit=True,
+            mode=self.mode,
+            dir=self.wandb_dir,
         )
         
-        print(f"W&B run iniziato: {run_name}")
+        print(f"W&B run iniziato: {run_name} ({self.mode})")
     
     def log_metrics(self, metrics: Dict[str, Any]):
         """Logga le metriche su W&B."""
         if self.current_run:
-            wandb.log(metrics)
+            self.current_run.log(metrics)
+
+    def log_examples(self, examples: List[Dict[str, Any]]):
+        """Logga le metriche numeriche per esempio (prefisso example/)."""
+        if not self.current_run:
+            return
+        for example in examples:
+            self.current_run.log({
+                f"example/{key}": value for key, value in example.items()
+                if isinstance(value, (int, float)) and not isinstance(value, bool)
+            })
     
     def finish_run(self):
         """Chiude il run corrente su W&B."""
         if self.current_run:
-            wandb.finish()
+            self.current_run.finish()
             self.current_run = None
+
+
+class JsonlSink(TrackingSink):
+    """Scrive tutti gli eventi di tracking in un file JSONL locale."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self.run_name = None
+
+    def _write(self, event: str, payload: Dict[str, Any]):
+        record = {"ts": time.time(), "event": event, "run": self.run_name, **payload}
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def start_run(self, model_name: str, config: Dict[str, Any], model_key: Optional[str] = None):
+        self.run_name = model_name
+        self._write("start_run", {"config": config})
+
+    def log_metrics(self, metrics: Dict[str, Any]):
+        self._write("metrics", {"metrics": metrics})
+
+    def log_examples(self, examples: List[Dict[str, Any]]):
+        for example in examples:
+            self._write("example", {"example": example})
+        self._file.flush()
+
+    def finish_run(self):
+        self._write("finish_run", {})
+        self._file.flush()
+        self.run_name = None
+
+    def close(self):
+        self._file.close()
+
+
+class StoreSink(TrackingSink):
+    """
+    Scrive run, record per esempio e metriche nell'archivio risultati
+    (ResultsStore) man mano che arrivano.
+
+    Le metriche dell'ultimo log_metrics diventano le metriche finali della run.
+    Con results_dir la run registra come sorgente il file che ResultLogger
+    scrive per lo stesso modello, così import_results_tree non la reimporta.
+    """
+
+    def __init__(self, store, run_timestamp: str, results_dir: Optional[Path] = None):
+        self.store = store
+        self.run_timestamp = run_timestamp
+        self.results_dir = results_dir
+        self.run_id = None
+        self.last_metrics: Dict[str, Any] = {}
+
+    def start_run(self, model_name: str, config: Dict[str, Any], model_key: Optional[str] = None):
+        model_key = model_key or model_name
+        source_path = None
+        if self.results_dir is not None:
+            source_path = str((Path(self.results_dir) / f"{model_key.replace('/', '_')}_results.json").resolve())
+        self.run_id = self.store.start_run(
+            task=config.get('task', 'unknown'),
+            model_key=model_key,
+            config=config,
+            run_timestamp=self.run_timestamp,
+            source_path=source_path,
+        )
+        self.last_metrics = {}
+
+    def log_metrics(self, metrics: Dict[str, Any]):
+        self.last_metrics.update(metrics)
+
+    def log_examples(self, examples: List[Dict[str, Any]]):
+        if self.run_id is None:
+            return
+        for example in examples:
+            self.store.add_record(self.run_id, example)
+
+    def finish_run(self):
+        if self.run_id is not None:
+            self.store.finish_run(self.run_id, self.last_metrics)
+            self.run_id = None
+
+
+class TrackingLogger:
+    """
+    Inoltra gli eventi di tracking ai sink tramite una coda e un thread in background.
+
+    Gli esempi vengono raggruppati in batch (batch_size o flush_interval
+    secondi); start/metrics/finish mantengono l'ordine rispetto agli esempi.
+    Gli errori di un sink vengono stampati ma non interrompono il benchmark.
+    """
+
+    def __init__(self, sinks: List[TrackingSink], batch_size: int = 50, flush_interval: float = 1.0):
+        self.sinks = sinks
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._worker, name="tracking-logger", daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    @property
+    def streams_to_store(self) -> bool:
+        """True se un sink scrive già le run nell'archivio risultati."""
+        return any(isinstance(sink, StoreSink) for sink in self.sinks)
+
+    # API compatibile con WandBLogger
+    def start_run(self, model_name: str, config: Dict[str, Any], model_key: Optional[str] = None):
+        """Inizia una run; model_key è la chiave MODELS (nome dei file risultati e dell'archivio)."""
+        self._queue.put(("start_run", (model_name, config, model_key)))
+
+    def log_metrics(self, metrics: Dict[str, Any]):
+        self._queue.put(("log_metrics", (dict(metrics),)))
+
+    def log_example(self, example: Dict[str, Any]):
+        self._queue.put(("example", example))
+
+    def finish_run(self):
+        self._queue.put(("finish_run", ()))
+
+    def flush(self, timeout: Optional[float] = None):
+        """Attende che tutti gli eventi accodati siano stati consegnati."""
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        done.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Consegna gli eventi rimanenti, chiude i sink e ferma il thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(("close", ()))
+        self._thread.join(timeout)
+
+    def _dispatch(self, method: str, *args):
+        for sink in self.sinks:
+            try:
+                with span(f"tracking.{type(sink).__name__}.{method}", cat="logging"):
+                    getattr(sink, method)(*args)
+            except Exception as e:
+                print(f"[!] Tracking sink {type(sink).__name__}.{method} fallito: {e}")
+
+    def _worker(self):
+        batch: List[Dict[str, Any]] = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                kind, payload = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                kind, payload = "timeout", None
+
+            if kind == "example":
+                batch.append(payload)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(batch) < self.batch_size:
+                    continue
+
+            # Ogni evento non-esempio (o batch pieno/scaduto) svuota prima il batch
+            if batch:
+                self._dispatch("log_examples", batch)
+                batch = []
+            deadline = None
+
+            if kind in ("example", "timeout"):
+                continue
+            if kind == "flush":
+                payload.set()
+            elif kind == "close":
+                self._dispatch("close")
+                return
+            else:
+                self._dispatch(kind, *payload)
+
+
+def build_tracker(
+    sinks: str,
+    project_name: str,
+    results_dir: Path,
+    store=None,
+    run_timestamp: Optional[str] = None,
+    wandb_mode: str = "online",
+) -> TrackingLogger:
+    """
+    Crea un TrackingLogger a partire da una lista di sink separati da virgola.
+
+    Args:
+        sinks: Es. 'wandb', 'jsonl,store', 'none'
+        project_name: Progetto W&B
+        results_dir: Directory della run (per tracking.jsonl e run W&B offline)
+        store: ResultsStore per il sink 'store'
+        run_timestamp: Timestamp della run per il sink 'store'
+        wandb_mode: 'online' o 'offline'
+    """
+    built: List[TrackingSink] = []
+    for name in [part.strip() for part in sinks.split(",") if part.strip()]:
+        if name == "wandb":
+            wandb_dir = str(results_dir) if wandb_mode == "offline" else None
+            built.append(WandBLogger(project_name, mode=wandb_mode, wandb_dir=wandb_dir))
+        elif name == "jsonl":
+            built.append(JsonlSink(Path(results_dir) / "tracking.jsonl"))
+        elif name == "store":
+            if store is None:
+                raise ValueError("Il sink 'store' richiede un ResultsStore")
+            built.append(StoreSink(store, run_timestamp, results_dir))
+        elif name == "none":
+            built.append(NoOpSink())
+        else:
+            raise ValueError(f"Sink di tracking '{name}' non supportato. Usa wandb, jsonl, store o none.")
+    return TrackingLogger(built)
+
+
+def sync_offline_runs(root: str = "results") -> int:
+    """
+    Sincronizza su W&B i run salvati in modalità offline sotto root.
+
+    Returns:
+        Numero di run per cui 'wandb sync' è terminato con successo
+    """
+    run_dirs = sorted(Path(root).glob("**/wandb/offline-run-*"))
+    if not run_dirs:
+        print(f"Nessun run W&B offline trovato in {root}")
+        return 0
+
+    synced = 0
+    for run_dir in run_dirs:
+        result = subprocess.run(["wandb", "sync", str(run_dir)])
+        if result.returncode == 0:
+            synced += 1
+        else:
+            print(f"[X] Sync fallito: {run_dir}")
+    print(f"[OK] Run sincronizzati: {synced}/{len(run_dirs)}")
+    return synced
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Utility di tracking VERABENCH")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="Sincronizza su W&B i run offline")
+    sync_parser.add_argument("root", nargs="?", default="results", help="Directory in cui cercare i run offline")
+    args = parser.parse_args()
+
+    if args.command == "sync":
+        sync_offline_runs(args.root)
+
+
+if __name__ == "__main__":
+    main()
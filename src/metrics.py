@@ -1,7 +1,8 @@
 """
 Sistema di metriche per il benchmark.
 """
-from typing import Dict, Any
+import math
+from typing import Dict, Any, Optional, Sequence
 
 
 class MetricsCalculator:
@@ -63,11 +64,16 @@ class MetricsCalculator:
         }
 
 
+# Le Batch API di OpenAI e TogetherAI costano il 50% delle richieste sincrone
+BATCH_PRICE_FACTOR = 0.5
+
+
 def calculate_cost(
     prompt_tokens: int,
     completion_tokens: int,
     input_price_per_1m: float,
     output_price_per_1m: float,
+    batch: bool = False,
 ) -> float:
     """
     Calcola il costo di una singola inferenza.
@@ -77,10 +83,22 @@ def calculate_cost(
         completion_tokens: Numero di token nella risposta
         input_price_per_1m: Prezzo per 1M token di input in USD
         output_price_per_1m: Prezzo per 1M token di output in USD
+        batch: Richiesta eseguita tramite Batch API (prezzo scontato di BATCH_PRICE_FACTOR)
     
     Returns:
         Costo totale in USD
     """
     input_cost = (prompt_tokens / 1_000_000) * input_price_per_1m
     output_cost = (completion_tokens / 1_000_000) * output_price_per_1m
+    if batch:
+        return (input_cost + output_cost) * BATCH_PRICE_FACTOR
     return input_cost + output_cost
+
+
+def percentile(values: Sequence[float], pct: float) -> Optional[float]:
+    """Percentile con metodo nearest-rank (None se non ci sono valori)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
@@ -20,6 +20,10 @@ Google AI Studio:
 NVIDIA NIM:
 - Free tier per development  max 40 req per min
 - Richiede NVIDIA_API_KEY in .env
+
+Mock:
+- Provider locale a latenza zero con risposta fissa (MOCK_RESPONSE in .env
+  per cambiarla), utile per profilare l'harness senza chiamate di rete
 """
 
 MODELS = {
@@ -114,6 +118,7 @@ MODELS = {
         "provider": "openai",
         "input_price_per_1m": 2.50,
         "output_price_per_1m": 10.00,
+        "rate_limits": {"tpm": 30_000},
     },
          
  
@@ -125,6 +130,7 @@ MODELS = {
         "provider": "google",
         "input_price_per_1m": 0.0,
         "output_price_per_1m": 0.0,
+        "rate_limits": {"rpm": 15, "rpd": 1_000},
    },
 
     "gemini-2.5-flash": {
@@ -136,18 +142,51 @@ MODELS = {
         "output_price_per_1m": 0.0,
     },
 
-    
+    # Provider locale (nessuna chiamata di rete): misura il solo overhead dell'harness
+    "mock": {
+        "id": "mock",
+        "name": "Mock (locale, latenza zero)",
+        "params": "N/A",
+        "provider": "mock",
+        "input_price_per_1m": 0.0,
+        "output_price_per_1m": 0.0,
+    },
 
  
 }
 
 
+# Limiti di rate per provider: richieste/minuto (rpm), token/minuto (tpm),
+# richieste/giorno (rpd) e token/giorno (tpd); None = nessun limite noto.
+# Usati dal planner (--plan) per stimare il tempo di esecuzione e dallo
+# scheduler (src.scheduler) per le quote giornaliere. Aggiornare in base al
+# proprio tier: i valori sono quelli del tier 1 (OpenAI, Anthropic) e del
+# free tier (Google AI Studio). Together e Anthropic non hanno quote
+# giornaliere. Un modello con limiti diversi da quelli del provider li
+# dichiara in "rate_limits" nella sua configurazione (vedi get_rate_limits).
+PROVIDER_RATE_LIMITS = {
+    "togetherai": {"rpm": 600, "tpm": None, "rpd": None, "tpd": None},
+    "openai": {"rpm": 500, "tpm": 200_000, "rpd": 10_000, "tpd": None},
+    "anthropic": {"rpm": 50, "tpm": 50_000, "rpd": None, "tpd": None},
+    "google": {"rpm": 10, "tpm": 250_000, "rpd": 250, "tpd": None},
+    "cerebras": {"rpm": 30, "tpm": 60_000, "rpd": 14_400, "tpd": 1_000_000},
+    "openrouter": {"rpm": 20, "tpm": None, "rpd": 50, "tpd": None},
+    "nvidia": {"rpm": 40, "tpm": None, "rpd": None, "tpd": None},
+    "mock": {"rpm": None, "tpm": None, "rpd": None, "tpd": None},
+}
+
+
 def get_model_config(model_key: str) -> dict:
     """Restituisce la configurazione per un modello specifico."""
     if model_key not in MODELS:
         raise ValueError(f"Modello '{model_key}' non trovato.")
     return MODELS[model_key]
 
+def get_rate_limits(model_key: str) -> dict:
+    """Limiti di rate di un modello: quelli del provider, sovrascritti dai suoi rate_limits."""
+    model_config = get_model_config(model_key)
+    return {**PROVIDER_RATE_LIMITS.get(model_config['provider'], {}), **model_config.get('rate_limits', {})}
+
 def get_all_models() -> list:
     """Restituisce la lista di tutti i modelli configurati."""
     return list(MODELS.keys())
@@ -0,0 +1,319 @@
+"""
+Packing delle richieste: K test case in una sola chiamata API.
+
+Per task con input brevi (es. routing) il system prompt domina i token e
+l'overhead per richiesta domina la latenza. In modalità packing il system
+prompt della task è seguito da istruzioni multi-richiesta; lo user prompt
+contiene K richieste con il loro id e il modello risponde con un array JSON
+[{"id": ..., "answer": ...}].
+
+L'array viene spacchettato e validato (id noto, risposta nel formato della
+task): gli elementi mancanti o malformati sono rieseguiti con una richiesta
+singola. I token della chiamata impacchettata sono divisi in parti uguali
+tra i K test case per l'attribuzione dei costi.
+
+Il confronto tra dimensioni di pacchetto (K=1 = richieste singole) riporta
+accuratezza, costo, token, tempo, throughput e tasso di fallback:
+
+    python main_routing.py --pack-sizes 1,5,10,25 --models gpt-4o-mini
+    python -m src.packing --task routing --model gpt-4o-mini --pack-sizes 1,5,10
+"""
+import argparse
+import csv
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from src.compaction import COMPACTION_MODES, DEFAULT_COMPACTION
+from src.cost_ledger import BudgetExceededError, CostLedger, estimate_request_cost
+from src.env import load_dotenv
+from src.inference_client import ModelInferenceClient
+from src.metrics import calculate_cost
+from src.model_config import get_model_config
+from src.task_specs import TaskSpec, get_task_spec, parse_json_response
+from src.tracing import span
+
+PACKING_INSTRUCTIONS = """
+
+MODALITÀ MULTI-RICHIESTA:
+Riceverai più richieste, ciascuna con un id. Applica le istruzioni sopra a ogni richiesta in modo indipendente.
+Rispondi SOLO con un array JSON con un elemento per richiesta, nello stesso ordine:
+[{"id": "<id della richiesta>", "answer": <risposta che daresti alla singola richiesta>}]
+Se la risposta singola è un oggetto JSON inseriscilo come oggetto, altrimenti come stringa."""
+
+# Token in output per elemento oltre a quelli della risposta (id e struttura dell'array)
+PACKING_OVERHEAD_TOKENS = 15
+
+
+def pack_prompt(spec: TaskSpec, test_cases: List[Dict[str, Any]]) -> str:
+    """User prompt con le richieste dei test case e il loro id."""
+    parts = [f"RICHIESTE ({len(test_cases)}):"]
+    for test_case in test_cases:
+        parts.append(f"\n### id: {test_case['id']}\n{spec.render_user_prompt(test_case)}")
+    return "\n".join(parts)
+
+
+def unpack_response(spec: TaskSpec, response: str, ids: List[str]) -> Dict[str, str]:
+    """
+    Risposte valide per id dall'array JSON del modello.
+
+    Ogni answer è riportata nella forma di una risposta singola (stringa o
+    JSON) e tenuta solo se l'id è atteso e il formato della task è rispettato.
+    """
+    items = parse_json_response(response)
+    if isinstance(items, dict):
+        # Alcuni modelli avvolgono l'array in un oggetto (es. {"answers": [...]})
+        items = next((value for value in items.values() if isinstance(value, list)), None)
+    if not isinstance(items, list):
+        return {}
+
+    expected = set(ids)
+    answers: Dict[str, str] = {}
+    for item in items:
+        if not isinstance(item, dict) or str(item.get("id")) not in expected or "answer" not in item:
+            continue
+        answer = item["answer"]
+        predicted = answer if isinstance(answer, str) else json.dumps(answer, ensure_ascii=False)
+        if spec.parse_response(predicted) is not None:
+            answers.setdefault(str(item["id"]), predicted)
+    return answers
+
+
+class PackedRunner:
+    """Esegue una task su un modello con pacchetti di K test case per richiesta."""
+
+    def __init__(self, task: str, model_key: str, client=None, temperature: float = 0.0,
+                 compaction: str = DEFAULT_COMPACTION, cost_ledger: Optional[CostLedger] = None):
+        self.spec = get_task_spec(task, compaction=compaction)
+        self.model_key = model_key
+        self.model_config = get_model_config(model_key)
+        self.client = client or ModelInferenceClient(self.model_config['id'], provider=self.model_config['provider'])
+        self.temperature = temperature
+        self.cost_ledger = cost_ledger or CostLedger()
+
+    def _generate(self, system_prompt: str, user_prompt: str, max_new_tokens: int):
+        # Riserva la stima pessimistica prima della chiamata, poi registra il costo reale
+        estimate = estimate_request_cost(self.model_config, system_prompt, user_prompt, max_new_tokens)
+        with self.cost_ledger.charge(self.model_key, estimate) as charge:
+            response, latency, token_usage = self.client.generate(
+                system_prompt=system_prompt,
+                user_prompt=user_prompt,
+                max_new_tokens=max_new_tokens,
+                temperature=self.temperature,
+            )
+            charge.settle(self._cost(token_usage['prompt_tokens'], token_usage['completion_tokens']),
+                          token_usage.get("api_key_id"))
+        return response, latency, token_usage['prompt_tokens'], token_usage['completion_tokens']
+
+    def _cost(self, prompt_tokens: float, completion_tokens: float) -> float:
+        return calculate_cost(prompt_tokens, completion_tokens,
+                              self.model_config['input_price_per_1m'], self.model_config['output_price_per_1m'])
+
+    def _single(self, test_case: Dict[str, Any], fallback: bool = False) -> Dict[str, Any]:
+        response, latency, prompt_tokens, completion_tokens = self._generate(
+            self.spec.system_prompt, self.spec.render_user_prompt(test_case), self.spec.max_new_tokens,
+        )
+        return {
+            "example_id": test_case['id'],
+            "predicted": response,
+            "latency": latency,
+            "cost": self._cost(prompt_tokens, completion_tokens),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "pack_size": 1,
+            "fallback": fallback,
+        }
+
+    def run_pack(self, test_cases: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Una richiesta per il pacchetto; fallback a richieste singole per gli elementi non validi."""
+        if len(test_cases) == 1:
+            return [self._single(test_cases[0])]
+
+        size = len(test_cases)
+        max_new_tokens = (self.spec.max_new_tokens + PACKING_OVERHEAD_TOKENS) * size
+        with span("packing.request", cat="packing", size=size):
+            response, latency, prompt_tokens, completion_tokens = self._generate(
+                self.spec.system_prompt + PACKING_INSTRUCTIONS, pack_prompt(self.spec, test_cases), max_new_tokens,
+            )
+        answers = unpack_response(self.spec, response, [str(test_case['id']) for test_case in test_cases])
+
+        # Token e costo della chiamata divisi in parti uguali tra i test case del pacchetto
+        share_prompt = prompt_tokens / size
+        share_completion = completion_tokens / size
+        share_cost = self._cost(prompt_tokens, completion_tokens) / size
+        results = []
+        for test_case in test_cases:
+            packed = {
+                "example_id": test_case['id'],
+                "predicted": answers.get(str(test_case['id'])),
+                "latency": latency,
+                "cost": share_cost,
+                "prompt_tokens": share_prompt,
+                "completion_tokens": share_completion,
+                "pack_size": size,
+                "fallback": False,
+            }
+            if packed["predicted"] is None:
+                with span("packing.fallback", cat="packing", test_id=test_case['id']):
+                    single = self._single(test_case, fallback=True)
+                # Il caso paga la sua quota del pacchetto più la richiesta singola
+                single["latency"] += latency
+                for key in ("cost", "prompt_tokens", "completion_tokens"):
+                    single[key] += packed[key]
+                packed = single
+            results.append(packed)
+        return results
+
+    def run(self, test_cases: List[Dict[str, Any]], pack_size: int) -> Dict[str, Any]:
+        """Esegue tutti i test case a pacchetti di pack_size e calcola le metriche della task."""
+        metrics = self.spec.create_metrics()
+        examples = []
+        requests = 0
+        budget_stopped = False
+        start = time.perf_counter()
+        for offset in range(0, len(test_cases), pack_size):
+            pack = test_cases[offset:offset + pack_size]
+            try:
+                results = self.run_pack(pack)
+            except BudgetExceededError as e:
+                # Il costo delle chiamate già fatte del pacchetto resta nel ledger
+                print(f"[!] {e}: K={pack_size} interrotto, valuto gli esempi completati")
+                budget_stopped = True
+                break
+            except Exception as e:
+                print(f"ERRORE pacchetto {pack[0]['id']}..{pack[-1]['id']}: {str(e)}")
+                continue
+            requests += (1 if len(pack) > 1 else 0) + sum(1 for result in results if result["pack_size"] == 1)
+            for test_case, result in zip(pack, results):
+                self.spec.add_prediction(metrics, result["predicted"], test_case, result["latency"], result["cost"])
+                examples.append(result)
+        wall_seconds = time.perf_counter() - start
+
+        n = len(examples)
+        final_metrics = metrics.get_metrics()
+        return {
+            "pack_size": pack_size,
+            "budget_stopped": budget_stopped,
+            "examples": n,
+            "requests": requests,
+            "accuracy": final_metrics.get(self.spec.accuracy_field, 0.0),
+            "total_cost": sum(example["cost"] for example in examples),
+            "cost_per_example": sum(example["cost"] for example in examples) / n if n else 0.0,
+            "prompt_tokens": sum(example["prompt_tokens"] for example in examples),
+            "completion_tokens": sum(example["completion_tokens"] for example in examples),
+            "wall_seconds": wall_seconds,
+            "throughput": n / wall_seconds if wall_seconds else 0.0,
+            "fallback_rate": sum(example["fallback"] for example in examples) / n if n else 0.0,
+            "metrics": final_metrics,
+            "records": examples,
+        }
+
+
+def compare_pack_sizes(
+    task: str,
+    model_key: str,
+    test_cases: List[Dict[str, Any]],
+    pack_sizes: List[int],
+    client=None,
+    compaction: str = DEFAULT_COMPACTION,
+    cost_ledger: Optional[CostLedger] = None,
+) -> List[Dict[str, Any]]:
+    """Esegue la stessa task con ogni dimensione di pacchetto (1 = richieste singole)."""
+    runner = PackedRunner(task, model_key, client=client, compaction=compaction, cost_ledger=cost_ledger)
+    # Nessuna chiamata se un limite di budget applicabile è già esaurito
+    runner.cost_ledger.check(model_key)
+    results = []
+    for pack_size in pack_sizes:
+        print(f"\n[*] {model_key}: K={pack_size}")
+        result = runner.run(test_cases, pack_size)
+        result["model"] = model_key
+        results.append(result)
+        if result["budget_stopped"]:
+            # Le dimensioni successive non sarebbero confrontabili
+            break
+    return results
+
+
+def print_comparison(task: str, results: List[Dict[str, Any]]):
+    """Tabella K -> accuratezza, costo, token, tempo, throughput e fallback."""
+    print(f"\n{'='*60}")
+    print(f"PACKING {task}")
+    print(f"{'='*60}")
+    print(f"{'Modello':<24} {'K':>4} {'Req':>5} {'Accuratezza':>12} {'Costo/es.':>12} {'Token in':>10} "
+          f"{'Token out':>10} {'Tempo':>8} {'es./s':>7} {'Fallback':>9}")
+    for result in results:
+        print(f"{result['model'][:24]:<24} {result['pack_size']:>4} {result['requests']:>5} {result['accuracy']:>12.3f} "
+              f"{result['cost_per_example']:>12.7f} {result['prompt_tokens']:>10.0f} {result['completion_tokens']:>10.0f} "
+              f"{result['wall_seconds']:>7.1f}s {result['throughput']:>7.2f} {result['fallback_rate']:>8.1%}")
+
+
+def save_comparison(results: List[Dict[str, Any]], output_dir: Path):
+    """Salva risultati completi in JSON e il riepilogo in CSV."""
+    output_dir.mkdir(parents=True, exist_ok=True)
+    with open(output_dir / "packing.json", "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    fields = ["model", "pack_size", "examples", "requests", "accuracy", "total_cost", "cost_per_example",
+              "prompt_tokens", "completion_tokens", "wall_seconds", "throughput", "fallback_rate"]
+    with open(output_dir / "packing.csv", "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def packing_cli(
+    task: str,
+    model_keys: List[str],
+    pack_sizes: str,
+    test_cases: Optional[List[Dict[str, Any]]] = None,
+    output_dir: Optional[str] = None,
+    compaction: str = DEFAULT_COMPACTION,
+    cost_ledger: Optional[CostLedger] = None,
+) -> List[Dict[str, Any]]:
+    """Confronto tra dimensioni di pacchetto per più modelli (usato dai runner con --pack-sizes)."""
+    load_dotenv()
+    sizes = [int(size) for size in pack_sizes.split(",") if size.strip()]
+    if test_cases is None:
+        test_cases = get_task_spec(task).load_test_cases()
+    cost_ledger = cost_ledger or CostLedger()
+
+    results = []
+    for model_key in model_keys:
+        try:
+            results.extend(compare_pack_sizes(task, model_key, test_cases, sizes, compaction=compaction,
+                                              cost_ledger=cost_ledger))
+        except Exception as e:
+            print(f"ERRORE {model_key}: {str(e)}")
+    if not results:
+        return results
+    print_comparison(task, results)
+    output_dir = Path(output_dir or f"results/packing/{task}/{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    save_comparison(results, output_dir)
+    print(f"\nRisultati packing: {output_dir}/")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Confronto tra richieste singole e impacchettate")
+    parser.add_argument("--task", required=True, help="Task da valutare")
+    parser.add_argument("--model", required=True, help="Chiavi dei modelli separate da virgola")
+    parser.add_argument("--pack-sizes", type=str, default="1,5,10", help="Dimensioni K separate da virgola")
+    parser.add_argument("--sample", type=int, default=None, help="Campione stratificato di N esempi")
+    parser.add_argument("--shard", type=str, default=None, help="Solo lo shard i/N del dataset")
+    parser.add_argument("--compaction", choices=COMPACTION_MODES, default=DEFAULT_COMPACTION,
+                        help="Compattazione del contesto JSON nei prompt (rag, judge, final_answer)")
+    parser.add_argument("--output-dir", type=str, default=None, help="Default: results/packing/<task>/<timestamp>")
+    parser.add_argument("--budget-run", type=float, default=None, help="Limite di spesa in USD per questo confronto")
+    parser.add_argument("--budget-day", type=float, default=None,
+                        help="Limite di spesa giornaliero in USD, condiviso tra processi (results/cost_ledger.json)")
+    args = parser.parse_args()
+
+    test_cases = get_task_spec(args.task).load_test_cases(sample_size=args.sample, shard=args.shard)
+    model_keys = [key.strip() for key in args.model.split(",") if key.strip()]
+    packing_cli(args.task, model_keys, args.pack_sizes, test_cases, args.output_dir, args.compaction,
+                cost_ledger=CostLedger(run_budget=args.budget_run, daily_budget=args.budget_day))
+
+
+if __name__ == "__main__":
+    main()
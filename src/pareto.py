@@ -0,0 +1,230 @@
+"""
+Analisi multi-obiettivo (frontiera di Pareto) delle configurazioni modello/variante.
+
+Obiettivi per ogni configurazione di una task:
+- accuracy (da massimizzare)
+- cost_per_example (da minimizzare)
+- avg_latency (da minimizzare)
+
+Le frontiere 2-D e 3-D sono calcolate con algoritmi skyline basati su
+ordinamento (O(n log n) nel caso tipico) invece del confronto a coppie O(n²).
+"""
+import csv
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Obiettivi standard: (campo, True se da massimizzare)
+OBJECTIVES = (
+    ("accuracy", True),
+    ("cost_per_example", False),
+    ("avg_latency", False),
+)
+
+# Pesi di default per lo score cross-task
+DEFAULT_WEIGHTS = {"accuracy": 0.5, "cost_per_example": 0.3, "avg_latency": 0.2}
+
+
+def _unique_points(points: Sequence[Tuple[float, ...]]) -> Tuple[List[Tuple[float, ...]], Dict[Tuple[float, ...], List[int]]]:
+    """Raggruppa i punti identici: non si dominano a vicenda."""
+    groups: Dict[Tuple[float, ...], List[int]] = {}
+    for i, point in enumerate(points):
+        groups.setdefault(tuple(point), []).append(i)
+    return list(groups), groups
+
+
+def pareto_front_2d(points: Sequence[Tuple[float, float]]) -> List[int]:
+    """
+    Indici dei punti non dominati (entrambe le coordinate da minimizzare).
+
+    Ordina per (x, y) e scorre mantenendo il minimo y visto: un punto è sulla
+    frontiera solo se migliora strettamente quel minimo.
+    """
+    unique, groups = _unique_points(points)
+    front = []
+    best_y = float("inf")
+    for x, y in sorted(unique):
+        if y < best_y:
+            best_y = y
+            front.extend(groups[(x, y)])
+    return sorted(front)
+
+
+def pareto_front_3d(points: Sequence[Tuple[float, float, float]]) -> List[int]:
+    """
+    Indici dei punti non dominati (tre coordinate da minimizzare).
+
+    Ordina per (x, y, z): ogni punto può essere dominato solo da punti già
+    visitati. Sui punti non dominati si mantiene una "scala" 2-D in (y, z)
+    con y crescente e z strettamente decrescente; verificare la dominanza
+    richiede una ricerca binaria sul predecessore in y.
+    """
+    unique, groups = _unique_points(points)
+    stair_y: List[float] = []
+    stair_z: List[float] = []
+    front = []
+
+    for x, y, z in sorted(unique):
+        # Predecessore: punto della scala con y' <= y e z' minimo
+        pos = bisect_right(stair_y, y)
+        if pos > 0 and stair_z[pos - 1] <= z:
+            continue
+        front.extend(groups[(x, y, z)])
+
+        # Inserisci (y, z) e rimuovi i punti della scala ora dominati in (y, z)
+        insert_at = bisect_left(stair_y, y)
+        end = insert_at
+        while end < len(stair_y) and stair_z[end] >= z:
+            end += 1
+        stair_y[insert_at:end] = [y]
+        stair_z[insert_at:end] = [z]
+
+    return sorted(front)
+
+
+def pareto_front(
+    rows: Sequence[Dict[str, Any]],
+    objectives: Sequence[Tuple[str, bool]] = OBJECTIVES,
+) -> List[int]:
+    """
+    Indici delle righe non dominate rispetto agli obiettivi (2 o 3).
+
+    Args:
+        rows: Configurazioni (dict con i campi degli obiettivi)
+        objectives: Coppie (campo, maximize)
+    """
+    if not rows:
+        return []
+    # Porta tutti gli obiettivi in forma "da minimizzare"
+    points = [
+        tuple(-float(row[field]) if maximize else float(row[field]) for field, maximize in objectives)
+        for row in rows
+    ]
+    if len(objectives) == 2:
+        return pareto_front_2d(points)
+    if len(objectives) == 3:
+        return pareto_front_3d(points)
+    raise ValueError("Sono supportati solo 2 o 3 obiettivi")
+
+
+def _normalize(values: List[float], maximize: bool) -> List[float]:
+    """Min-max in [0, 1] dove 1 è sempre il valore migliore."""
+    low, high = min(values), max(values)
+    if high == low:
+        return [1.0] * len(values)
+    if maximize:
+        return [(v - low) / (high - low) for v in values]
+    return [(high - v) / (high - low) for v in values]
+
+
+def cross_task_scores(
+    rows: Sequence[Dict[str, Any]],
+    weights: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Score pesato per (modello, variante) mediato sulle task.
+
+    In ogni task gli obiettivi sono normalizzati min-max (1 = migliore) e
+    combinati con i pesi; lo score finale è la media sulle task coperte.
+
+    Returns:
+        Lista ordinata per score decrescente con model, variant, score,
+        tasks_covered e task_scores
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    total_weight = sum(weights.values()) or 1.0
+    maximize = dict(OBJECTIVES)
+
+    by_task: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        by_task.setdefault(row["task"], []).append(row)
+
+    per_config: Dict[Tuple[str, str], Dict[str, float]] = {}
+    for task, task_rows in by_task.items():
+        normalized = {
+            field: _normalize([float(row[field]) for row in task_rows], maximize[field])
+            for field in weights
+        }
+        for i, row in enumerate(task_rows):
+            score = sum(weights[field] * normalized[field][i] for field in weights) / total_weight
+            per_config.setdefault((row["model"], row["variant"]), {})[task] = score
+
+    ranking = [
+        {
+            "model": model,
+            "variant": variant,
+            "score": sum(task_scores.values()) / len(task_scores),
+            "tasks_covered": len(task_scores),
+            "task_scores": task_scores,
+        }
+        for (model, variant), task_scores in per_config.items()
+    ]
+    ranking.sort(key=lambda item: (-item["score"], item["model"], item["variant"]))
+    return ranking
+
+
+def pareto_table(
+    rows: Sequence[Dict[str, Any]],
+    weights: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Tabella classificata per task con appartenenza alle frontiere.
+
+    Per ogni riga aggiunge pareto_3d (accuracy/costo/latenza), pareto_2d
+    (accuracy/costo), task_score e rank (per task, frontiera prima, poi score).
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    scores = {
+        (item["model"], item["variant"]): item["task_scores"]
+        for item in cross_task_scores(rows, weights)
+    }
+
+    by_task: Dict[str, List[Dict[str, Any]]] = {}
+    for row in rows:
+        by_task.setdefault(row["task"], []).append(row)
+
+    table = []
+    for task in sorted(by_task):
+        task_rows = by_task[task]
+        front_3d = set(pareto_front(task_rows))
+        front_2d = set(pareto_front(task_rows, OBJECTIVES[:2]))
+        ranked = []
+        for i, row in enumerate(task_rows):
+            ranked.append({
+                "task": task,
+                "model": row["model"],
+                "variant": row["variant"],
+                "accuracy": row["accuracy"],
+                "cost_per_example": row["cost_per_example"],
+                "avg_latency": row["avg_latency"],
+                "pareto_3d": i in front_3d,
+                "pareto_2d": i in front_2d,
+                "task_score": scores[(row["model"], row["variant"])][task],
+            })
+        ranked.sort(key=lambda item: (not item["pareto_3d"], -item["task_score"]))
+        for rank, item in enumerate(ranked, 1):
+            item["rank"] = rank
+        table.extend(ranked)
+    return table
+
+
+def export_pareto_table(table: List[Dict[str, Any]], output_path: Path):
+    """Esporta la tabella classificata in CSV."""
+    fields = ["task", "rank", "model", "variant", "accuracy", "cost_per_example",
+              "avg_latency", "pareto_3d", "pareto_2d", "task_score"]
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(table)
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """Converte 'accuracy=0.5,cost_per_example=0.3,avg_latency=0.2' in dict."""
+    weights = {}
+    for part in value.split(","):
+        field, _, weight = part.partition("=")
+        field = field.strip()
+        if field not in dict(OBJECTIVES):
+            raise ValueError(f"Obiettivo '{field}' non valido. Usa: {', '.join(dict(OBJECTIVES))}")
+        weights[field] = float(weight)
+    return weights
@@ -0,0 +1,238 @@
+"""
+Planner (dry run): stima token, costo e tempo di una run senza chiamate API.
+
+Per ogni modello renderizza tutti i prompt della task (un test di consistenza
+conta una volta per esecuzione, TaskSpec.runs_for), conta i token in input
+in locale (tiktoken se installato, altrimenti ~4 caratteri per token), stima
+i token in output dalla storia delle run nell'archivio (media per modello,
+poi per task, infine max_new_tokens) e applica prezzi di MODELS e limiti di
+get_rate_limits (provider ed eccezioni del modello). Il tempo previsto è il
+massimo tra il vincolo di latenza (latenza media / concorrenza) e i vincoli
+rpm/tpm; i
+modelli sono eseguiti in sequenza come nei runner.
+
+Uso:
+    python main_rag.py --plan
+    python -m src.planner --task judge --models gpt-4o-mini,gpt-4o --concurrency 8
+"""
+import math
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from src.compaction import DEFAULT_COMPACTION
+from src.metrics import calculate_cost
+from src.model_config import get_model_config, get_rate_limits
+from src.results_store import DEFAULT_DB_PATH, ResultsStore
+from src.task_specs import get_task_spec
+
+CHARS_PER_TOKEN = 4
+# Token aggiunti dal formato chat (ruoli e separatori di system + user + risposta)
+MESSAGE_OVERHEAD_TOKENS = 7
+# Latenza per richiesta ipotizzata senza storia (secondi)
+DEFAULT_LATENCY = 2.0
+
+
+def get_token_counter(model_id: str) -> tuple:
+    """
+    Contatore di token per un modello.
+
+    Returns:
+        (funzione testo -> token, descrizione del tokenizer)
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return (lambda text: len(text) // CHARS_PER_TOKEN + 1), f"~{CHARS_PER_TOKEN} caratteri/token"
+
+    try:
+        encoding = tiktoken.encoding_for_model(model_id)
+    except KeyError:
+        # Modelli non OpenAI: o200k_base come approssimazione del loro tokenizer
+        encoding = tiktoken.get_encoding("o200k_base")
+    return (lambda text: len(encoding.encode(text))), f"tiktoken {encoding.name}"
+
+
+def _history(store: Optional[ResultsStore], task: str, model_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Statistiche storiche del modello sulla task, o della task su tutti i modelli."""
+    if store is None:
+        return {"examples": 0, "source": None}
+    for model in (model_config['id'], model_config['name']):
+        stats = store.usage_stats(task, model)
+        if stats["examples"]:
+            return {**stats, "source": "modello"}
+    # Dagli altri modelli solo i token in output: la latenza dipende dal modello (mock escluso)
+    stats = store.usage_stats(task, exclude_provider="mock")
+    if stats["examples"]:
+        return {**stats, "avg_latency": None, "source": "task"}
+    return {"examples": 0, "source": None}
+
+
+def plan_model(
+    task: str,
+    model_key: str,
+    test_cases: List[Dict[str, Any]],
+    user_prompts: List[str],
+    concurrency: int = 1,
+    store: Optional[ResultsStore] = None,
+    max_new_tokens: Optional[int] = None,
+    count_tokens: Optional[Callable[[str], int]] = None,
+) -> Dict[str, Any]:
+    """Stima di costo e tempo per un modello su prompt già renderizzati."""
+    spec = get_task_spec(task)
+    model_config = get_model_config(model_key)
+    max_new_tokens = max_new_tokens or spec.max_new_tokens
+    tokenizer = None
+    if count_tokens is None:
+        count_tokens, tokenizer = get_token_counter(model_config['id'])
+
+    # I test di consistenza (judge) sono eseguiti più volte: ogni esecuzione è una richiesta
+    runs = [spec.runs_for(test_case) for test_case in test_cases]
+    requests = sum(runs)
+    system_tokens = count_tokens(spec.system_prompt)
+    input_tokens = sum(n * count_tokens(prompt) for n, prompt in zip(runs, user_prompts)) \
+        + requests * (system_tokens + MESSAGE_OVERHEAD_TOKENS)
+
+    history = _history(store, task, model_config)
+    avg_output = max_new_tokens
+    avg_latency = 0.0 if model_config['provider'] == "mock" else DEFAULT_LATENCY
+    if history["source"]:
+        avg_output = min(history["avg_completion_tokens"], max_new_tokens)
+        if history["avg_latency"] is not None:
+            avg_latency = history["avg_latency"]
+    output_tokens = avg_output * requests
+
+    cost = calculate_cost(input_tokens, output_tokens,
+                          model_config['input_price_per_1m'], model_config['output_price_per_1m'])
+    max_cost = calculate_cost(input_tokens, max_new_tokens * requests,
+                              model_config['input_price_per_1m'], model_config['output_price_per_1m'])
+
+    # Vincoli sul tempo: latenza con N richieste in parallelo e rate limit del provider
+    limits = get_rate_limits(model_key)
+    bounds = {"latenza": requests * avg_latency / max(concurrency, 1)}
+    if limits.get("rpm"):
+        bounds["rpm"] = requests / limits["rpm"] * 60
+    if limits.get("tpm"):
+        bounds["tpm"] = (input_tokens + output_tokens) / limits["tpm"] * 60
+    bottleneck = max(bounds, key=bounds.get)
+    # Quote giornaliere: richieste (rpd) e token (tpd)
+    days = max(
+        math.ceil(requests / limits["rpd"]) if limits.get("rpd") else 1,
+        math.ceil((input_tokens + output_tokens) / limits["tpd"]) if limits.get("tpd") else 1,
+    )
+
+    return {
+        "model_key": model_key,
+        "model_name": model_config['name'],
+        "provider": model_config['provider'],
+        "requests": requests,
+        "input_tokens": input_tokens,
+        "output_tokens": round(output_tokens),
+        "output_source": history["source"] or "max_new_tokens",
+        "avg_latency": avg_latency,
+        "cost": cost,
+        "max_cost": max_cost,
+        "wall_seconds": bounds[bottleneck],
+        "bottleneck": bottleneck,
+        "days": days,
+        "tokenizer": tokenizer,
+    }
+
+
+def plan_task(
+    task: str,
+    model_keys: List[str],
+    use_short_dataset: bool = False,
+    sample_size: Optional[int] = None,
+    shard: Optional[str] = None,
+    seed: int = 42,
+    concurrency: int = 1,
+    db_path: str = DEFAULT_DB_PATH,
+    compaction: str = DEFAULT_COMPACTION,
+) -> Dict[str, Any]:
+    """
+    Piano di una run: stessa selezione del dataset dei runner, un piano per modello.
+
+    Returns:
+        Dict con task, concurrency, models (piani per modello) e totali
+    """
+    spec = get_task_spec(task, compaction=compaction)
+    dataset_file = spec.short_dataset_path if use_short_dataset and not sample_size else spec.dataset_path
+    test_cases = spec.load_test_cases(use_short_dataset, sample_size, shard, seed)
+    user_prompts = [spec.render_user_prompt(test_case) for test_case in test_cases]
+
+    # Senza archivio (prima run) si stima dall'output massimo: nessun file creato
+    store = ResultsStore(db_path) if Path(db_path).exists() else None
+    try:
+        plans = []
+        for model_key in model_keys:
+            try:
+                plans.append(plan_model(task, model_key, test_cases, user_prompts,
+                                        concurrency=concurrency, store=store))
+            except ValueError as e:
+                print(f"[!] {e}")
+    finally:
+        if store is not None:
+            store.close()
+
+    return {
+        "task": task,
+        "dataset": dataset_file,
+        "concurrency": concurrency,
+        "models": plans,
+        "requests": sum(plan["requests"] for plan in plans),
+        "cost": sum(plan["cost"] for plan in plans),
+        "max_cost": sum(plan["max_cost"] for plan in plans),
+        "wall_seconds": sum(plan["wall_seconds"] for plan in plans),
+    }
+
+
+def _format_duration(seconds: float) -> str:
+    hours, rest = divmod(int(round(seconds)), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def print_plan(plan: Dict[str, Any]):
+    """Stampa il piano in forma tabellare."""
+    print("=" * 60)
+    print(f"PIANO (dry run, nessuna chiamata API) - task {plan['task']}")
+    print(f"Dataset: {plan['dataset']} | concorrenza: {plan['concurrency']}")
+    print("=" * 60)
+    print(f"{'Modello':<32} {'Req':>6} {'Input tok':>11} {'Output tok':>11} {'Costo $':>9} {'Max $':>9} "
+          f"{'Tempo':>10}  Vincolo")
+    for model_plan in plan["models"]:
+        note = model_plan["bottleneck"]
+        if model_plan["days"] > 1:
+            note += f", {model_plan['days']} giorni (quota giornaliera)"
+        print(f"{model_plan['model_name'][:32]:<32} {model_plan['requests']:>6} {model_plan['input_tokens']:>11,} "
+              f"{model_plan['output_tokens']:>11,} {model_plan['cost']:>9.4f} {model_plan['max_cost']:>9.4f} "
+              f"{_format_duration(model_plan['wall_seconds']):>10}  {note}")
+    print("-" * 60)
+    print(f"Totale: {plan['requests']} richieste, ${plan['cost']:.4f} previsti (max ${plan['max_cost']:.4f}), "
+          f"{_format_duration(plan['wall_seconds'])}")
+    if plan["models"]:
+        sources = sorted({model_plan["output_source"] for model_plan in plan["models"]})
+        tokenizers = sorted({model_plan["tokenizer"] for model_plan in plan["models"] if model_plan["tokenizer"]})
+        print(f"Token in output stimati da: {', '.join(sources)} | tokenizer: {', '.join(tokenizers)}")
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Stima token, costo e tempo di una run senza chiamate API")
+    parser.add_argument("--task", type=str, required=True, help="Task da pianificare")
+    parser.add_argument("--models", type=str, required=True, help="Chiavi dei modelli separate da virgola")
+    parser.add_argument("--short", action="store_true", help="Usa dataset_short.json")
+    parser.add_argument("--sample", type=int, default=None, help="Campione stratificato di N esempi")
+    parser.add_argument("--shard", type=str, default=None, help="Solo lo shard i/N del dataset")
+    parser.add_argument("--concurrency", type=int, default=1, help="Richieste in parallelo ipotizzate")
+    parser.add_argument("--store", type=str, default=DEFAULT_DB_PATH, help="Archivio SQLite con la storia delle run")
+    args = parser.parse_args()
+
+    model_keys = [key.strip() for key in args.models.split(",") if key.strip()]
+    print_plan(plan_task(args.task, model_keys, use_short_dataset=args.short, sample_size=args.sample,
+                         shard=args.shard, concurrency=args.concurrency, db_path=args.store))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Profiling dell'harness durante una run di benchmark.
+
+Modalità (opzione --profile dei runner):
+- cprofile: statistiche deterministiche per funzione (.pstats + riepilogo .txt)
+- sampling: campionatore a intervalli fissi sul thread della run, con output
+  "folded stacks" pronto per flamegraph.pl / speedscope (.folded)
+- tracemalloc: principali allocatori di memoria per riga e picco (.txt)
+
+Usato con il provider "mock" isola l'overhead puro dell'harness
+(serializzazione JSON, parsing delle risposte, confronti delle metriche, stampa).
+
+Esempio:
+    with profile_run("sampling", results_dir, "gpt-4o-mini"):
+        runner.run_single_model("gpt-4o-mini")
+"""
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import nullcontext
+from pathlib import Path
+from typing import List, Optional
+
+PROFILE_MODES = ("cprofile", "tracemalloc", "sampling")
+
+# Intervallo di campionamento di default (secondi)
+DEFAULT_SAMPLE_INTERVAL = 0.005
+
+# Righe/funzioni riportate nei riepiloghi testuali
+TOP_N = 30
+
+
+class StackSampler:
+    """
+    Campiona periodicamente lo stack di un thread tramite sys._current_frames().
+
+    Ogni campione è una stringa "modulo:funzione;...;modulo:funzione" (dalla
+    radice alla foglia); i conteggi formano l'output folded per i flamegraph.
+    """
+
+    def __init__(self, thread_id: int, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                module = frame.f_globals.get("__name__", "?")
+                stack.append(f"{module}:{code.co_name}")
+                frame = frame.f_back
+            self.samples[";".join(reversed(stack))] += 1
+
+    def write_folded(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RunProfiler:
+    """
+    Context manager che profila il blocco e scrive i report in output_dir.
+
+    Args:
+        mode: Una di PROFILE_MODES
+        output_dir: Directory della run (i file sono prefissati con profile_<label>)
+        label: Etichetta della run, tipicamente la chiave del modello
+        sample_interval: Intervallo del campionatore (solo modalità sampling)
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        output_dir: Path,
+        label: str,
+        sample_interval: float = DEFAULT_SAMPLE_INTERVAL,
+    ):
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"Modalità di profiling '{mode}' non valida. Usa: {', '.join(PROFILE_MODES)}")
+        self.mode = mode
+        self.output_dir = Path(output_dir)
+        self.prefix = f"profile_{label.replace('/', '_')}"
+        self.sample_interval = sample_interval
+        self.output_files: List[Path] = []
+        self._profiler: Optional[cProfile.Profile] = None
+        self._sampler: Optional[StackSampler] = None
+        self._started = 0.0
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        elif self.mode == "sampling":
+            self._sampler = StackSampler(threading.get_ident(), self.sample_interval)
+            self._sampler.start()
+        else:
+            tracemalloc.start(25)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self._started
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.mode == "cprofile":
+            self._profiler.disable()
+            self._write_cprofile()
+        elif self.mode == "sampling":
+            self._sampler.stop()
+            self._write_sampling()
+        else:
+            self._write_tracemalloc()
+        print(f"[*] Profilo {self.mode} ({elapsed:.2f}s): {', '.join(str(p) for p in self.output_files)}")
+        return False
+
+    def _write_cprofile(self):
+        pstats_path = self.output_dir / f"{self.prefix}.pstats"
+        self._profiler.dump_stats(pstats_path)
+
+        buffer = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=buffer)
+        stats.sort_stats("cumulative").print_stats(TOP_N)
+        stats.sort_stats("tottime").print_stats(TOP_N)
+        summary_path = self.output_dir / f"{self.prefix}.txt"
+        summary_path.write_text(buffer.getvalue(), encoding="utf-8")
+        self.output_files += [pstats_path, summary_path]
+
+    def _write_sampling(self):
+        folded_path = self.output_dir / f"{self.prefix}.folded"
+        self._sampler.write_folded(folded_path)
+        self.output_files.append(folded_path)
+
+    def _write_tracemalloc(self):
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot = snapshot.filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ])
+
+        lines = [
+            f"Memoria tracciata: attuale {current / 1024 / 1024:.2f} MiB, picco {peak / 1024 / 1024:.2f} MiB",
+            "",
+            f"Top {TOP_N} allocatori per riga:",
+        ]
+        for stat in snapshot.statistics("lineno")[:TOP_N]:
+            lines.append(f"  {stat.size / 1024:10.1f} KiB  {stat.count:8d} blocchi  {stat.traceback[0]}")
+
+        lines += ["", "Top 5 stack di allocazione:"]
+        for stat in snapshot.statistics("traceback")[:5]:
+            lines.append(f"  {stat.size / 1024:.1f} KiB in {stat.count} blocchi")
+            lines += [f"    {line}" for line in stat.traceback.format(limit=10)]
+
+        memory_path = self.output_dir / f"{self.prefix}_memory.txt"
+        memory_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+        self.output_files.append(memory_path)
+
+
+def profile_run(mode: Optional[str], output_dir: Path, label: str):
+    """RunProfiler se mode è impostato, altrimenti un context manager vuoto."""
+    if not mode:
+        return nullcontext()
+    return RunProfiler(mode, output_dir, label)
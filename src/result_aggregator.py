@@ -1,51 +1,207 @@
 """
 Aggregatore automatico dei risultati per visualizzazione.
+
+L'aggregazione da file è incrementale: un manifest nella directory dei
+risultati memorizza per ogni file mtime, dimensione, hash del contenuto e
+l'entry già estratta, così solo i file nuovi o modificati vengono riletti
+(in parallelo su un thread pool).
 """
+import hashlib
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+
+MANIFEST_FILENAME = ".aggregate_manifest.json"
+MANIFEST_VERSION = 1
 
 
-def aggregate_task_results(results_dir: Path, task_name: str) -> List[Dict[str, Any]]:
+def derive_variant(config: Dict[str, Any]) -> str:
     """
-    Aggrega tutti i file *_results.json in una directory.
+    Ricava la variante di prompt dalla config della run.
+
+    Usa, nell'ordine, 'variant', 'prompt_variant' e 'prompt_format'
+    (es. 'json', 'xml_variant', 'cot'), poi la compattazione del contesto
+    JSON se diversa dal formato originale (es. 'compact_tabular');
+    altrimenti 'default'.
+    """
+    for key in ('variant', 'prompt_variant', 'prompt_format'):
+        value = config.get(key)
+        if value:
+            return str(value).lower()
+    compaction = config.get('compaction')
+    if compaction and compaction != 'indent':
+        return f"compact_{compaction}"
+    return 'default'
+
+
+def _build_entry(data: Dict[str, Any], result_file: Path, task_name: str) -> Dict[str, Any]:
+    """Crea l'entry aggregata a partire dal contenuto di un file risultati."""
+    if not isinstance(data, dict) or not isinstance(data.get('config'), dict) or not isinstance(data.get('metrics'), dict):
+        raise ValueError("struttura non valida: attesi oggetti 'config' e 'metrics'")
+
+    # Estrai model name dal filename
+    model_key = result_file.stem.replace('_results', '')
+
+    return {
+        'task': task_name,
+        'model': data['config'].get('model_name', model_key),
+        'variant': derive_variant(data['config']),
+        'config': data['config'],
+        'metrics': data['metrics'],
+    }
+
+
+def _parse_result_file(
+    result_file: Path,
+    task_name: str,
+    previous: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Legge e valida un file risultati.
+
+    Se l'hash del contenuto coincide con quello nel manifest (file solo
+    "toccato"), riusa l'entry precedente senza rifare il parsing.
+
+    Returns:
+        Tupla (sha256 contenuto, entry o None, messaggio di errore o None);
+        sha256 è None se il file non è leggibile
+    """
+    try:
+        raw = result_file.read_bytes()
+    except OSError as e:
+        return None, None, str(e)
+    digest = hashlib.sha256(raw).hexdigest()
+    if previous and previous['sha256'] == digest and previous.get('task') == task_name:
+        return digest, previous['entry'], previous['error']
+    try:
+        entry = _build_entry(json.loads(raw), result_file, task_name)
+        return digest, entry, None
+    except (ValueError, TypeError, AttributeError) as e:
+        return digest, None, str(e)
+
+
+def _load_manifest(manifest_path: Path) -> Dict[str, Any]:
+    if not manifest_path.exists():
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get('version') != MANIFEST_VERSION:
+        return {}
+    return manifest.get('files', {})
+
+
+def _save_manifest(manifest_path: Path, files: Dict[str, Any]):
+    # Scrittura atomica: un manifest troncato invaliderebbe tutta la cache
+    tmp_path = manifest_path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'version': MANIFEST_VERSION, 'files': files}, f, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+
+def aggregate_task_results_with_errors(
+    results_dir: Path,
+    task_name: str,
+    recursive: bool = False,
+    max_workers: int = 8,
+) -> Tuple[List[Dict[str, Any]], List[Tuple[str, str]]]:
+    """
+    Aggrega i file *_results.json in modo incrementale e riporta i file non validi.
 
     Args:
         results_dir: Directory contenente i file JSON dei risultati
         task_name: Nome della task
+        recursive: Cerca anche nelle sottodirectory (storico di più run)
+        max_workers: Thread usati per leggere i file nuovi o modificati
 
     Returns:
-        Lista di dict con struttura per visualizer_bubble.py
+        Tupla (entries per visualizer_bubble.py, lista di (path, errore))
     """
-    aggregated = []
-
-    # Trova tutti i file *_results.json
-    result_files = list(results_dir.glob("*_results.json"))
+    results_dir = Path(results_dir)
+    pattern = "**/*_results.json" if recursive else "*_results.json"
+    result_files = sorted(results_dir.glob(pattern))
 
     if not result_files:
-        return []
+        return [], []
+
+    manifest_path = results_dir / MANIFEST_FILENAME
+    cached = _load_manifest(manifest_path)
+    files: Dict[str, Any] = {}
+    to_parse = []
+    # File non leggibili (rimossi durante la scansione, permessi): riportati ma
+    # non salvati nel manifest, così la scansione successiva li riprova
+    unreadable = []
 
     for result_file in result_files:
+        key = result_file.relative_to(results_dir).as_posix()
         try:
-            with open(result_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-
-            # Estrai model name dal filename
-            model_key = result_file.stem.replace('_results', '')
+            stat = result_file.stat()
+        except OSError as e:
+            unreadable.append((str(result_file), str(e)))
+            continue
+        previous = cached.get(key)
+        # mtime e size invariati (e stessa task): riusa l'entry senza rileggere il file
+        if (previous and previous['mtime_ns'] == stat.st_mtime_ns and previous['size'] == stat.st_size
+                and previous.get('task') == task_name):
+            files[key] = previous
+        else:
+            to_parse.append((key, result_file, stat, previous))
 
-            # Crea entry aggregata
-            entry = {
+    if to_parse:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parsed = list(executor.map(lambda item: _parse_result_file(item[1], task_name, item[3]), to_parse))
+        for (key, result_file, stat, previous), (digest, entry, error) in zip(to_parse, parsed):
+            if digest is None:
+                unreadable.append((str(result_file), error))
+                continue
+            files[key] = {
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha256': digest,
                 'task': task_name,
-                'model': data['config'].get('model_name', model_key),
-                'variant': 'default',
-                'config': data['config'],
-                'metrics': data['metrics']
+                'entry': entry,
+                'error': error,
             }
+        _save_manifest(manifest_path, files)
+    elif set(files) != set(cached):
+        # File rimossi dalla directory: aggiorna il manifest
+        _save_manifest(manifest_path, files)
+
+    aggregated = []
+    errors = []
+    for key in sorted(files):
+        record = files[key]
+        if record['error']:
+            errors.append((str(results_dir / key), record['error']))
+        else:
+            aggregated.append(record['entry'])
 
-            aggregated.append(entry)
+    return aggregated, sorted(errors + unreadable)
 
-        except Exception:
-            continue
+
+def aggregate_task_results(results_dir: Path, task_name: str, recursive: bool = False) -> List[Dict[str, Any]]:
+    """
+    Aggrega tutti i file *_results.json in una directory.
+
+    I file malformati vengono segnalati a video invece di essere ignorati
+    silenziosamente.
+
+    Args:
+        results_dir: Directory contenente i file JSON dei risultati
+        task_name: Nome della task
+        recursive: Cerca anche nelle sottodirectory
+
+    Returns:
+        Lista di dict con struttura per visualizer_bubble.py
+    """
+    aggregated, errors = aggregate_task_results_with_errors(results_dir, task_name, recursive=recursive)
+
+    for path, error in errors:
+        print(f"[!] File risultati non valido: {path} ({error})")
 
     return aggregated
 
@@ -54,3 +210,27 @@ def save_aggregated_results(aggregated: List[Dict[str, Any]], output_path: Path)
     """Salva i risultati aggregati in un file JSON."""
     with open(output_path, 'w', encoding='utf-8') as f:
         json.dump(aggregated, f, indent=2, ensure_ascii=False)
+
+
+def aggregate_store_results(store, task_name: str, run_timestamp: str = None) -> List[Dict[str, Any]]:
+    """
+    Aggrega i risultati di una task leggendo dall'archivio SQLite.
+
+    Args:
+        store: ResultsStore
+        task_name: Nome della task
+        run_timestamp: Limita alla run indicata (default: tutte le run)
+
+    Returns:
+        Lista di dict con struttura per visualizer_bubble.py
+    """
+    return [
+        {
+            'task': run['task'],
+            'model': run['model'],
+            'variant': run['variant'],
+            'config': run['config'],
+            'metrics': run['metrics'],
+        }
+        for run in store.query_runs(task=task_name, run_timestamp=run_timestamp)
+    ]
@@ -0,0 +1,470 @@
+"""
+Archivio SQLite dei risultati del benchmark.
+
+Tabelle:
+- runs: una riga per (task, modello, run) con timestamp e variante
+- configs: configurazione completa della run (JSON)
+- records: risultati per singolo esempio (predizione, latenza, costo, token)
+- metrics: metriche aggregate finali della run
+
+Le scritture dei record sono bufferizzate e inserite a batch; le query sono
+indicizzate per task/modello/data. Uso da riga di comando:
+
+    python -m src.results_store import results/
+    python -m src.results_store query --task routing --model "GPT-4o Mini" --metric routing_accuracy --last 30
+"""
+import argparse
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.model_config import MODELS
+from src.result_aggregator import derive_variant
+
+DEFAULT_DB_PATH = "results/verabench.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_timestamp TEXT NOT NULL,
+    task TEXT NOT NULL,
+    model_key TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    provider TEXT,
+    variant TEXT NOT NULL DEFAULT 'default',
+    created_at TEXT NOT NULL,
+    source_path TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS configs (
+    run_id INTEGER PRIMARY KEY REFERENCES runs(run_id),
+    config_json TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS records (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    seq INTEGER NOT NULL,
+    example_id TEXT NOT NULL,
+    predicted TEXT,
+    latency REAL,
+    cost REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    extra_json TEXT,
+    PRIMARY KEY (run_id, seq)
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    name TEXT NOT NULL,
+    value REAL,
+    value_json TEXT NOT NULL,
+    PRIMARY KEY (run_id, name)
+);
+CREATE INDEX IF NOT EXISTS idx_runs_task_model_date ON runs(task, model_name, created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_task_date ON runs(task, created_at);
+CREATE INDEX IF NOT EXISTS idx_runs_timestamp ON runs(run_timestamp);
+CREATE INDEX IF NOT EXISTS idx_records_example ON records(run_id, example_id);
+"""
+
+# Campi del record per esempio mappati su colonne dedicate
+RECORD_COLUMNS = ("example_id", "predicted", "latency", "cost", "prompt_tokens", "completion_tokens")
+
+
+class ResultsStore:
+    """Archivio dei risultati su SQLite (thread-safe, scritture a batch)."""
+
+    def __init__(self, db_path: str = DEFAULT_DB_PATH, batch_size: int = 500):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self._lock = threading.RLock()
+        self._pending_records: List[Tuple] = []
+        self._next_seq: Dict[int, int] = {}
+
+        self.conn = sqlite3.connect(str(self.db_path), timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL permette letture concorrenti mentre un processo scrive
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    # ------------------------------------------------------------------
+    # Scrittura
+    # ------------------------------------------------------------------
+
+    def start_run(
+        self,
+        task: str,
+        model_key: str,
+        config: Dict[str, Any],
+        run_timestamp: str,
+        source_path: Optional[str] = None,
+        created_at: Optional[str] = None,
+    ) -> int:
+        """Registra una nuova run e la sua configurazione. Restituisce run_id."""
+        created_at = created_at or datetime.now().isoformat(timespec='seconds')
+        with self._lock:
+            if source_path:
+                # Il file è stato riscritto (stessa run_timestamp): la run precedente non ne è più la sorgente
+                self.conn.execute("UPDATE runs SET source_path = NULL WHERE source_path = ?", (source_path,))
+            cursor = self.conn.execute(
+                "INSERT INTO runs (run_timestamp, task, model_key, model_name, provider, variant, created_at, source_path) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    run_timestamp,
+                    task,
+                    model_key,
+                    config.get('model_name', model_key),
+                    config.get('provider'),
+                    derive_variant(config),
+                    created_at,
+                    source_path,
+                ),
+            )
+            run_id = cursor.lastrowid
+            self.conn.execute(
+                "INSERT INTO configs (run_id, config_json) VALUES (?, ?)",
+                (run_id, json.dumps(config, ensure_ascii=False)),
+            )
+            self.conn.commit()
+            self._next_seq[run_id] = 0
+        return run_id
+
+    def add_record(self, run_id: int, record: Dict[str, Any]):
+        """Accoda un risultato per esempio; scritto su disco a batch."""
+        extra = {key: value for key, value in record.items() if key not in RECORD_COLUMNS}
+        with self._lock:
+            seq = self._next_seq.get(run_id, 0)
+            self._next_seq[run_id] = seq + 1
+            self._pending_records.append((
+                run_id,
+                seq,
+                str(record['example_id']),
+                record.get('predicted'),
+                record.get('latency'),
+                record.get('cost'),
+                record.get('prompt_tokens'),
+                record.get('completion_tokens'),
+                json.dumps(extra, ensure_ascii=False) if extra else None,
+            ))
+            if len(self._pending_records) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """Scrive su disco i record in attesa."""
+        with self._lock:
+            if not self._pending_records:
+                return
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO records "
+                "(run_id, seq, example_id, predicted, latency, cost, prompt_tokens, completion_tokens, extra_json) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                self._pending_records,
+            )
+            self.conn.commit()
+            self._pending_records = []
+
+    def finish_run(self, run_id: int, metrics: Dict[str, Any]):
+        """Scrive i record rimanenti e le metriche aggregate della run."""
+        rows = []
+        for name, value in metrics.items():
+            numeric = float(value) if isinstance(value, (int, float)) else None
+            rows.append((run_id, name, numeric, json.dumps(value, ensure_ascii=False)))
+        with self._lock:
+            self.flush()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO metrics (run_id, name, value, value_json) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+            self._next_seq.pop(run_id, None)
+
+    def save_run(
+        self,
+        task: str,
+        model_key: str,
+        config: Dict[str, Any],
+        metrics: Dict[str, Any],
+        run_timestamp: str,
+        records: Optional[List[Dict[str, Any]]] = None,
+        source_path: Optional[str] = None,
+        created_at: Optional[str] = None,
+    ) -> int:
+        """Salva una run completa (config, record per esempio e metriche)."""
+        run_id = self.start_run(task, model_key, config, run_timestamp, source_path, created_at)
+        for record in records or []:
+            self.add_record(run_id, record)
+        self.finish_run(run_id, metrics)
+        return run_id
+
+    # ------------------------------------------------------------------
+    # Lettura
+    # ------------------------------------------------------------------
+
+    def query_runs(
+        self,
+        task: Optional[str] = None,
+        model: Optional[str] = None,
+        run_timestamp: Optional[str] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Restituisce le run filtrate, dalla più recente.
+
+        Args:
+            task: Nome task
+            model: Nome modello (model_name) o chiave (model_key)
+            run_timestamp: Timestamp della run (nome della directory risultati)
+            since/until: Date ISO (YYYY-MM-DD o datetime) su created_at
+            limit: Numero massimo di run
+
+        Returns:
+            Lista di entry nel formato di aggregate_task_results
+            (task, model, variant, config, metrics) più run_id/run_timestamp/created_at
+        """
+        clauses, params = [], []
+        if task:
+            clauses.append("r.task = ?")
+            params.append(task)
+        if model:
+            clauses.append("(r.model_name = ? OR r.model_key = ?)")
+            params.extend([model, model])
+        if run_timestamp:
+            clauses.append("r.run_timestamp = ?")
+            params.append(run_timestamp)
+        if since:
+            clauses.append("r.created_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("r.created_at <= ?")
+            params.append(until)
+
+        query = (
+            "SELECT r.*, c.config_json FROM runs r JOIN configs c ON c.run_id = r.run_id"
+            + (" WHERE " + " AND ".join(clauses) if clauses else "")
+            + " ORDER BY r.created_at DESC, r.run_id DESC"
+        )
+        if limit:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            runs = self.conn.execute(query, params).fetchall()
+            metrics_by_run = self._load_metrics([row['run_id'] for row in runs])
+
+        return [
+            {
+                'task': row['task'],
+                'model': row['model_name'],
+                'variant': row['variant'],
+                'config': json.loads(row['config_json']),
+                'metrics': metrics_by_run.get(row['run_id'], {}),
+                'run_id': row['run_id'],
+                'run_timestamp': row['run_timestamp'],
+                'created_at': row['created_at'],
+            }
+            for row in runs
+        ]
+
+    def _load_metrics(self, run_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        metrics_by_run: Dict[int, Dict[str, Any]] = {}
+        # Limite SQLite sul numero di parametri per query
+        for start in range(0, len(run_ids), 500):
+            chunk = run_ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT run_id, name, value_json FROM metrics WHERE run_id IN ({placeholders})",
+                chunk,
+            )
+            for row in rows:
+                metrics_by_run.setdefault(row['run_id'], {})[row['name']] = json.loads(row['value_json'])
+        return metrics_by_run
+
+    def metric_history(
+        self,
+        task: str,
+        model: str,
+        metric: str,
+        last_n: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """Andamento di una metrica nelle ultime N run di un modello su una task."""
+        query = (
+            "SELECT r.run_id, r.run_timestamp, r.created_at, r.variant, m.value "
+            "FROM runs r JOIN metrics m ON m.run_id = r.run_id "
+            "WHERE r.task = ? AND (r.model_name = ? OR r.model_key = ?) AND m.name = ? "
+            "ORDER BY r.created_at DESC, r.run_id DESC"
+        )
+        params: List[Any] = [task, model, model, metric]
+        if last_n:
+            query += " LIMIT ?"
+            params.append(last_n)
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(query, params)]
+
+    def usage_stats(
+        self,
+        task: str,
+        model: Optional[str] = None,
+        exclude_provider: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Token in output e latenza medi per esempio nelle run passate.
+
+        Args:
+            task: Nome task
+            model: Nome modello (model_name) o chiave (model_key); None = tutti i modelli
+            exclude_provider: Provider da escludere (es. "mock")
+
+        Returns:
+            Dict con examples, avg_completion_tokens, avg_latency (None se nessun record)
+        """
+        query = (
+            "SELECT COUNT(*) AS examples, AVG(rec.completion_tokens) AS avg_completion_tokens, "
+            "AVG(rec.latency) AS avg_latency "
+            "FROM records rec JOIN runs r ON r.run_id = rec.run_id "
+            "WHERE r.task = ? AND rec.completion_tokens IS NOT NULL"
+        )
+        params: List[Any] = [task]
+        if model:
+            query += " AND (r.model_name = ? OR r.model_key = ?)"
+            params.extend([model, model])
+        if exclude_provider:
+            query += " AND r.provider IS NOT ?"
+            params.append(exclude_provider)
+        with self._lock:
+            self.flush()
+            return dict(self.conn.execute(query, params).fetchone())
+
+    def get_records(self, run_id: int) -> List[Dict[str, Any]]:
+        """Risultati per esempio di una run, nell'ordine di esecuzione."""
+        with self._lock:
+            self.flush()
+            rows = self.conn.execute(
+                "SELECT * FROM records WHERE run_id = ? ORDER BY seq", (run_id,)
+            ).fetchall()
+        records = []
+        for row in rows:
+            record = {column: row[column] for column in RECORD_COLUMNS}
+            if row['extra_json']:
+                record.update(json.loads(row['extra_json']))
+            records.append(record)
+        return records
+
+    def has_source(self, source_path: str) -> bool:
+        with self._lock:
+            row = self.conn.execute("SELECT 1 FROM runs WHERE source_path = ?", (source_path,)).fetchone()
+        return row is not None
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self.conn.close()
+
+
+def model_key_from_results_file(result_file: Path) -> str:
+    """
+    Chiave del modello dal nome del file, come lo scrivono i runner
+    (<model_key con / sostituito da _>_results.json).
+
+    Per i modelli configurati restituisce la chiave originale (con /), la
+    stessa delle run salvate dal vivo; altrimenti il nome del file.
+    """
+    safe_key = result_file.name[:-len("_results.json")]
+    return next((key for key in MODELS if key.replace('/', '_') == safe_key), safe_key)
+
+
+def import_results_tree(store: ResultsStore, root: str = "results") -> Dict[str, Any]:
+    """
+    Importa i file results/<task>/<timestamp>/*_results.json esistenti.
+
+    L'import è idempotente: i file già importati (stesso path) vengono saltati.
+
+    Returns:
+        Dict con conteggi imported/skipped e lista errors (path, messaggio)
+    """
+    summary = {"imported": 0, "skipped": 0, "errors": []}
+
+    for result_file in sorted(Path(root).glob("**/*_results.json")):
+        source_path = str(result_file.resolve())
+        if store.has_source(source_path):
+            summary["skipped"] += 1
+            continue
+        try:
+            with open(result_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            config = data['config']
+            metrics = data['metrics']
+            # Layout: results/<task>/<timestamp>/<model>_results.json
+            task = config.get('task', result_file.parent.parent.name)
+            run_timestamp = result_file.parent.name
+            # Come i runner: la chiave è quella del file, non il model_id del provider
+            model_key = model_key_from_results_file(result_file)
+            try:
+                created_at = datetime.strptime(run_timestamp, "%Y%m%d_%H%M%S").isoformat()
+            except ValueError:
+                created_at = datetime.fromtimestamp(result_file.stat().st_mtime).isoformat(timespec='seconds')
+
+            store.save_run(
+                task=task,
+                model_key=model_key,
+                config=config,
+                metrics=metrics,
+                run_timestamp=run_timestamp,
+                records=data.get('examples'),
+                source_path=source_path,
+                created_at=created_at,
+            )
+            summary["imported"] += 1
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            summary["errors"].append((str(result_file), str(e)))
+
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archivio risultati VERABENCH")
+    parser.add_argument("--db", type=str, default=DEFAULT_DB_PATH, help="Path del database SQLite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Importa i file *_results.json esistenti")
+    import_parser.add_argument("root", nargs="?", default="results", help="Directory radice dei risultati")
+
+    query_parser = subparsers.add_parser("query", help="Interroga le run salvate")
+    query_parser.add_argument("--task", type=str, required=True)
+    query_parser.add_argument("--model", type=str, default=None)
+    query_parser.add_argument("--metric", type=str, default=None, help="Mostra l'andamento di una metrica")
+    query_parser.add_argument("--since", type=str, default=None, help="Data minima (YYYY-MM-DD)")
+    query_parser.add_argument("--last", type=int, default=None, help="Ultime N run")
+
+    args = parser.parse_args()
+    store = ResultsStore(args.db)
+
+    if args.command == "import":
+        summary = import_results_tree(store, args.root)
+        print(f"[OK] Importati: {summary['imported']} | Già presenti: {summary['skipped']}")
+        for path, error in summary["errors"]:
+            print(f"[X] {path}: {error}")
+    elif args.metric and args.model:
+        history = store.metric_history(args.task, args.model, args.metric, args.last)
+        print(f"{'Run':<18} {'Variant':<10} {args.metric}")
+        print("-" * 60)
+        for row in history:
+            value = f"{row['value']:.4f}" if row['value'] is not None else "-"
+            print(f"{row['run_timestamp']:<18} {row['variant']:<10} {value}")
+    else:
+        runs = store.query_runs(task=args.task, model=args.model, since=args.since, limit=args.last)
+        print(f"{'Run':<18} {'Model':<30} {'Variant':<10} {'Examples':>8}")
+        print("-" * 70)
+        for run in runs:
+            print(f"{run['run_timestamp']:<18} {run['model']:<30} {run['variant']:<10} "
+                  f"{run['metrics'].get('total_examples', 0):>8}")
+
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,494 @@
+"""
+Scheduler multi-giorno con quote giornaliere per provider (free tier).
+
+Le sweep grandi sui free tier (Cerebras 14.400 richieste e 1M token al
+giorno, OpenRouter 50-1000 richieste al giorno) non finiscono in un giorno.
+Lo scheduler mantiene una coda persistente di job (task, modello, selezione
+del dataset) e il consumo giornaliero per provider in results/scheduler/:
+
+- state.json: job in coda con gli id degli esempi e consumo per giorno
+  (UTC, come il reset delle quote) e provider
+- jobs/<job_id>.jsonl: un record per esecuzione completata (ripresa),
+  con chiave (example_id, attempt): i test di consistenza della task judge
+  sono eseguiti più volte (TaskSpec.runs_for)
+
+`run` esegue un esempio alla volta finché la quota del giorno lo permette
+(rpd/tpd di get_rate_limits, con la stima pessimistica dei token prima
+della richiesta) e rispetta rpm con un intervallo minimo tra le richieste.
+Il consumo si conta per provider; un modello con rate_limits propri nella
+configurazione (quote per modello, es. Gemini) ha un contatore suo.
+A quota esaurita passa ai job degli altri provider; quando nessun job può
+avanzare si sospende fino al reset (mezzanotte UTC) e riprende da solo, o
+termina con --no-wait (es. da cron). Un'esecuzione che fallisce
+MAX_ATTEMPTS volte è abbandonata e il job si chiude senza di essa. Ogni
+richiesta passa dal CostLedger come nei runner: con --budget-run o
+--budget-day lo scheduler si ferma al raggiungimento del limite.
+
+Un job completato viene valutato con i calcolatori di metriche della task e
+salvato come una run normale (results/<task>/<timestamp>/ e archivio,
+execution="scheduled"); a coda finita stampa il riepilogo di tutti i job.
+Un job completato non viene riaccodato: `add --rerun` lo rimette in coda
+da zero per una nuova run.
+
+Il consumo registrato è solo quello dello scheduler: richieste fatte con
+la stessa chiave da altri processi non sono conteggiate.
+
+    python -m src.scheduler add --task routing --models llama3.1-8b,qwen-3-32b
+    python -m src.scheduler run
+    python -m src.scheduler status
+"""
+import argparse
+import fcntl
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.compaction import COMPACTION_MODES, DEFAULT_COMPACTION
+from src.cost_ledger import BudgetExceededError, CostLedger, estimate_request_cost
+from src.env import load_dotenv
+from src.incremental import record_hashes
+from src.inference_client import ModelInferenceClient
+from src.logger import ResultLogger
+from src.metrics import calculate_cost
+from src.model_config import MODELS, PROVIDER_RATE_LIMITS, get_model_config, get_rate_limits
+from src.results_store import ResultsStore
+from src.task_specs import build_run_config, get_task_spec, make_job_id
+
+DEFAULT_SCHEDULER_DIR = "results/scheduler"
+CHARS_PER_TOKEN = 4
+# Tentativi falliti dopo cui un'esecuzione è abbandonata
+MAX_ATTEMPTS = 3
+
+
+def quota_day(now: Optional[datetime] = None) -> str:
+    """Giorno di quota corrente (le quote dei provider si azzerano a mezzanotte UTC)."""
+    return (now or datetime.now(timezone.utc)).date().isoformat()
+
+
+def seconds_until_reset(now: Optional[datetime] = None) -> float:
+    now = now or datetime.now(timezone.utc)
+    tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time(), tzinfo=timezone.utc)
+    return (tomorrow - now).total_seconds()
+
+
+def quota_key(model_key: str) -> str:
+    """Contatore di quota del modello: il modello stesso se ha rate_limits propri, altrimenti il provider."""
+    model_config = get_model_config(model_key)
+    return model_key if "rate_limits" in model_config else model_config['provider']
+
+
+def quota_limits(key: str) -> Dict[str, Any]:
+    """Limiti di un contatore di quota (chiave di modello o provider)."""
+    return get_rate_limits(key) if key in MODELS else PROVIDER_RATE_LIMITS.get(key, {})
+
+
+def run_key(example_id: Any, attempt: int) -> str:
+    """Chiave di un'esecuzione nello stato (example_id#attempt)."""
+    return f"{example_id}#{attempt}"
+
+
+class QuotaScheduler:
+    """Coda persistente di job con consumo giornaliero per provider."""
+
+    def __init__(self, root: str = DEFAULT_SCHEDULER_DIR, cost_ledger: Optional[CostLedger] = None):
+        self.root = Path(root)
+        self.state_path = self.root / "state.json"
+        self.jobs_dir = self.root / "jobs"
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self._last_request: Dict[str, float] = {}
+        self.cost_ledger = cost_ledger or CostLedger()
+
+    # --- stato ---
+
+    def load_state(self) -> Dict[str, Any]:
+        if not self.state_path.exists():
+            return {"jobs": {}, "usage": {}}
+        with open(self.state_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_state(self, state: Dict[str, Any]):
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.state_path)
+
+    def _records_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.jsonl"
+
+    def completed_records(self, job_id: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """Record delle esecuzioni già completate per (example_id, attempt)."""
+        path = self._records_path(job_id)
+        if not path.exists():
+            return {}
+        records = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    records[(str(record["example_id"]), record.get("attempt", 0))] = record
+        return records
+
+    # --- coda ---
+
+    def add_jobs(
+        self,
+        task: str,
+        model_keys: List[str],
+        sample_size: Optional[int] = None,
+        shard: Optional[str] = None,
+        compaction: str = DEFAULT_COMPACTION,
+        rerun: bool = False,
+    ) -> List[str]:
+        """
+        Accoda un job per modello; un job già in coda con la stessa selezione non viene duplicato.
+
+        Un job già completato resta tale: con rerun viene rimesso in coda da
+        zero (record e tentativi falliti azzerati) per una nuova run.
+        """
+        spec = get_task_spec(task)
+        test_cases = spec.load_test_cases(sample_size=sample_size, shard=shard)
+        state = self.load_state()
+        added = []
+        for model_key in model_keys:
+            model_config = get_model_config(model_key)
+            job_id = make_job_id(task, model_key, sample_size, shard, compaction)
+            if job_id in state["jobs"]:
+                status = state["jobs"][job_id]["status"]
+                if status != "done":
+                    print(f"[=] {job_id} già in coda ({status})")
+                    continue
+                if not rerun:
+                    print(f"[=] {job_id} già completato (--rerun per una nuova run)")
+                    continue
+                self._records_path(job_id).unlink(missing_ok=True)
+            state["jobs"][job_id] = {
+                "task": task,
+                "model_key": model_key,
+                "provider": model_config['provider'],
+                "sample_size": sample_size,
+                "shard": shard,
+                "compaction": compaction,
+                "example_ids": [str(test_case['id']) for test_case in test_cases],
+                "requests": sum(spec.runs_for(test_case) for test_case in test_cases),
+                "status": "pending",
+                "created_at": datetime.now().isoformat(timespec="seconds"),
+                "days": [],
+            }
+            added.append(job_id)
+            print(f"[+] {job_id}: {len(test_cases)} esempi, {state['jobs'][job_id]['requests']} richieste "
+                  f"({model_config['provider']})")
+        self.save_state(state)
+        return added
+
+    # --- quote ---
+
+    def _usage(self, state: Dict[str, Any], key: str) -> Dict[str, int]:
+        day = state["usage"].setdefault(quota_day(), {})
+        return day.setdefault(key, {"requests": 0, "tokens": 0})
+
+    def _fits_quota(self, state: Dict[str, Any], key: str, estimated_tokens: int) -> bool:
+        limits = quota_limits(key)
+        usage = self._usage(state, key)
+        if limits.get("rpd") is not None and usage["requests"] + 1 > limits["rpd"]:
+            return False
+        if limits.get("tpd") is not None and usage["tokens"] + estimated_tokens > limits["tpd"]:
+            return False
+        return True
+
+    def _pace(self, key: str):
+        """Intervallo minimo tra due richieste dello stesso contatore di quota secondo rpm."""
+        rpm = quota_limits(key).get("rpm")
+        if rpm:
+            wait = self._last_request.get(key, 0.0) + 60.0 / rpm - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        self._last_request[key] = time.monotonic()
+
+    # --- esecuzione ---
+
+    def run_job(self, state: Dict[str, Any], job_id: str, clients: Dict[str, ModelInferenceClient]) -> str:
+        """
+        Esegue le esecuzioni mancanti del job finché quota e budget lo permettono.
+
+        Returns:
+            "done" se il job è completo, "quota" se la quota del giorno è esaurita,
+            "budget" se un limite del CostLedger è raggiunto, altrimenti "pending"
+        """
+        job = state["jobs"][job_id]
+        spec = get_task_spec(job["task"], compaction=job["compaction"])
+        model_config = get_model_config(job["model_key"])
+        provider = job["provider"]
+        quota = quota_key(job["model_key"])
+        test_cases = spec.load_test_cases(sample_size=job["sample_size"], shard=job["shard"])
+        done = self.completed_records(job_id)
+        failures = job.setdefault("failures", {})
+        missing = [
+            (example_id, attempt)
+            for example_id in job["example_ids"]
+            for attempt in range(spec.runs_for(test_cases.get(example_id)))
+            if (example_id, attempt) not in done and failures.get(run_key(example_id, attempt), 0) < MAX_ATTEMPTS
+        ]
+        if not missing:
+            return "done"
+
+        if job["model_key"] not in clients:
+            clients[job["model_key"]] = ModelInferenceClient(model_config['id'], provider=provider)
+        client = clients[job["model_key"]]
+
+        job["status"] = "running"
+        if quota_day() not in job["days"]:
+            job["days"].append(quota_day())
+        print(f"\n[*] {job_id}: {len(missing)} richieste mancanti su {job.get('requests', len(job['example_ids']))}")
+
+        with open(self._records_path(job_id), "a", encoding="utf-8") as records_file:
+            for example_id, attempt in missing:
+                test_case = test_cases.get(example_id)
+                user_prompt = spec.render_user_prompt(test_case)
+                # Stima pessimistica: prompt ~4 caratteri per token + output massimo
+                estimated_tokens = (len(spec.system_prompt) + len(user_prompt)) // CHARS_PER_TOKEN + spec.max_new_tokens
+                if not self._fits_quota(state, quota, estimated_tokens):
+                    self.save_state(state)
+                    return "quota"
+
+                usage = self._usage(state, quota)
+                try:
+                    # Riserva la stima pessimistica prima della chiamata, poi registra il costo reale
+                    estimate = estimate_request_cost(model_config, spec.system_prompt, user_prompt, spec.max_new_tokens)
+                    with self.cost_ledger.charge(job["model_key"], estimate) as charge:
+                        self._pace(quota)
+                        usage["requests"] += 1
+                        predicted, latency, token_usage = client.generate(
+                            system_prompt=spec.system_prompt,
+                            user_prompt=user_prompt,
+                            max_new_tokens=spec.max_new_tokens,
+                            temperature=0.0,
+                        )
+                        cost = calculate_cost(
+                            token_usage['prompt_tokens'],
+                            token_usage['completion_tokens'],
+                            model_config['input_price_per_1m'],
+                            model_config['output_price_per_1m'],
+                        )
+                        charge.settle(cost, token_usage.get("api_key_id"))
+                except BudgetExceededError as e:
+                    print(f"[!] {e}: {job_id} sospeso")
+                    self.save_state(state)
+                    return "budget"
+                except Exception as e:
+                    # Richiesta contata nella quota; l'esecuzione si rifà fino a MAX_ATTEMPTS volte
+                    key = run_key(example_id, attempt)
+                    failures[key] = failures.get(key, 0) + 1
+                    abandoned = " (abbandonato)" if failures[key] >= MAX_ATTEMPTS else ""
+                    print(f"ERRORE test {example_id} attempt {attempt} "
+                          f"[{failures[key]}/{MAX_ATTEMPTS}]{abandoned}: {str(e)}")
+                    self.save_state(state)
+                    continue
+                usage["tokens"] += token_usage['prompt_tokens'] + token_usage['completion_tokens']
+
+                record = {
+                    "example_id": test_case['id'],
+                    "attempt": attempt,
+                    "predicted": predicted,
+                    "latency": latency,
+                    "cost": cost,
+                    "prompt_tokens": token_usage['prompt_tokens'],
+                    "completion_tokens": token_usage['completion_tokens'],
+                    "day": quota_day(),
+                    **record_hashes(test_case, spec.system_prompt, user_prompt, model_config, spec.max_new_tokens, 0.0),
+                }
+                records_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                records_file.flush()
+                self.save_state(state)
+
+        done = self.completed_records(job_id)
+        remaining = [key for key in missing if key not in done and failures.get(run_key(*key), 0) < MAX_ATTEMPTS]
+        return "pending" if remaining else "done"
+
+    def finalize_job(self, state: Dict[str, Any], job_id: str) -> Dict[str, Any]:
+        """Valuta il job completo e lo salva come run (results/<task>/<timestamp>/ e archivio)."""
+        job = state["jobs"][job_id]
+        spec = get_task_spec(job["task"], compaction=job["compaction"])
+        model_config = get_model_config(job["model_key"])
+        records = self.completed_records(job_id)
+        test_cases = spec.load_test_cases(sample_size=job["sample_size"], shard=job["shard"])
+
+        metrics = spec.create_metrics()
+        examples = []
+        for test_case in test_cases:
+            for attempt in range(spec.runs_for(test_case)):
+                record = records.get((str(test_case['id']), attempt))
+                if record is None:
+                    continue
+                spec.add_prediction(metrics, record["predicted"], test_case, record["latency"], record["cost"])
+                examples.append({key: value for key, value in record.items() if key != "day"})
+        final_metrics = metrics.get_metrics()
+
+        config = build_run_config(
+            spec,
+            model_config,
+            seed=42,
+            sample_size=job["sample_size"],
+            shard=job["shard"],
+            total_examples=len(test_cases),
+            execution="scheduled",
+            scheduled_days=job["days"],
+            failed_requests=sum(1 for count in job.get("failures", {}).values() if count >= MAX_ATTEMPTS),
+        )
+
+        store = ResultsStore()
+        try:
+            result_logger = ResultLogger(f"results/{job['task']}", store=store)
+            result_logger.save_results({"config": config, "metrics": final_metrics}, job["model_key"], examples=examples)
+        finally:
+            store.close()
+
+        job["status"] = "done"
+        job["results_dir"] = str(result_logger.results_dir)
+        job["metrics"] = final_metrics
+        self.save_state(state)
+        return final_metrics
+
+    def run(self, wait: bool = True) -> bool:
+        """
+        Esegue la coda nei limiti delle quote, sospendendosi fino al reset se serve.
+
+        Returns:
+            True se tutti i job sono completati
+        """
+        load_dotenv()
+        lock_handle = open(self.root / "scheduler.lock", "a")
+        try:
+            fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_handle.close()
+            raise RuntimeError(f"Scheduler già in esecuzione su {self.root}")
+
+        clients: Dict[str, ModelInferenceClient] = {}
+        try:
+            while True:
+                state = self.load_state()
+                exhausted = set()
+                progressed = False
+                budget_stopped = False
+                for job_id, job in state["jobs"].items():
+                    if job["status"] == "done" or quota_key(job["model_key"]) in exhausted:
+                        continue
+                    # Avanzamento: esecuzioni completate o tentativi falliti (che portano all'abbandono)
+                    attempts_before = len(self.completed_records(job_id)) + sum(job.get("failures", {}).values())
+                    try:
+                        outcome = self.run_job(state, job_id, clients)
+                    except Exception as e:
+                        print(f"ERRORE {job_id}: {str(e)}")
+                        continue
+                    finally:
+                        attempts_after = len(self.completed_records(job_id)) + sum(job.get("failures", {}).values())
+                        progressed = progressed or attempts_after > attempts_before
+                    if outcome == "budget":
+                        budget_stopped = True
+                        break
+                    if outcome == "quota":
+                        exhausted.add(quota_key(job["model_key"]))
+                        print(f"[!] Quota giornaliera di {quota_key(job['model_key'])} esaurita")
+                    elif outcome == "done":
+                        final_metrics = self.finalize_job(state, job_id)
+                        accuracy_field = get_task_spec(job["task"]).accuracy_field
+                        print(f"[✓] {job_id} completato: {accuracy_field} {final_metrics.get(accuracy_field, 0.0):.3f}")
+
+                pending = [job_id for job_id, job in state["jobs"].items() if job["status"] != "done"]
+                if not pending:
+                    print_status(state)
+                    return True
+                if budget_stopped:
+                    print(f"\n[!] Limite di budget raggiunto: {len(pending)} job in sospeso, rilanciare con un limite "
+                          f"più alto o dopo il cambio di giorno per --budget-day")
+                    print_status(state, self)
+                    return False
+                if not exhausted:
+                    if progressed:
+                        # Esempi falliti per errori: nuovo giro senza attendere il reset
+                        continue
+                    print(f"\n[!] {len(pending)} job bloccati da errori: controllare configurazione e chiavi")
+                    print_status(state, self)
+                    return False
+                if not wait:
+                    print(f"\n[*] {len(pending)} job in sospeso: rilanciare dopo il reset delle quote (00:00 UTC)")
+                    return False
+                pause = seconds_until_reset() + 60
+                print(f"\n[*] {len(pending)} job in sospeso: riprendo tra {pause / 3600:.1f} ore (reset quote 00:00 UTC)")
+                time.sleep(pause)
+        finally:
+            fcntl.flock(lock_handle, fcntl.LOCK_UN)
+            lock_handle.close()
+
+
+def print_status(state: Dict[str, Any], scheduler: Optional[QuotaScheduler] = None):
+    """Avanzamento dei job, metriche dei job completati e consumo di oggi per provider."""
+    print(f"\n{'='*60}")
+    print("SCHEDULER")
+    print(f"{'='*60}")
+    print(f"{'Job':<48} {'Stato':<8} {'Esempi':>13} {'Giorni':>6}  Accuratezza")
+    for job_id, job in state["jobs"].items():
+        total = job.get("requests", len(job["example_ids"]))
+        if job["status"] == "done":
+            completed = total
+        else:
+            completed = len(scheduler.completed_records(job_id)) if scheduler else 0
+        accuracy = ""
+        if job.get("metrics"):
+            accuracy_field = get_task_spec(job["task"]).accuracy_field
+            accuracy = f"{job['metrics'].get(accuracy_field, 0.0):.3f}"
+        print(f"{job_id[:48]:<48} {job['status']:<8} {f'{completed}/{total}':>13} {len(job['days']):>6}  {accuracy}")
+
+    today = state["usage"].get(quota_day(), {})
+    if today:
+        print(f"\nConsumo di oggi ({quota_day()} UTC):")
+        for key, usage in sorted(today.items()):
+            limits = quota_limits(key)
+            rpd = f"/{limits['rpd']:,}" if limits.get("rpd") else ""
+            tpd = f"/{limits['tpd']:,}" if limits.get("tpd") else ""
+            print(f"  {key:<22} richieste {usage['requests']:,}{rpd}  token {usage['tokens']:,}{tpd}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler multi-giorno con quote giornaliere per provider")
+    parser.add_argument("--dir", type=str, default=DEFAULT_SCHEDULER_DIR, help="Cartella dello stato")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Accoda (task, modello) per ogni modello")
+    add_parser.add_argument("--task", required=True, help="Task da valutare")
+    add_parser.add_argument("--models", required=True, help="Chiavi dei modelli separate da virgola")
+    add_parser.add_argument("--sample", type=int, default=None, help="Campione stratificato di N esempi")
+    add_parser.add_argument("--shard", type=str, default=None, help="Solo lo shard i/N del dataset")
+    add_parser.add_argument("--compaction", choices=COMPACTION_MODES, default=DEFAULT_COMPACTION,
+                            help="Compattazione del contesto JSON nei prompt (rag, judge, final_answer)")
+    add_parser.add_argument("--rerun", action="store_true",
+                            help="Rimette in coda da zero i job già completati (nuova run)")
+
+    run_parser = subparsers.add_parser("run", help="Esegue la coda nei limiti delle quote giornaliere")
+    run_parser.add_argument("--no-wait", action="store_true",
+                            help="A quote esaurite termina invece di attendere il reset (es. da cron)")
+    run_parser.add_argument("--budget-run", type=float, default=None, help="Limite di spesa in USD per questa esecuzione")
+    run_parser.add_argument("--budget-day", type=float, default=None,
+                            help="Limite di spesa giornaliero in USD, condiviso tra processi (results/cost_ledger.json)")
+
+    subparsers.add_parser("status", help="Avanzamento dei job e consumo di oggi")
+    args = parser.parse_args()
+
+    cost_ledger = None
+    if args.command == "run":
+        cost_ledger = CostLedger(run_budget=args.budget_run, daily_budget=args.budget_day)
+    scheduler = QuotaScheduler(args.dir, cost_ledger=cost_ledger)
+    if args.command == "add":
+        model_keys = [key.strip() for key in args.models.split(",") if key.strip()]
+        scheduler.add_jobs(args.task, model_keys, args.sample, args.shard, args.compaction, rerun=args.rerun)
+    elif args.command == "run":
+        scheduler.run(wait=not args.no_wait)
+    else:
+        print_status(scheduler.load_state(), scheduler)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+"""
+Registro delle task del benchmark.
+
+Ogni TaskSpec raccoglie ciò che serve per eseguire una task fuori dal suo
+runner: percorsi di dataset e prompt, rendering dello user prompt, creazione
+del calcolatore di metriche e l'adattatore verso la sua add_prediction (le
+firme differiscono per task). Lo usano i runner main_*.py e gli strumenti
+che eseguono più task (benchmark dell'harness, pipeline, planner).
+
+Uso:
+    spec = get_task_spec("rag")
+    user_prompt = spec.render_user_prompt(test_case)
+    metrics = spec.create_metrics()
+    spec.add_prediction(metrics, predicted, test_case, latency, cost)
+
+Il contesto JSON incorporato nei prompt è serializzato con dump_context,
+secondo la modalità di compattazione della spec (vedi src/compaction.py).
+"""
+import hashlib
+import importlib
+import json
+from typing import Any, Dict, List, Optional
+
+from src.compaction import COMPACTABLE_TASKS, DEFAULT_COMPACTION, compact_json
+
+# Esecuzioni di ogni consistency_test della task judge
+CONSISTENCY_RUNS = 5
+
+
+def parse_json_response(response: str) -> Optional[Any]:
+    """JSON di una risposta del modello (anche in un blocco ```json); None se non valido."""
+    cleaned = response.strip()
+    if cleaned.startswith("```json"):
+        cleaned = cleaned[7:]
+    elif cleaned.startswith("```"):
+        cleaned = cleaned[3:]
+    if cleaned.endswith("```"):
+        cleaned = cleaned[:-3]
+    try:
+        return json.loads(cleaned.strip())
+    except json.JSONDecodeError:
+        return None
+
+
+class TaskSpec:
+    """Descrizione di una task; le sottoclassi specializzano prompt e metriche."""
+
+    name = ""
+    display_name = ""
+    # Metrica principale usata come "accuracy" nei grafici e nei ranking
+    accuracy_field = "accuracy"
+    # "modulo:Classe" del calcolatore di metriche (importato alla creazione)
+    metrics_class = ""
+    max_new_tokens = 300
+
+    def __init__(self, tasks_dir: str = "tasks", compaction: str = DEFAULT_COMPACTION):
+        self.tasks_dir = tasks_dir
+        self.compaction = compaction
+        self._prompt_config: Optional[Dict[str, Any]] = None
+
+    @property
+    def dataset_path(self) -> str:
+        return f"{self.tasks_dir}/{self.name}/dataset.json"
+
+    @property
+    def short_dataset_path(self) -> str:
+        return f"{self.tasks_dir}/{self.name}/dataset_short.json"
+
+    @property
+    def prompt_path(self) -> str:
+        return f"{self.tasks_dir}/{self.name}/prompt.json"
+
+    @property
+    def prompt_config(self) -> Dict[str, Any]:
+        if self._prompt_config is None:
+            with open(self.prompt_path, "r", encoding="utf-8") as f:
+                self._prompt_config = json.load(f)
+        return self._prompt_config
+
+    @property
+    def system_prompt(self) -> str:
+        return self.prompt_config["system_prompt"]
+
+    def load_test_cases(
+        self,
+        use_short_dataset: bool = False,
+        sample_size: Optional[int] = None,
+        shard: Optional[str] = None,
+        seed: int = 42,
+    ) -> List[Dict[str, Any]]:
+        """Test case selezionati come nei runner (il campione stratificato parte dal dataset completo)."""
+        from src.data_loader import load_test_cases
+
+        use_short = use_short_dataset and not sample_size
+        dataset_file = self.short_dataset_path if use_short else self.dataset_path
+        return load_test_cases(dataset_file, sample_size=sample_size, shard=shard, seed=seed)
+
+    def dump_context(self, value: Any) -> str:
+        """Serializza il contesto JSON di un prompt (indent=2 o forma compattata)."""
+        return compact_json(value, self.compaction)
+
+    def render_user_prompt(self, test_case: Dict[str, Any]) -> str:
+        return test_case["user_request"]
+
+    def create_metrics(self, **kwargs):
+        module_name, class_name = self.metrics_class.split(":")
+        return getattr(importlib.import_module(module_name), class_name)(**kwargs)
+
+    def add_prediction(self, metrics, predicted: str, test_case: Dict[str, Any], latency: float, cost: float, **extra):
+        metrics.add_prediction(predicted_response=predicted, test_case=test_case, latency=latency, cost=cost)
+
+    def runs_for(self, test_case: Dict[str, Any]) -> int:
+        """Esecuzioni del test case (attempt 0..N-1); più di una solo per i test di consistenza."""
+        return 1
+
+    def parse_response(self, predicted: str) -> Optional[Any]:
+        """Risposta strutturata del modello; None se non rispetta il formato della task."""
+        parsed = parse_json_response(predicted)
+        return parsed if isinstance(parsed, dict) else None
+
+    def reference_answer(self, test_case: Dict[str, Any]) -> str:
+        """Risposta "perfetta" derivata dalla ground truth (provider oracolo, test dell'harness)."""
+        raise NotImplementedError
+
+
+class RoutingTaskSpec(TaskSpec):
+    name = "routing"
+    display_name = "Agent Routing"
+    accuracy_field = "routing_accuracy"
+    metrics_class = "tasks.routing.metrics:RoutingMetricsCalculator"
+    max_new_tokens = 50
+    # Agenti elencati nel system prompt del router
+    agents = ("erp_agent", "crm_agent", "calendar_agent", "database_agent", "general_assistant")
+
+    def add_prediction(self, metrics, predicted, test_case, latency, cost, **extra):
+        metrics.add_prediction(predicted=predicted, expected=test_case["correct_agent"], latency=latency, cost=cost)
+
+    def parse_response(self, predicted):
+        agent = predicted.strip().strip("`'\".").lower()
+        return agent if agent in self.agents else None
+
+    def reference_answer(self, test_case):
+        return test_case["correct_agent"]
+
+
+class ToolCallingTaskSpec(TaskSpec):
+    name = "tool_calling"
+    display_name = "Tool Calling"
+    accuracy_field = "tool_selection_accuracy"
+    metrics_class = "tasks.tool_calling.metrics:ToolCallingMetricsCalculator"
+    max_new_tokens = 200
+
+    def add_prediction(self, metrics, predicted, test_case, latency, cost, **extra):
+        metrics.add_prediction(
+            predicted_response=predicted,
+            expected_tool=test_case["expected_tool"],
+            expected_parameters=test_case["expected_parameters"],
+            latency=latency,
+            cost=cost,
+        )
+
+    def parse_response(self, predicted):
+        parsed = super().parse_response(predicted)
+        return parsed if parsed and isinstance(parsed.get("tool"), str) else None
+
+    def reference_answer(self, test_case):
+        return json.dumps(
+            {"tool": test_case["expected_tool"], "parameters": test_case["expected_parameters"]},
+            ensure_ascii=False,
+        )
+
+
+class RAGTaskSpec(TaskSpec):
+    name = "rag"
+    display_name = "RAG (Retrieval Augmented Generation)"
+    accuracy_field = "retrieval_accuracy"
+    metrics_class = "tasks.rag.metrics:RAGMetricsCalculator"
+    max_new_tokens = 500
+
+    def __init__(self, tasks_dir: str = "tasks", compaction: str = DEFAULT_COMPACTION):
+        super().__init__(tasks_dir, compaction)
+        self._mock_database: Optional[Dict[str, Any]] = None
+        self._database_json: Optional[str] = None
+
+    @property
+    def mock_database(self) -> Dict[str, Any]:
+        if self._mock_database is None:
+            with open(f"{self.tasks_dir}/rag/mock_database.json", "r", encoding="utf-8") as f:
+                self._mock_database = json.load(f)
+        return self._mock_database
+
+    @property
+    def database_json(self) -> str:
+        # Il database è lo stesso per ogni esempio: serializzato una sola volta
+        if self._database_json is None:
+            self._database_json = self.dump_context(self.mock_database)
+        return self._database_json
+
+    def render_user_prompt(self, test_case):
+        return self.prompt_config["user_prompt_template"].format(
+            database_json=self.database_json,
+            user_phone=test_case["user_phone"],
+            user_query=test_case["user_query"],
+        )
+
+    def reference_answer(self, test_case):
+        if test_case.get("should_deny_access", False):
+            return json.dumps({"error": "accesso negato"}, ensure_ascii=False)
+        return json.dumps({"retrieved_data": test_case["expected_output"]}, ensure_ascii=False)
+
+
+class JudgeTaskSpec(TaskSpec):
+    name = "judge"
+    display_name = "Judge/Validator"
+    accuracy_field = "judgment_accuracy"
+    metrics_class = "tasks.judge.metrics:JudgeMetricsCalculator"
+
+    def render_user_prompt(self, test_case):
+        # Il prompt richiede: user_request, tool_name, tool_parameters, tool_result
+        tool_parameters = self.dump_context(test_case["tool_call"]["parameters"])
+        tool_result = self.dump_context(test_case["tool_result"])
+        return f"""USER REQUEST:
+{test_case['user_request']}
+
+TOOL CALL ESEGUITO:
+Tool: {test_case['tool_call']['name']}
+Parametri: {tool_parameters}
+
+RISULTATO OTTENUTO:
+{tool_result}
+
+Valuta se questo output è appropriato e può essere inoltrato all'utente."""
+
+    def add_prediction(self, metrics, predicted, test_case, latency, cost, **extra):
+        is_consistency_test = "consistency_test" in test_case.get("category", "")
+        metrics.add_prediction(
+            predicted_response=predicted,
+            ground_truth=test_case["ground_truth"],
+            latency=latency,
+            cost=cost,
+            test_case_id=test_case["id"] if is_consistency_test else None,
+        )
+
+    def runs_for(self, test_case):
+        return CONSISTENCY_RUNS if "consistency_test" in test_case.get("category", "") else 1
+
+    def parse_response(self, predicted):
+        parsed = super().parse_response(predicted)
+        return parsed if parsed and isinstance(parsed.get("approved"), bool) else None
+
+    def reference_answer(self, test_case):
+        return json.dumps({"approved": test_case["ground_truth"]["should_approve"]})
+
+
+class FinalAnswerTaskSpec(TaskSpec):
+    name = "final_answer"
+    display_name = "Final Answer"
+    accuracy_field = "overall_quality"
+    metrics_class = "tasks.final_answer.metrics:FinalAnswerMetricsCalculator"
+
+    def render_user_prompt(self, test_case):
+        return self.prompt_config["user_prompt_template"].format(
+            user_query=test_case["user_query"],
+            user_preferences=self.dump_context(test_case["user_preferences"]),
+            retrieved_context=self.dump_context(test_case["retrieved_context"]),
+        )
+
+    def parse_response(self, predicted):
+        # Risposta libera per l'utente: valida se non vuota
+        return predicted.strip() or None
+
+    def reference_answer(self, test_case):
+        concepts = test_case.get("expected_response_characteristics", {}).get("must_include_concepts", [])
+        return ", ".join(concepts) or test_case["user_query"]
+
+
+TASK_SPECS = {
+    spec.name: spec
+    for spec in (RoutingTaskSpec, ToolCallingTaskSpec, RAGTaskSpec, JudgeTaskSpec, FinalAnswerTaskSpec)
+}
+
+
+def get_task_spec(task_name: str, tasks_dir: str = "tasks", compaction: str = DEFAULT_COMPACTION) -> TaskSpec:
+    """Restituisce la TaskSpec per una task (compaction: modalità di src/compaction.py)."""
+    if task_name not in TASK_SPECS:
+        raise ValueError(f"Task '{task_name}' non trovata. Disponibili: {', '.join(TASK_SPECS)}")
+    return TASK_SPECS[task_name](tasks_dir, compaction)
+
+
+def get_all_tasks() -> List[str]:
+    """Restituisce la lista delle task registrate."""
+    return list(TASK_SPECS)
+
+
+def make_job_id(task: str, model_key: str, sample_size: Optional[int], shard: Optional[str], compaction: str) -> str:
+    """ID stabile di un job (task, modello, selezione del dataset), condiviso da scheduler e coda distribuita."""
+    key = json.dumps([task, model_key, sample_size, shard, compaction])
+    return f"{task}_{model_key.replace('/', '_')}_{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+
+
+def build_run_config(
+    spec: TaskSpec,
+    model_config: Dict[str, Any],
+    temperature: float = 0.0,
+    **fields: Any,
+) -> Dict[str, Any]:
+    """
+    Config salvata con una run eseguita fuori dai runner (batch, scheduler, coda distribuita).
+
+    Args:
+        spec: TaskSpec della run (task e compattazione)
+        model_config: Configurazione del modello
+        temperature: Temperatura delle richieste
+        **fields: Campi aggiuntivi (es. execution, sample_size, shard)
+    """
+    config = {
+        "task": spec.name,
+        "model_id": model_config['id'],
+        "model_name": model_config['name'],
+        "provider": model_config['provider'],
+        "max_new_tokens": spec.max_new_tokens,
+        "temperature": temperature,
+        **fields,
+    }
+    if spec.name in COMPACTABLE_TASKS:
+        config["compaction"] = spec.compaction
+    return config
@@ -0,0 +1,50 @@
+"""
+Esecutore simulato dei tool call per la pipeline end-to-end.
+
+Risponde con i risultati reali del dataset judge: per un tool call sceglie,
+tra gli esempi approvati con lo stesso tool, quello con più parametri
+uguali e ne restituisce il tool_result. Per i tool senza esempi restituisce
+un esito generico. Nessuna chiamata esterna, risultato deterministico.
+"""
+import copy
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class MockToolExecutor:
+    """Tool executor simulato basato sui risultati del dataset judge."""
+
+    def __init__(self, tasks_dir: str = "tasks"):
+        with open(f"{tasks_dir}/judge/dataset.json", "r", encoding="utf-8") as f:
+            dataset = json.load(f)
+        test_cases = dataset["test_cases"] if isinstance(dataset, dict) else dataset
+
+        self._results: Dict[str, List[Tuple[Dict[str, Any], Any]]] = {}
+        for test_case in test_cases:
+            if not test_case.get("ground_truth", {}).get("should_approve"):
+                continue
+            tool_call = test_case["tool_call"]
+            self._results.setdefault(tool_call["name"], []).append(
+                (tool_call.get("parameters") or {}, test_case["tool_result"])
+            )
+
+    @property
+    def tools(self) -> List[str]:
+        return sorted(self._results)
+
+    def execute(self, tool_name: str, parameters: Optional[Dict[str, Any]] = None) -> Any:
+        """Risultato simulato del tool call."""
+        parameters = parameters or {}
+        candidates = self._results.get(tool_name)
+        if not candidates:
+            return {"status": "ok", "tool": tool_name, "message": "operazione eseguita"}
+
+        def matching(candidate):
+            candidate_parameters = candidate[0]
+            return sum(
+                1 for key, value in parameters.items()
+                if value is not None and candidate_parameters.get(key) == value
+            )
+
+        _, tool_result = max(candidates, key=matching)
+        return copy.deepcopy(tool_result)
@@ -0,0 +1,175 @@
+"""
+Tracing leggero degli esempi in formato Chrome trace / Perfetto.
+
+Con il tracing disattivato span() restituisce un context manager no-op
+condiviso: il costo è una lookup globale e una chiamata di funzione.
+Attivato, ogni span diventa un evento "complete" (ph="X") con timestamp in
+microsecondi, visualizzabile in chrome://tracing o ui.perfetto.dev.
+
+Esempio:
+    enable_tracing()
+    with span("format_prompt", cat="harness", test_id=test_case['id']):
+        ...
+    get_tracer().write(results_dir / "trace.json")
+"""
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+class _NullSpan:
+    """Span no-op usato quando il tracing è disattivato."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start_ns")
+
+    def __init__(self, tracer: "Tracer", name: str, cat: str, args: Dict[str, Any]):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start_ns = 0
+
+    def __enter__(self):
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add_complete(self.name, self.start_ns, time.perf_counter_ns(), self.cat, self.args)
+        return False
+
+    def set(self, **args):
+        """Aggiunge argomenti allo span (es. token usati) prima della chiusura."""
+        self.args.update(args)
+
+
+class Tracer:
+    """Raccoglie gli eventi di trace in memoria (thread-safe)."""
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.origin_ns = time.perf_counter_ns()
+        self.events: List[Dict[str, Any]] = []
+        self.thread_names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, cat: str = "harness", **args) -> _Span:
+        return _Span(self, name, cat, args)
+
+    def add_complete(
+        self,
+        name: str,
+        start_ns: int,
+        end_ns: int,
+        cat: str = "harness",
+        args: Optional[Dict[str, Any]] = None,
+    ):
+        """Registra uno span già misurato (timestamp da time.perf_counter_ns)."""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": (start_ns - self.origin_ns) / 1000,
+            "dur": (end_ns - start_ns) / 1000,
+            "pid": self.pid,
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def instant(self, name: str, cat: str = "harness", **args):
+        """Registra un evento istantaneo (es. throttling, errore)."""
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "i",
+            "s": "t",
+            "ts": (time.perf_counter_ns() - self.origin_ns) / 1000,
+            "pid": self.pid,
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self.events.append(event)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def write(self, path: Path) -> Path:
+        """Scrive il trace in formato Chrome trace JSON."""
+        with self._lock:
+            metadata = [
+                {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self.thread_names.items()
+            ]
+            trace = {"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace, f, default=str)
+        return path
+
+
+_tracer: Optional[Tracer] = None
+
+
+def enable_tracing() -> Tracer:
+    """Attiva il tracing globale (idempotente) e restituisce il tracer."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable_tracing():
+    global _tracer
+    _tracer = None
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+def span(name: str, cat: str = "harness", **args):
+    """Context manager che misura un blocco; no-op se il tracing è spento."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return tracer.span(name, cat, **args)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, cat: str = "harness", **args):
+    """Registra uno span misurato a mano; no-op se il tracing è spento."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.add_complete(name, start_ns, end_ns, cat, args)
+
+
+def instant(name: str, cat: str = "harness", **args):
+    """Evento istantaneo; no-op se il tracing è spento."""
+    tracer = _tracer
+    if tracer is not None:
+        tracer.instant(name, cat, **args)
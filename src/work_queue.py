@@ -0,0 +1,587 @@
+"""
+Esecuzione distribuita su più macchine tramite una coda di lavoro SQLite.
+
+Una sola VM limita il throughput alle quote delle sue chiavi e della sua
+rete. Con la coda più processi, anche su macchine diverse con le proprie
+API key, si dividono gli esempi di uno stesso job (task, modello,
+selezione del dataset):
+
+- enqueue: crea il job e un elemento di lavoro per esecuzione, con chiave
+  (example_id, attempt): i test di consistenza della task judge sono
+  eseguiti più volte (TaskSpec.runs_for)
+- worker: prende in lease un blocco di elementi, li esegue in parallelo e
+  scrive i risultati per elemento nella coda; un thread rinnova i lease
+  finché gli elementi sono in esecuzione
+- un lease scaduto (worker crashato o macchina spenta) rimette l'elemento
+  in coda; dopo MAX_ATTEMPTS tentativi l'elemento è segnato come fallito,
+  come un esempio in errore in una run normale
+- quando tutti gli elementi di un job sono conclusi, il worker che ha
+  chiuso l'ultimo lo valuta con i calcolatori di metriche della task
+  nell'ordine del dataset e lo salva come una run normale (execution=
+  "distributed"): le metriche sono le stesse di una run su una sola macchina
+
+La run finalizzata va nell'archivio indicato da --store e nella directory
+che lo contiene (<dir dell'archivio>/<task>/<timestamp>/). Il job può
+concludersi su qualsiasi macchina: con più worker l'archivio deve stare
+anch'esso sul filesystem condiviso, altrimenti ogni run resta sulla macchina
+che l'ha finalizzata.
+
+Il file della coda deve stare su un filesystem condiviso con lock POSIX
+funzionanti (NFSv4, SMB); per questo la coda usa il journal classico di
+SQLite e non WAL, che richiede memoria condivisa sulla stessa macchina. Le
+scadenze dei lease usano l'orologio di sistema: le macchine devono essere
+sincronizzate (NTP).
+
+    python -m src.work_queue --db /mnt/shared/queue.db enqueue --task routing --models llama3.1-8b
+    python -m src.work_queue --db /mnt/shared/queue.db --store /mnt/shared/results/verabench.db worker --concurrency 8   # su ogni macchina
+    python -m src.work_queue --db /mnt/shared/queue.db status
+"""
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.compaction import COMPACTION_MODES, DEFAULT_COMPACTION
+from src.cost_ledger import BudgetExceededError, CostLedger, estimate_request_cost
+from src.env import load_dotenv
+from src.incremental import record_hashes
+from src.inference_client import ModelInferenceClient
+from src.logger import ResultLogger
+from src.metrics import calculate_cost
+from src.model_config import get_model_config
+from src.results_store import DEFAULT_DB_PATH, ResultsStore
+from src.task_specs import build_run_config, get_task_spec, make_job_id
+
+DEFAULT_QUEUE_PATH = "results/work_queue.db"
+DEFAULT_LEASE_SECONDS = 120.0
+DEFAULT_WORKER_CONCURRENCY = 4
+MAX_ATTEMPTS = 3
+POLL_INTERVAL = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    task TEXT NOT NULL,
+    model_key TEXT NOT NULL,
+    sample_size INTEGER,
+    shard TEXT,
+    compaction TEXT NOT NULL,
+    status TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    results_dir TEXT,
+    metrics_json TEXT
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    example_id TEXT NOT NULL,
+    -- Esecuzione del test case (TaskSpec.runs_for); attempts conta invece i lease
+    attempt INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    result_json TEXT,
+    error TEXT,
+    PRIMARY KEY (job_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_items_status ON items(status, lease_expires);
+"""
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    Job ed elementi di lavoro (uno per esecuzione di un esempio) con lease a scadenza, thread-safe.
+
+    Stati di un job: open, finalizing, done. Stati di un elemento: pending,
+    leased, done, failed.
+    """
+
+    def __init__(self, db_path: str = DEFAULT_QUEUE_PATH, lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self._lock = threading.RLock()
+        # Transazioni esplicite: il lease deve leggere e aggiornare in un'unica BEGIN IMMEDIATE
+        self.conn = sqlite3.connect(str(self.db_path), timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def _write(self, statements):
+        """Esegue statements(conn) in una transazione di scrittura."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    # --- job ---
+
+    def enqueue(
+        self,
+        task: str,
+        model_keys: List[str],
+        sample_size: Optional[int] = None,
+        shard: Optional[str] = None,
+        compaction: str = DEFAULT_COMPACTION,
+    ) -> List[str]:
+        """Accoda un job per modello; un job ancora aperto con la stessa selezione non viene duplicato."""
+        spec = get_task_spec(task)
+        test_cases = spec.load_test_cases(sample_size=sample_size, shard=shard)
+        runs = [(str(test_case['id']), attempt) for test_case in test_cases for attempt in range(spec.runs_for(test_case))]
+        added = []
+        for model_key in model_keys:
+            get_model_config(model_key)
+            job_id = make_job_id(task, model_key, sample_size, shard, compaction)
+
+            def add(conn):
+                row = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is not None and row['status'] != "done":
+                    return row['status']
+                # Job già completato: la nuova richiesta è una nuova run
+                conn.execute("DELETE FROM items WHERE job_id = ?", (job_id,))
+                conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+                conn.execute(
+                    "INSERT INTO jobs (job_id, task, model_key, sample_size, shard, compaction, status, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, 'open', ?)",
+                    (job_id, task, model_key, sample_size, shard, compaction,
+                     datetime.now().isoformat(timespec="seconds")),
+                )
+                conn.executemany(
+                    "INSERT INTO items (job_id, seq, example_id, attempt, status) VALUES (?, ?, ?, ?, 'pending')",
+                    [(job_id, seq, example_id, attempt) for seq, (example_id, attempt) in enumerate(runs)],
+                )
+                return None
+
+            existing = self._write(add)
+            if existing is not None:
+                print(f"[=] {job_id} già in coda ({existing})")
+                continue
+            added.append(job_id)
+            print(f"[+] {job_id}: {len(test_cases)} esempi, {len(runs)} elementi")
+        return added
+
+    def jobs(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [dict(row) for row in self.conn.execute("SELECT * FROM jobs ORDER BY created_at, job_id")]
+
+    def job(self, job_id: str) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone())
+
+    def counts(self, job_id: str) -> Dict[str, int]:
+        """Elementi del job per stato."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) AS n FROM items WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall()
+        counts = {"pending": 0, "leased": 0, "done": 0, "failed": 0}
+        counts.update({row['status']: row['n'] for row in rows})
+        return counts
+
+    def outstanding(self) -> int:
+        """Elementi in attesa o in lease dei job aperti."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM items i JOIN jobs j ON j.job_id = i.job_id "
+                "WHERE j.status = 'open' AND i.status IN ('pending', 'leased')"
+            ).fetchone()[0]
+
+    # --- lease ---
+
+    def lease(self, owner: str, limit: int) -> List[Dict[str, Any]]:
+        """
+        Prende in lease fino a `limit` elementi in attesa o con lease scaduto.
+
+        Gli elementi con lease scaduto e già MAX_ATTEMPTS tentativi vengono
+        segnati come falliti invece di essere ripresi.
+        """
+        def take(conn):
+            now = time.time()
+            conn.execute(
+                "UPDATE items SET status = 'failed', lease_owner = NULL, "
+                "error = COALESCE(error, 'lease scaduto') "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, MAX_ATTEMPTS),
+            )
+            rows = conn.execute(
+                "SELECT i.job_id, i.seq, i.example_id, i.attempt, i.attempts FROM items i "
+                "JOIN jobs j ON j.job_id = i.job_id "
+                "WHERE j.status = 'open' AND (i.status = 'pending' OR (i.status = 'leased' AND i.lease_expires < ?)) "
+                "ORDER BY j.created_at, i.job_id, i.seq LIMIT ?",
+                (now, limit),
+            ).fetchall()
+            conn.executemany(
+                "UPDATE items SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1 "
+                "WHERE job_id = ? AND seq = ?",
+                [(owner, now + self.lease_seconds, row['job_id'], row['seq']) for row in rows],
+            )
+            return [dict(row) for row in rows]
+
+        return self._write(take)
+
+    def renew(self, owner: str) -> int:
+        """Prolunga i lease dell'owner ancora in corso."""
+        return self._write(lambda conn: conn.execute(
+            "UPDATE items SET lease_expires = ? WHERE lease_owner = ? AND status = 'leased'",
+            (time.time() + self.lease_seconds, owner),
+        ).rowcount)
+
+    def complete(self, job_id: str, seq: int, owner: str, record: Dict[str, Any]) -> bool:
+        """
+        Registra il risultato di un elemento.
+
+        Vale il primo risultato: se il lease è scaduto e un altro worker ha già
+        completato l'elemento, questo risultato viene scartato (False).
+        """
+        return self._write(lambda conn: conn.execute(
+            "UPDATE items SET status = 'done', result_json = ?, worker = ?, lease_owner = NULL, error = NULL "
+            "WHERE job_id = ? AND seq = ? AND status IN ('pending', 'leased')",
+            (json.dumps(record, ensure_ascii=False), owner, job_id, seq),
+        ).rowcount > 0)
+
+    def fail(self, job_id: str, seq: int, owner: str, error: str, count_attempt: bool = True):
+        """Rimette in coda l'elemento dopo un errore, o lo segna fallito dopo MAX_ATTEMPTS tentativi."""
+        def release(conn):
+            if not count_attempt:
+                conn.execute(
+                    "UPDATE items SET attempts = attempts - 1 "
+                    "WHERE job_id = ? AND seq = ? AND lease_owner = ? AND status = 'leased'",
+                    (job_id, seq, owner),
+                )
+            conn.execute(
+                "UPDATE items SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_owner = NULL, lease_expires = NULL, error = ? "
+                "WHERE job_id = ? AND seq = ? AND lease_owner = ? AND status = 'leased'",
+                (MAX_ATTEMPTS, error, job_id, seq, owner),
+            )
+
+        self._write(release)
+
+    def claim_finalize(self, job_id: str, force: bool = False) -> bool:
+        """Passa il job a finalizing se nessun elemento è in attesa o in lease (un solo worker lo ottiene)."""
+        statuses = "('open', 'finalizing')" if force else "('open')"
+        return self._write(lambda conn: conn.execute(
+            f"UPDATE jobs SET status = 'finalizing' WHERE job_id = ? AND status IN {statuses} "
+            "AND NOT EXISTS (SELECT 1 FROM items WHERE job_id = ? AND status IN ('pending', 'leased'))",
+            (job_id, job_id),
+        ).rowcount > 0)
+
+    def results(self, job_id: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+        """Record degli elementi completati per (example_id, attempt), con il worker che li ha eseguiti."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT example_id, attempt, worker, result_json FROM items WHERE job_id = ? AND status = 'done'",
+                (job_id,),
+            ).fetchall()
+        return {
+            (row['example_id'], row['attempt']): {**json.loads(row['result_json']), "worker": row['worker']}
+            for row in rows
+        }
+
+    def active_leases(self) -> List[Dict[str, Any]]:
+        """Elementi in lease e prima scadenza per worker."""
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(
+                "SELECT lease_owner, COUNT(*) AS n, MIN(lease_expires) AS expires FROM items "
+                "WHERE status = 'leased' GROUP BY lease_owner ORDER BY lease_owner"
+            )]
+
+    def mark_done(self, job_id: str, results_dir: str, metrics: Dict[str, Any]):
+        self._write(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'done', results_dir = ?, metrics_json = ? WHERE job_id = ?",
+            (results_dir, json.dumps(metrics, ensure_ascii=False), job_id),
+        ))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+def finalize_job(queue: WorkQueue, job_id: str, store_path: str = DEFAULT_DB_PATH) -> Dict[str, Any]:
+    """Valuta il job nell'ordine del dataset e lo salva come run (archivio store_path e <sua dir>/<task>/<timestamp>/)."""
+    job = queue.job(job_id)
+    spec = get_task_spec(job["task"], compaction=job["compaction"])
+    model_config = get_model_config(job["model_key"])
+    records = queue.results(job_id)
+    test_cases = spec.load_test_cases(sample_size=job["sample_size"], shard=job["shard"])
+
+    metrics = spec.create_metrics()
+    examples = []
+    for test_case in test_cases:
+        for attempt in range(spec.runs_for(test_case)):
+            record = records.get((str(test_case['id']), attempt))
+            if record is None:
+                continue
+            spec.add_prediction(metrics, record["predicted"], test_case, record["latency"], record["cost"])
+            examples.append(record)
+    final_metrics = metrics.get_metrics()
+
+    config = build_run_config(
+        spec,
+        model_config,
+        seed=42,
+        sample_size=job["sample_size"],
+        shard=job["shard"],
+        total_examples=len(test_cases),
+        execution="distributed",
+        workers=sorted({record["worker"] for record in records.values()}),
+        failed_requests=queue.counts(job_id)["failed"],
+    )
+
+    store = ResultsStore(store_path)
+    try:
+        result_logger = ResultLogger(str(Path(store_path).parent / job["task"]), store=store)
+        result_logger.save_results({"config": config, "metrics": final_metrics}, job["model_key"], examples=examples)
+    finally:
+        store.close()
+
+    queue.mark_done(job_id, str(result_logger.results_dir), final_metrics)
+    return final_metrics
+
+
+def finalize_ready(queue: WorkQueue, force: bool = False, store_path: str = DEFAULT_DB_PATH) -> List[str]:
+    """Finalizza i job con tutti gli elementi conclusi; con force riprende anche quelli rimasti in finalizing."""
+    finalized = []
+    for job in queue.jobs():
+        if job["status"] == "done" or not queue.claim_finalize(job["job_id"], force=force):
+            continue
+        final_metrics = finalize_job(queue, job["job_id"], store_path=store_path)
+        accuracy_field = get_task_spec(job["task"]).accuracy_field
+        print(f"[✓] {job['job_id']} completato: {accuracy_field} {final_metrics.get(accuracy_field, 0.0):.3f}")
+        finalized.append(job["job_id"])
+    return finalized
+
+
+class QueueWorker:
+    """Processo worker: lease, esecuzione parallela degli esempi e finalizzazione dei job conclusi."""
+
+    def __init__(
+        self,
+        queue: WorkQueue,
+        worker_id: Optional[str] = None,
+        concurrency: int = DEFAULT_WORKER_CONCURRENCY,
+        cost_ledger: Optional[CostLedger] = None,
+        store_path: str = DEFAULT_DB_PATH,
+    ):
+        self.queue = queue
+        self.store_path = store_path
+        self.worker_id = worker_id or default_worker_id()
+        self.concurrency = concurrency
+        self.cost_ledger = cost_ledger or CostLedger()
+        self._clients: Dict[str, ModelInferenceClient] = {}
+        self._specs: Dict[str, Any] = {}
+        self._test_cases: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._setup_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.completed = 0
+        self.failed = 0
+        self.budget_stopped = False
+
+    def _job_context(self, job_id: str):
+        """Spec, client e test case del job (caricati una volta per processo)."""
+        with self._setup_lock:
+            if job_id not in self._specs:
+                job = self.queue.job(job_id)
+                spec = get_task_spec(job["task"], compaction=job["compaction"])
+                model_config = get_model_config(job["model_key"])
+                if job["model_key"] not in self._clients:
+                    self._clients[job["model_key"]] = ModelInferenceClient(
+                        model_config['id'], provider=model_config['provider']
+                    )
+                self._specs[job_id] = (job, spec, model_config)
+                self._test_cases[job_id] = spec.load_test_cases(sample_size=job["sample_size"], shard=job["shard"])
+            job, spec, model_config = self._specs[job_id]
+            return job, spec, model_config, self._clients[job["model_key"]], self._test_cases[job_id]
+
+    def _run_item(self, item: Dict[str, Any]):
+        job_id, seq, example_id, attempt = item["job_id"], item["seq"], item["example_id"], item["attempt"]
+        try:
+            job, spec, model_config, client, test_cases = self._job_context(job_id)
+            test_case = test_cases.get(example_id)
+            user_prompt = spec.render_user_prompt(test_case)
+            estimate = estimate_request_cost(model_config, spec.system_prompt, user_prompt, spec.max_new_tokens)
+            with self.cost_ledger.charge(job["model_key"], estimate) as charge:
+                predicted, latency, token_usage = client.generate(
+                    system_prompt=spec.system_prompt,
+                    user_prompt=user_prompt,
+                    max_new_tokens=spec.max_new_tokens,
+                    temperature=0.0,
+                )
+                cost = calculate_cost(
+                    token_usage['prompt_tokens'],
+                    token_usage['completion_tokens'],
+                    model_config['input_price_per_1m'],
+                    model_config['output_price_per_1m'],
+                )
+                charge.settle(cost, token_usage.get("api_key_id"))
+        except BudgetExceededError as e:
+            # Il budget è di questa macchina: l'elemento torna in coda per gli altri worker
+            self.queue.fail(job_id, seq, self.worker_id, str(e), count_attempt=False)
+            self.budget_stopped = True
+            self._stop.set()
+            return
+        except Exception as e:
+            print(f"ERRORE {job_id} test {example_id} attempt {attempt}: {str(e)}")
+            self.queue.fail(job_id, seq, self.worker_id, str(e))
+            self.failed += 1
+            return
+
+        record = {
+            "example_id": test_case['id'],
+            "attempt": attempt,
+            "predicted": predicted,
+            "latency": latency,
+            "cost": cost,
+            "prompt_tokens": token_usage['prompt_tokens'],
+            "completion_tokens": token_usage['completion_tokens'],
+            **record_hashes(test_case, spec.system_prompt, user_prompt, model_config, spec.max_new_tokens, 0.0),
+        }
+        if self.queue.complete(job_id, seq, self.worker_id, record):
+            self.completed += 1
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.queue.lease_seconds / 3):
+            self.queue.renew(self.worker_id)
+
+    def run(self, wait: bool = False, max_items: Optional[int] = None) -> int:
+        """
+        Esegue elementi finché i job aperti hanno elementi in attesa o in lease
+        (o, con wait, finché non viene interrotto).
+
+        Args:
+            wait: A coda vuota attende nuovi elementi invece di terminare
+            max_items: Numero massimo di elementi da prendere in lease
+
+        Returns:
+            Elementi completati da questo worker
+        """
+        load_dotenv()
+        print(f"[*] Worker {self.worker_id} su {self.queue.db_path} (concorrenza {self.concurrency})")
+        heartbeat = threading.Thread(target=self._heartbeat, daemon=True)
+        heartbeat.start()
+        leased_total = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                while not self._stop.is_set():
+                    limit = self.concurrency
+                    if max_items is not None:
+                        limit = min(limit, max_items - leased_total)
+                        if limit <= 0:
+                            break
+                    items = self.queue.lease(self.worker_id, limit)
+                    leased_total += len(items)
+                    if items:
+                        list(executor.map(self._run_item, items))
+                        print(f"  → {self.worker_id}: {self.completed} completati, {self.failed} errori")
+                    finalize_ready(self.queue, store_path=self.store_path)
+                    if not items:
+                        # Elementi ancora in lease di altri worker: se il worker è caduto tornano in coda alla scadenza
+                        if not wait and not self.queue.outstanding():
+                            break
+                        time.sleep(min(POLL_INTERVAL, self.queue.lease_seconds / 3))
+        finally:
+            self._stop.set()
+            heartbeat.join()
+        if self.budget_stopped:
+            print(f"[!] Worker {self.worker_id} fermato: budget esaurito")
+        return self.completed
+
+
+def print_status(queue: WorkQueue):
+    """Avanzamento dei job, lease attivi per worker e metriche dei job completati."""
+    print(f"\n{'='*60}")
+    print("CODA DI LAVORO")
+    print(f"{'='*60}")
+    print(f"{'Job':<48} {'Stato':<10} {'Completati':>13} {'Lease':>5} {'Falliti':>7}  Accuratezza")
+    for job in queue.jobs():
+        counts = queue.counts(job["job_id"])
+        total = sum(counts.values())
+        accuracy = ""
+        if job["metrics_json"]:
+            accuracy_field = get_task_spec(job["task"]).accuracy_field
+            accuracy = f"{json.loads(job['metrics_json']).get(accuracy_field, 0.0):.3f}"
+        completed = f"{counts['done']}/{total}"
+        print(f"{job['job_id'][:48]:<48} {job['status']:<10} {completed:>13} "
+              f"{counts['leased']:>5} {counts['failed']:>7}  {accuracy}")
+
+    owners = queue.active_leases()
+    if owners:
+        print("\nLease attivi:")
+        now = time.time()
+        for row in owners:
+            state = "scaduto" if row['expires'] < now else f"scade tra {row['expires'] - now:.0f}s"
+            print(f"  {row['lease_owner']:<40} {row['n']:>4} elementi ({state})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Esecuzione distribuita tramite una coda di lavoro SQLite condivisa")
+    parser.add_argument("--db", type=str, default=DEFAULT_QUEUE_PATH,
+                        help="File SQLite della coda (su un filesystem condiviso tra le macchine)")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help="Durata di un lease prima che l'elemento torni in coda")
+    parser.add_argument("--store", type=str, default=DEFAULT_DB_PATH,
+                        help="Archivio SQLite delle run finalizzate (con più macchine, sul filesystem condiviso)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Accoda (task, modello) per ogni modello")
+    enqueue_parser.add_argument("--task", required=True, help="Task da valutare")
+    enqueue_parser.add_argument("--models", required=True, help="Chiavi dei modelli separate da virgola")
+    enqueue_parser.add_argument("--sample", type=int, default=None, help="Campione stratificato di N esempi")
+    enqueue_parser.add_argument("--shard", type=str, default=None, help="Solo lo shard i/N del dataset")
+    enqueue_parser.add_argument("--compaction", choices=COMPACTION_MODES, default=DEFAULT_COMPACTION,
+                                help="Compattazione del contesto JSON nei prompt (rag, judge, final_answer)")
+
+    worker_parser = subparsers.add_parser("worker", help="Esegue elementi della coda")
+    worker_parser.add_argument("--concurrency", type=int, default=DEFAULT_WORKER_CONCURRENCY,
+                               help="Elementi in lease ed eseguiti in parallelo")
+    worker_parser.add_argument("--worker-id", type=str, default=None, help="Identificativo (default: host-pid)")
+    worker_parser.add_argument("--wait", action="store_true",
+                               help="A coda vuota attende nuovi elementi invece di terminare")
+    worker_parser.add_argument("--max-items", type=int, default=None, help="Termina dopo N elementi")
+    worker_parser.add_argument("--budget-day", type=float, default=None,
+                               help="Limite di spesa giornaliero in USD di questa macchina (results/cost_ledger.json)")
+
+    finalize_parser = subparsers.add_parser("finalize", help="Valuta e salva i job con tutti gli elementi conclusi")
+    finalize_parser.add_argument("--force", action="store_true",
+                                 help="Riprende anche i job rimasti in finalizing (worker interrotto durante il salvataggio)")
+
+    subparsers.add_parser("status", help="Avanzamento dei job e lease attivi")
+    args = parser.parse_args()
+
+    queue = WorkQueue(args.db, lease_seconds=args.lease_seconds)
+    try:
+        if args.command == "enqueue":
+            model_keys = [key.strip() for key in args.models.split(",") if key.strip()]
+            queue.enqueue(args.task, model_keys, args.sample, args.shard, args.compaction)
+        elif args.command == "worker":
+            worker = QueueWorker(queue, args.worker_id, args.concurrency,
+                                 cost_ledger=CostLedger(daily_budget=args.budget_day), store_path=args.store)
+            worker.run(wait=args.wait, max_items=args.max_items)
+        elif args.command == "finalize":
+            if not finalize_ready(queue, force=args.force, store_path=args.store):
+                print("[=] Nessun job pronto da finalizzare")
+        else:
+            print_status(queue)
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,13 +5,15 @@ Valuta:
 - Faithfulness: Fedeltà ai fatti tramite DeepEval 
 - Answer Relevancy: Pertinenza della risposta tramite DeepEval
 - Conciseness: Concisione per WhatsApp (rule-based: max caratteri e linee)
+
+DeepEval viene importato alla prima valutazione, non al caricamento del modulo.
 """
 import os
 from typing import Dict, Any
-from deepeval.metrics import FaithfulnessMetric, AnswerRelevancyMetric
-from deepeval.test_case import LLMTestCase
 import json
 
+from src.tracing import span
+
 
 class FinalAnswerMetricsCalculator:
     """Calcola le metriche per la task di Final Answer."""
@@ -121,6 +123,9 @@ class FinalAnswerMetricsCalculator:
             Score 0.0-1.0 (1.0 = completamente fedele ai fatti)
         """
         try:
+            from deepeval.metrics import FaithfulnessMetric
+            from deepeval.test_case import LLMTestCase
+
             # Crea test case per DeepEval
             test_case = LLMTestCase(
                 input="N/A",  # Non serve per faithfulness
@@ -136,7 +141,8 @@ class FinalAnswerMetricsCalculator:
             )
             
             # Misura (sincrono)
-            metric.measure(test_case)
+            with span("deepeval.faithfulness", cat="judge"):
+                metric.measure(test_case)
             
             # Ritorna score normalizzato 0-1
             return metric.score if metric.score is not None else 0.0
@@ -158,6 +164,9 @@ class FinalAnswerMetricsCalculator:
             Score 0.0-1.0 (1.0 = completamente rilevante)
         """
         try:
+            from deepeval.metrics import AnswerRelevancyMetric
+            from deepeval.test_case import LLMTestCase
+
             # Crea test case per DeepEval
             test_case = LLMTestCase(
                 input=input_query,
@@ -171,7 +180,8 @@ class FinalAnswerMetricsCalculator:
                 include_reason=False,
             )
             # Misura
-            metric.measure(test_case)
+            with span("deepeval.answer_relevancy", cat="judge"):
+                metric.measure(test_case)
             # Ritorna score normalizzato 0-1
             return metric.score if metric.score is not None else 0.0
             
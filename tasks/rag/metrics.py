@@ -9,6 +9,14 @@ import json
 from typing import Dict, Any, List
 
 
+def _as_set(values: List[Any]) -> set:
+    """Insieme dei valori di una lista; gli elementi non hashable diventano JSON canonico."""
+    return {
+        json.dumps(value, sort_keys=True, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+        for value in values
+    }
+
+
 class RAGMetricsCalculator:
     """Calcola le metriche per la task di RAG."""
     
@@ -129,8 +137,9 @@ class RAGMetricsCalculator:
                     fields_correct += nested_correct
                 elif isinstance(exp_value, list):
                     # Liste: set comparison per ordine-indipendente
+                    # (elementi non hashable, es. dict, confrontati come JSON canonico)
                     if isinstance(pred_value, list):
-                        if set(pred_value) == set(exp_value):
+                        if _as_set(pred_value) == _as_set(exp_value):
                             fields_correct += 1
                 else:
                     if pred_value == exp_value:
@@ -0,0 +1,22 @@
+"""Fixture condivise dei test."""
+import pytest
+
+
+class FakeClient:
+    """Client finto: approva sempre, fallisce sugli user prompt in failing_prompts."""
+
+    def __init__(self, failing_prompts=()):
+        self.failing_prompts = set(failing_prompts)
+        self.calls = 0
+
+    def generate(self, system_prompt, user_prompt, max_new_tokens, temperature=0.0):
+        self.calls += 1
+        if user_prompt in self.failing_prompts:
+            raise RuntimeError("errore del provider")
+        return '{"approved": true}', 0.01, {"prompt_tokens": 100, "completion_tokens": 5}
+
+
+@pytest.fixture
+def fake_client():
+    """Factory di FakeClient (senza chiamate di rete)."""
+    return FakeClient
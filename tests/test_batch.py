@@ -0,0 +1,43 @@
+"""Batch locale: attempt dei test di consistenza e riserva del costo nel CostLedger."""
+import pytest
+
+from src.batch import BatchRunner, LocalBatchBackend
+from src.cost_ledger import BudgetExceededError, CostLedger
+from src.task_specs import CONSISTENCY_RUNS, get_task_spec
+
+
+def _judge_cases():
+    cases = get_task_spec("judge").load_test_cases()
+    consistency = next(case for case in cases if "consistency_test" in case.get("category", ""))
+    single = next(case for case in cases if "consistency_test" not in case.get("category", ""))
+    return [single, consistency]
+
+
+def _runner(tmp_path, ledger):
+    runner = BatchRunner("judge", "mock", "local", poll_interval=0.0, state_dir=str(tmp_path / "state"),
+                         cost_ledger=ledger)
+    runner.backend = LocalBatchBackend("mock", root=str(tmp_path / "local"))
+    # Prezzi non nulli per esercitare la riserva (il provider resta mock, nessuna chiamata di rete)
+    runner.model_config = {**runner.model_config, "input_price_per_1m": 1.0, "output_price_per_1m": 1.0}
+    return runner
+
+
+def test_consistency_attempts_and_ledger_settlement(tmp_path):
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"))
+    single, consistency = _judge_cases()
+    outcome = _runner(tmp_path, ledger).run([single, consistency])
+
+    keys = [(example["example_id"], example["attempt"]) for example in outcome["examples"]]
+    assert keys == [(single["id"], 0)] + [(consistency["id"], attempt) for attempt in range(CONSISTENCY_RUNS)]
+    assert outcome["state"]["requests"] == 1 + CONSISTENCY_RUNS
+    assert ledger.run_spent == pytest.approx(sum(example["cost"] for example in outcome["examples"]))
+    assert ledger.run_spent > 0
+
+
+def test_reservation_blocks_submission_over_budget(tmp_path):
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"), run_budget=1e-6)
+    with pytest.raises(BudgetExceededError):
+        _runner(tmp_path, ledger).run(_judge_cases())
+
+    assert not (tmp_path / "local").exists()
+    assert ledger.run_spent == 0.0
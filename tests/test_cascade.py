@@ -0,0 +1,45 @@
+"""Chiamate della cascata addebitate al CostLedger."""
+import pytest
+
+from src.cascade import run_cascade
+from src.cost_ledger import CostLedger
+
+
+class FixedClient:
+    """Client finto: risponde sempre crm_agent con un uso di token fisso."""
+
+    def __init__(self, config):
+        self.calls = 0
+
+    def generate(self, **kwargs):
+        self.calls += 1
+        return "crm_agent", 0.01, {"prompt_tokens": 1_000, "completion_tokens": 10}
+
+
+def _test_cases(n):
+    return [{"id": f"r{i}", "user_request": f"richiesta {i}", "correct_agent": "crm_agent"} for i in range(n)]
+
+
+def test_cascade_calls_are_charged_to_ledger(tmp_path):
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"))
+    result = run_cascade("routing", "gpt-4o-mini", "gpt-4o", _test_cases(3), signals=["parse"],
+                         client_factory=FixedClient, cost_ledger=ledger)
+
+    assert len(result["records"]) == 3
+    spent = sum(record["cheap"]["cost"] + record["strong"]["cost"] for record in result["records"])
+    assert spent > 0
+    assert ledger.run_spent == pytest.approx(spent)
+    assert ledger.summary()["model_spent"].keys() == {"gpt-4o-mini", "gpt-4o"}
+
+
+def test_cascade_stops_when_run_budget_is_exhausted(tmp_path):
+    # Budget sufficiente per un paio di esempi (modello economico + forte)
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"), run_budget=0.005)
+    result = run_cascade("routing", "gpt-4o-mini", "gpt-4o", _test_cases(5), signals=["parse"],
+                         client_factory=FixedClient, cost_ledger=ledger)
+
+    assert result["budget_stopped"] is True
+    assert 0 < len(result["records"]) < 5
+    # Nessuna chiamata oltre il limite: la spesa è quella degli esempi completati
+    spent = sum(record["cheap"]["cost"] + record["strong"]["cost"] for record in result["records"])
+    assert ledger.run_spent == pytest.approx(spent)
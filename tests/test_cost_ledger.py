@@ -0,0 +1,60 @@
+"""CostLedger: riserve, riconciliazione e limiti per run, modello e giorno."""
+import pytest
+
+from src.cost_ledger import BudgetExceededError, CostLedger
+
+
+def _ledger(tmp_path, **budgets):
+    return CostLedger(path=str(tmp_path / "ledger.json"), **budgets)
+
+
+def test_outstanding_reservations_count_against_the_budget(tmp_path):
+    ledger = _ledger(tmp_path, run_budget=1.0)
+    first = ledger.reserve("a", 0.6)
+    # La seconda riserva sommata alla prima sfora il limite anche senza spesa registrata
+    with pytest.raises(BudgetExceededError):
+        ledger.reserve("a", 0.5)
+
+    ledger.reconcile(first, 0.2)
+    assert ledger.run_spent == pytest.approx(0.2)
+    # Riconciliata al costo reale, la riserva libera il margine non speso
+    ledger.release(ledger.reserve("a", 0.7))
+    assert ledger.run_spent == pytest.approx(0.2)
+
+
+def test_charge_releases_reservation_on_error(tmp_path):
+    ledger = _ledger(tmp_path, run_budget=1.0)
+    with pytest.raises(RuntimeError):
+        with ledger.charge("a", 0.9):
+            raise RuntimeError("richiesta fallita")
+    # Nessun costo e nessuna riserva residua
+    with ledger.charge("a", 0.9) as charge:
+        charge.settle(0.9)
+    assert ledger.run_spent == pytest.approx(0.9)
+    ledger.check("a")
+    with pytest.raises(BudgetExceededError):
+        ledger.reserve("a", 0.2)
+
+
+def test_model_budget_is_per_model(tmp_path):
+    ledger = _ledger(tmp_path, model_budget=0.5)
+    with ledger.charge("a", 0.1) as charge:
+        charge.settle(0.5)
+    with pytest.raises(BudgetExceededError):
+        ledger.check("a")
+    ledger.check("b")
+    ledger.release(ledger.reserve("b", 0.4))
+
+
+def test_daily_budget_is_shared_between_processes(tmp_path):
+    first_process = _ledger(tmp_path, daily_budget=1.0)
+    with first_process.charge("a", 0.1) as charge:
+        charge.settle(0.8, "key-1")
+
+    second_process = _ledger(tmp_path, daily_budget=1.0)
+    assert second_process.day_spent() == pytest.approx(0.8)
+    with pytest.raises(BudgetExceededError):
+        second_process.reserve("b", 0.3)
+    second_process.record("b", 0.3)
+    assert first_process.day_spent() == pytest.approx(1.1)
+    assert first_process.summary()["key_spent"] == {"key-1": pytest.approx(0.8)}
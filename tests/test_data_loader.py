@@ -0,0 +1,94 @@
+"""Campionamento stratificato e sharding di src.data_loader."""
+from collections import Counter
+
+import json
+
+import pytest
+
+from src.data_loader import (
+    build_id_index,
+    convert_json_to_jsonl,
+    load_test_cases,
+    select_test_cases,
+    shard_test_cases,
+    stratified_sample,
+)
+
+
+def make_cases(categories, per_category=1):
+    return [
+        {"id": f"{category}_{index}", "category": category}
+        for category in categories
+        for index in range(per_category)
+    ]
+
+
+def test_stratified_sample_is_deterministic_per_seed():
+    cases = make_cases([f"cat_{i:02d}" for i in range(20)], per_category=3)
+    assert stratified_sample(cases, 15, seed=7) == stratified_sample(cases, 15, seed=7)
+
+
+def test_stratified_sample_proportional_quotas():
+    cases = make_cases(["a"], 30) + make_cases(["b"], 10)
+    sample = stratified_sample(cases, 8, seed=1)
+    assert Counter(case["category"] for case in sample) == {"a": 6, "b": 2}
+
+
+def test_leftover_slots_depend_on_seed_not_on_alphabetical_order():
+    # Più strati che esempi: ogni strato ha lo stesso resto e gli esempi avanzati sono spareggi
+    cases = make_cases([f"cat_{i:02d}" for i in range(24)])
+    strata = {
+        frozenset(case["category"] for case in stratified_sample(cases, 10, seed=seed))
+        for seed in range(1, 6)
+    }
+    assert len(strata) > 1
+    alphabetical = frozenset(f"cat_{i:02d}" for i in range(10))
+    assert any(selected != alphabetical for selected in strata)
+
+
+def test_judge_sample_is_not_biased_towards_approve():
+    for seed in (1, 2, 3):
+        sample = load_test_cases("tasks/judge/dataset.json", sample_size=10, seed=seed)
+        assert any(case["category"].startswith("reject_") for case in sample)
+
+
+def test_shards_partition_the_sample():
+    cases = make_cases([f"cat_{i}" for i in range(5)], per_category=8)
+    sample = select_test_cases(cases, sample_size=20, seed=3)
+    shards = [select_test_cases(cases, sample_size=20, shard=f"{i}/3", seed=3) for i in range(3)]
+    assert sorted(case["id"] for shard in shards for case in shard) == [case["id"] for case in sample]
+    assert shard_test_cases(cases, 0, 1) == cases
+
+
+def test_invalid_sample_size():
+    with pytest.raises(ValueError):
+        stratified_sample(make_cases(["a"], 3), 0)
+
+
+def write_json_dataset(path, cases):
+    path.write_text(json.dumps({"dataset_info": {}, "test_cases": cases}), encoding="utf-8")
+    return path
+
+
+@pytest.mark.parametrize("fmt", ["json", "jsonl"])
+def test_loaded_test_cases_expose_id_lookup(tmp_path, fmt):
+    cases = [dict(case, text=f"testo {case['id']}") for case in make_cases(["a", "b"], per_category=3)]
+    json_path = write_json_dataset(tmp_path / "dataset.json", cases)
+    if fmt == "jsonl":
+        convert_json_to_jsonl(str(json_path))
+        json_path.unlink()
+
+    selected = load_test_cases(str(json_path), sample_size=4, seed=3)
+    assert len(selected) == 4
+    for case in selected:
+        assert selected.get(case["id"]) is case
+    # Il lookup copre solo la selezione, non l'intero dataset
+    unselected = next(case["id"] for case in cases if case["id"] not in selected.ids())
+    for missing in (unselected, "assente"):
+        with pytest.raises(KeyError):
+            selected.get(missing)
+
+
+def test_id_index_rejects_duplicate_ids():
+    with pytest.raises(ValueError, match="duplicato"):
+        build_id_index([{"id": "x"}, {"id": "x"}])
@@ -0,0 +1,44 @@
+"""Hedging: il costo delle risposte scartate arriva nel CostLedger."""
+import threading
+import time
+
+import pytest
+
+from src.cost_ledger import CostLedger
+from src.hedging import HedgingPolicy, ledger_recorder
+from src.metrics import calculate_cost, percentile
+
+MODEL_CONFIG = {"input_price_per_1m": 1.0, "output_price_per_1m": 2.0}
+USAGE = {"prompt_tokens": 1_000, "completion_tokens": 100}
+
+
+def test_percentile_nearest_rank():
+    assert percentile([], 95) is None
+    assert percentile([3.0, 1.0, 2.0, 4.0], 50) == 2.0
+    assert percentile([3.0, 1.0, 2.0, 4.0], 95) == 4.0
+
+
+def test_discarded_response_is_recorded_in_ledger(tmp_path):
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"))
+    policy = HedgingPolicy(50, min_samples=1, on_discarded=ledger_recorder(ledger, "model", MODEL_CONFIG))
+    # Una latenza osservata breve: il duplicato parte dopo ~10ms
+    policy.run(lambda: ("ok", 0.0, dict(USAGE)))
+
+    calls = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            calls.append(None)
+            first = len(calls) == 1
+        # La richiesta originale è lenta, il duplicato risponde subito
+        time.sleep(0.3 if first else 0.0)
+        return "ok", 0.0, dict(USAGE)
+
+    answer, _, token_usage = policy.run(call)
+    assert answer == "ok" and token_usage["hedged"] and token_usage["hedge_won"]
+    policy._executor.shutdown(wait=True)
+
+    single_cost = calculate_cost(USAGE["prompt_tokens"], USAGE["completion_tokens"], 1.0, 2.0)
+    assert ledger.summary()["model_spent"] == {"model": pytest.approx(single_cost)}
+    assert policy.metrics()["hedge_extra_prompt_tokens"] == USAGE["prompt_tokens"]
@@ -0,0 +1,96 @@
+"""Re-run differenziali: riuso, rivalutazione e riesecuzione per hash."""
+import pytest
+
+from src.incremental import load_reference, record_hashes
+from src.metrics import calculate_cost
+from src.results_store import ResultsStore
+
+MODEL_CONFIG = {"id": "provider/model", "provider": "openai", "input_price_per_1m": 1.0, "output_price_per_1m": 2.0}
+SYSTEM_PROMPT = "Scegli l'agente."
+
+
+def _test_case(example_id, expected="crm_agent"):
+    return {"id": example_id, "user_request": f"richiesta {example_id}", "correct_agent": expected}
+
+
+def _record(test_case, attempt=0, predicted="crm_agent"):
+    return {
+        "example_id": test_case["id"],
+        "attempt": attempt,
+        "predicted": predicted,
+        "latency": 0.5,
+        "cost": 0.0,
+        "prompt_tokens": 100,
+        "completion_tokens": 5,
+        **record_hashes(test_case, SYSTEM_PROMPT, test_case["user_request"], MODEL_CONFIG, 50, 0.0),
+    }
+
+
+def _hashes(test_case, system_prompt=SYSTEM_PROMPT, temperature=0.0):
+    return record_hashes(test_case, system_prompt, test_case["user_request"], MODEL_CONFIG, 50, temperature)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultsStore(str(tmp_path / "verabench.db"))
+    yield store
+    store.close()
+
+
+def _save(store, records, timestamp):
+    return store.save_run("routing", "model", {"model_name": "Model"}, {"routing_accuracy": 1.0}, timestamp,
+                          records=records)
+
+
+def test_unchanged_example_is_reused_at_current_prices(store):
+    test_case = _test_case("r1")
+    _save(store, [_record(test_case)], "20250101_000000")
+    reference = load_reference(store, "routing", "model")
+
+    predicted, latency, cost, token_usage = reference.reuse("r1", _hashes(test_case), MODEL_CONFIG)
+    assert (predicted, latency) == ("crm_agent", 0.5)
+    assert cost == pytest.approx(calculate_cost(100, 5, 1.0, 2.0))
+    assert token_usage == {"prompt_tokens": 100, "completion_tokens": 5}
+    assert reference.metrics()["incremental_reused"] == 1
+
+
+def test_changed_prompt_model_or_new_example_is_rerun(store):
+    test_case = _test_case("r1")
+    _save(store, [_record(test_case)], "20250101_000000")
+    reference = load_reference(store, "routing", "model")
+
+    assert reference.reuse("r1", _hashes(test_case, system_prompt="Nuovo prompt."), MODEL_CONFIG) is None
+    assert reference.reuse("r1", _hashes(test_case, temperature=0.7), MODEL_CONFIG) is None
+    assert reference.reuse("r2", _hashes(_test_case("r2")), MODEL_CONFIG) is None
+    assert reference.metrics()["incremental_rerun"] == 3
+    assert reference.metrics()["incremental_reused"] == 0
+
+
+def test_changed_expected_answer_is_rescored_without_a_call(store):
+    _save(store, [_record(_test_case("r1"))], "20250101_000000")
+    reference = load_reference(store, "routing", "model")
+
+    fixed = _test_case("r1", expected="erp_agent")
+    assert reference.reuse("r1", _hashes(fixed), MODEL_CONFIG) is not None
+    metrics = reference.metrics()
+    assert (metrics["incremental_reused"], metrics["incremental_rescored"]) == (1, 1)
+
+
+def test_attempts_are_reused_separately(store):
+    test_case = _test_case("c1")
+    _save(store, [_record(test_case, 0, "crm_agent"), _record(test_case, 1, "erp_agent")], "20250101_000000")
+    reference = load_reference(store, "routing", "model")
+
+    assert reference.reuse("c1", _hashes(test_case), MODEL_CONFIG, attempt=1)[0] == "erp_agent"
+    assert reference.reuse("c1", _hashes(test_case), MODEL_CONFIG, attempt=2) is None
+
+
+def test_reference_is_latest_run_with_hashes(store):
+    test_case = _test_case("r1")
+    hashed = _save(store, [_record(test_case)], "20250101_000000")
+    legacy = {key: value for key, value in _record(test_case).items() if not key.endswith("_hash")}
+    _save(store, [legacy], "20250102_000000")
+
+    assert load_reference(store, "routing", "model").run_id == hashed
+    with pytest.raises(ValueError):
+        load_reference(store, "routing", "model", run_id=str(hashed + 1))
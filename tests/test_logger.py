@@ -0,0 +1,55 @@
+"""Sink 'store' del tracking e import dei file risultati nell'archivio."""
+import json
+
+from src.logger import ResultLogger, build_tracker
+from src.results_store import ResultsStore, import_results_tree
+
+
+def test_store_sink_uses_model_key_and_is_not_reimported(tmp_path):
+    store = ResultsStore(str(tmp_path / "verabench.db"))
+    result_logger = ResultLogger(str(tmp_path / "results" / "routing"), "20250101_000000")
+    tracker = build_tracker("store", "verabench-test", result_logger.results_dir,
+                            store=store, run_timestamp="20250101_000000")
+
+    config = {"task": "routing", "model_id": "provider/model-v1", "model_name": "Model"}
+    tracker.start_run("routing_llama", config, model_key="llama")
+    tracker.log_example({"example_id": "r1", "predicted": "crm", "latency": 0.1, "cost": 0.0})
+    tracker.log_metrics({"routing_accuracy": 1.0})
+    tracker.finish_run()
+    tracker.close()
+    # Con il sink store il runner non passa l'archivio a ResultLogger
+    result_logger.save_results({"config": config, "metrics": {"routing_accuracy": 1.0}}, "llama")
+
+    summary = import_results_tree(store, str(tmp_path / "results"))
+    assert summary["imported"] == 0 and summary["skipped"] == 1
+
+    rows = store.conn.execute("SELECT model_key, source_path FROM runs").fetchall()
+    assert [row["model_key"] for row in rows] == ["llama"]
+    assert rows[0]["source_path"].endswith("llama_results.json")
+    assert len(store.get_records(1)) == 1
+    store.close()
+
+
+def test_imported_run_and_live_run_share_the_model_key(tmp_path):
+    # File di una run precedente all'archivio: model_id del provider diverso dalla chiave
+    model_key = "mistralai/Mistral-7B-Instruct-v0.3"
+    config = {"task": "routing", "model_id": "mistralai/Mistral-7B-Instruct-v0.3-turbo", "model_name": "Mistral 7B"}
+    old_run = tmp_path / "results" / "routing" / "20250101_000000"
+    old_run.mkdir(parents=True)
+    (old_run / "mistralai_Mistral-7B-Instruct-v0.3_results.json").write_text(
+        json.dumps({"config": config, "metrics": {"routing_accuracy": 0.5}}), encoding="utf-8")
+
+    store = ResultsStore(str(tmp_path / "verabench.db"))
+    assert import_results_tree(store, str(tmp_path / "results"))["imported"] == 1
+
+    # Run dal vivo dello stesso modello, salvata dal runner
+    result_logger = ResultLogger(str(tmp_path / "results" / "routing"), "20250102_000000", store=store)
+    result_logger.save_results({"config": config, "metrics": {"routing_accuracy": 0.75}}, model_key)
+
+    runs = store.query_runs(task="routing", model=model_key)
+    assert sorted(run["run_timestamp"] for run in runs) == ["20250101_000000", "20250102_000000"]
+    history = store.metric_history("routing", model_key, "routing_accuracy")
+    assert [row["value"] for row in history] == [0.75, 0.5]
+    keys = store.conn.execute("SELECT DISTINCT model_key FROM runs").fetchall()
+    assert [row["model_key"] for row in keys] == [model_key]
+    store.close()
@@ -0,0 +1,45 @@
+"""Chiamate impacchettate e di fallback addebitate al CostLedger."""
+import json
+import re
+
+import pytest
+
+from src.cost_ledger import CostLedger
+from src.packing import compare_pack_sizes
+
+
+class PackClient:
+    """Client finto: risponde crm_agent a ogni richiesta del pacchetto tranne 'r0' (fallback)."""
+
+    def generate(self, system_prompt, user_prompt, max_new_tokens, temperature=0.0):
+        ids = re.findall(r"### id: (\S+)", user_prompt)
+        if ids:
+            response = json.dumps([{"id": i, "answer": "crm_agent"} for i in ids if i != "r0"])
+        else:
+            response = "crm_agent"
+        return response, 0.01, {"prompt_tokens": 1_000, "completion_tokens": 20}
+
+
+def _test_cases(n):
+    return [{"id": f"r{i}", "user_request": f"richiesta {i}", "correct_agent": "crm_agent"} for i in range(n)]
+
+
+def test_packed_and_fallback_calls_are_charged(tmp_path):
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"))
+    results = compare_pack_sizes("routing", "gpt-4o", _test_cases(6), [1, 3], client=PackClient(),
+                                 cost_ledger=ledger)
+
+    assert [result["requests"] for result in results] == [6, 3]
+    assert results[1]["fallback_rate"] == pytest.approx(1 / 6)
+    assert ledger.run_spent == pytest.approx(sum(result["total_cost"] for result in results))
+
+
+def test_budget_stops_comparison(tmp_path):
+    # Basta per poche richieste singole a gpt-4o
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"), run_budget=0.01)
+    results = compare_pack_sizes("routing", "gpt-4o", _test_cases(6), [1, 3], client=PackClient(),
+                                 cost_ledger=ledger)
+
+    assert len(results) == 1 and results[0]["budget_stopped"]
+    assert 0 < results[0]["examples"] < 6
+    assert ledger.run_spent == pytest.approx(results[0]["total_cost"])
@@ -0,0 +1,35 @@
+"""Planner: il piano conta le stesse richieste e gli stessi token di una run reale."""
+from pathlib import Path
+
+import pytest
+
+from main_judge import JudgeBenchmarkRunner
+from src.cost_ledger import CostLedger
+from src.planner import plan_task
+from src.results_store import ResultsStore
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_plan_matches_mock_judge_run(tmp_path, monkeypatch):
+    # La run mock scrive risultati e archivio in tmp_path
+    (tmp_path / "tasks").symlink_to(REPO_ROOT / "tasks")
+    monkeypatch.chdir(tmp_path)
+
+    plan = plan_task("judge", ["mock"], db_path=str(tmp_path / "assente.db"))
+    (model_plan,) = plan["models"]
+
+    runner = JudgeBenchmarkRunner(tracking="none", cost_ledger=CostLedger(path=str(tmp_path / "ledger.json")))
+    runner.run_single_model("mock")
+    runner.results_store.close()
+
+    store = ResultsStore()
+    (run,) = store.query_runs(task="judge")
+    records = store.get_records(run["run_id"])
+    store.close()
+
+    # I test di consistenza sono eseguiti CONSISTENCY_RUNS volte: il piano deve contarli tutti
+    assert model_plan["requests"] == len(records) > len(runner.test_cases)
+    sent_prompt_tokens = sum(record["prompt_tokens"] for record in records)
+    # Contatori diversi (~4 caratteri per token in entrambi, più l'overhead dei messaggi nel piano)
+    assert model_plan["input_tokens"] == pytest.approx(sent_prompt_tokens, rel=0.05)
@@ -0,0 +1,59 @@
+"""Aggregazione incrementale dei file *_results.json."""
+import json
+
+from src import result_aggregator
+from src.result_aggregator import MANIFEST_FILENAME, aggregate_task_results, aggregate_task_results_with_errors
+
+
+def write_result(path, model_name, accuracy, **config):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({
+        "config": {"model_name": model_name, **config},
+        "metrics": {"routing_accuracy": accuracy},
+    }), encoding="utf-8")
+
+
+def test_aggregates_run_history_and_derives_variant(tmp_path):
+    write_result(tmp_path / "20250101_000000" / "a_results.json", "A", 0.5)
+    write_result(tmp_path / "20250102_000000" / "b_results.json", "B", 0.7, prompt_format="XML")
+    entries = aggregate_task_results(tmp_path, "routing", recursive=True)
+    assert [(entry["model"], entry["variant"]) for entry in entries] == [("A", "default"), ("B", "xml")]
+    assert (tmp_path / MANIFEST_FILENAME).exists()
+
+
+def test_unchanged_files_are_not_reparsed(tmp_path, monkeypatch):
+    write_result(tmp_path / "run1" / "a_results.json", "A", 0.5)
+    write_result(tmp_path / "run2" / "b_results.json", "B", 0.7)
+    aggregate_task_results(tmp_path, "routing", recursive=True)
+
+    parsed = []
+    original = result_aggregator._parse_result_file
+    monkeypatch.setattr(result_aggregator, "_parse_result_file",
+                        lambda path, *args: parsed.append(path.parent.name) or original(path, *args))
+    write_result(tmp_path / "run2" / "b_results.json", "B", 0.9)
+    entries = aggregate_task_results(tmp_path, "routing", recursive=True)
+    assert parsed == ["run2"]
+    assert entries[1]["metrics"]["routing_accuracy"] == 0.9
+
+
+def test_malformed_files_are_reported(tmp_path, capsys):
+    write_result(tmp_path / "a_results.json", "A", 0.5)
+    (tmp_path / "broken_results.json").write_text(json.dumps({"config": []}), encoding="utf-8")
+    entries = aggregate_task_results(tmp_path, "routing")
+    assert len(entries) == 1
+    assert "broken_results.json" in capsys.readouterr().out
+
+
+def test_unreadable_files_are_reported_and_retried(tmp_path):
+    write_result(tmp_path / "a_results.json", "A", 0.5)
+    # Una directory con il nome di un file risultati: read_bytes solleva OSError
+    (tmp_path / "b_results.json").mkdir()
+    entries, errors = aggregate_task_results_with_errors(tmp_path, "routing")
+    assert len(entries) == 1
+    assert [path for path, _ in errors] == [str(tmp_path / "b_results.json")]
+
+    # Non finisce nel manifest: quando diventa leggibile viene aggregato
+    (tmp_path / "b_results.json").rmdir()
+    write_result(tmp_path / "b_results.json", "B", 0.7)
+    entries, errors = aggregate_task_results_with_errors(tmp_path, "routing")
+    assert [entry["model"] for entry in entries] == ["A", "B"] and errors == []
@@ -0,0 +1,86 @@
+"""Scheduler: attempt dei test di consistenza, abbandono dopo MAX_ATTEMPTS, quote giornaliere e CostLedger."""
+import pytest
+
+from src.cost_ledger import CostLedger
+from src.model_config import MODELS, PROVIDER_RATE_LIMITS
+from src.scheduler import MAX_ATTEMPTS, QuotaScheduler, quota_day, quota_key, run_key
+from src.task_specs import get_task_spec
+
+
+def _scheduler(tmp_path, **ledger_kwargs):
+    ledger = CostLedger(path=str(tmp_path / "ledger.json"), **ledger_kwargs)
+    return QuotaScheduler(str(tmp_path / "scheduler"), cost_ledger=ledger)
+
+
+def test_consistency_attempts_are_all_run(tmp_path, fake_client):
+    scheduler = _scheduler(tmp_path)
+    job_id = scheduler.add_jobs("judge", ["mock"])[0]
+    state = scheduler.load_state()
+    spec = get_task_spec("judge")
+    expected = sum(spec.runs_for(test_case) for test_case in spec.load_test_cases())
+    assert state["jobs"][job_id]["requests"] == expected > len(state["jobs"][job_id]["example_ids"])
+
+    assert scheduler.run_job(state, job_id, {"mock": fake_client()}) == "done"
+    assert len(scheduler.completed_records(job_id)) == expected
+
+
+def test_failing_example_is_abandoned_after_max_attempts(tmp_path, fake_client):
+    scheduler = _scheduler(tmp_path)
+    job_id = scheduler.add_jobs("routing", ["mock"], sample_size=3)[0]
+    state = scheduler.load_state()
+    spec = get_task_spec("routing")
+    failing = spec.load_test_cases(sample_size=3)[0]
+    failing_id = str(failing["id"])
+    client = fake_client(failing_prompts=[spec.render_user_prompt(failing)])
+
+    outcomes = [scheduler.run_job(state, job_id, {"mock": client}) for _ in range(MAX_ATTEMPTS)]
+    assert outcomes == ["pending"] * (MAX_ATTEMPTS - 1) + ["done"]
+    assert state["jobs"][job_id]["failures"] == {run_key(failing_id, 0): MAX_ATTEMPTS}
+    assert len(scheduler.completed_records(job_id)) == 2
+    assert client.calls == 2 + MAX_ATTEMPTS
+
+
+def test_budget_stops_job_before_the_request(tmp_path, fake_client):
+    scheduler = _scheduler(tmp_path, run_budget=1e-9)
+    job_id = scheduler.add_jobs("routing", ["gpt-4o-mini"], sample_size=2)[0]
+    state = scheduler.load_state()
+    client = fake_client()
+
+    assert scheduler.run_job(state, job_id, {"gpt-4o-mini": client}) == "budget"
+    assert client.calls == 0
+    assert scheduler.completed_records(job_id) == {}
+
+
+def test_every_configured_provider_has_rate_limits():
+    assert {config["provider"] for config in MODELS.values()} <= PROVIDER_RATE_LIMITS.keys()
+
+
+def test_model_rate_limits_have_their_own_daily_quota(tmp_path, monkeypatch, fake_client):
+    monkeypatch.setitem(MODELS, "gpt-4o-mini", {**MODELS["gpt-4o-mini"], "rate_limits": {"rpm": None, "rpd": 2}})
+    assert quota_key("gpt-4o-mini") == "gpt-4o-mini"
+    assert quota_key("gpt-4o") == "gpt-4o" and quota_key("mock") == "mock"
+
+    scheduler = _scheduler(tmp_path)
+    job_id = scheduler.add_jobs("routing", ["gpt-4o-mini"], sample_size=3)[0]
+    state = scheduler.load_state()
+    client = fake_client()
+
+    assert scheduler.run_job(state, job_id, {"gpt-4o-mini": client}) == "quota"
+    assert client.calls == 2
+    assert state["usage"][quota_day()] == {"gpt-4o-mini": {"requests": 2, "tokens": 2 * 105}}
+
+
+def test_done_job_is_requeued_only_with_rerun(tmp_path, fake_client):
+    scheduler = _scheduler(tmp_path)
+    job_id = scheduler.add_jobs("routing", ["mock"], sample_size=2)[0]
+    state = scheduler.load_state()
+    assert scheduler.run_job(state, job_id, {"mock": fake_client()}) == "done"
+    state["jobs"][job_id]["status"] = "done"
+    scheduler.save_state(state)
+
+    assert scheduler.add_jobs("routing", ["mock"], sample_size=2) == []
+    assert len(scheduler.completed_records(job_id)) == 2
+
+    assert scheduler.add_jobs("routing", ["mock"], sample_size=2, rerun=True) == [job_id]
+    assert scheduler.load_state()["jobs"][job_id]["status"] == "pending"
+    assert scheduler.completed_records(job_id) == {}
@@ -0,0 +1,95 @@
+"""Coda di lavoro: lease a scadenza, tentativi massimi, primo risultato e attempt di consistenza."""
+import time
+from pathlib import Path
+
+import pytest
+
+from src.cost_ledger import CostLedger
+from src.results_store import ResultsStore
+from src.task_specs import get_task_spec
+from src.work_queue import MAX_ATTEMPTS, QueueWorker, WorkQueue
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def _queue(tmp_path, lease_seconds=60.0):
+    return WorkQueue(str(tmp_path / "queue.db"), lease_seconds=lease_seconds)
+
+
+def test_expired_lease_is_requeued_and_first_result_wins(tmp_path):
+    queue = _queue(tmp_path, lease_seconds=0.05)
+    job_id = queue.enqueue("routing", ["mock"], sample_size=2)[0]
+
+    first = queue.lease("worker-a", 1)
+    assert len(first) == 1
+    # Worker A non rinnova il lease: alla scadenza l'elemento torna disponibile
+    time.sleep(0.1)
+    second = queue.lease("worker-b", 2)
+    assert first[0]["seq"] in [item["seq"] for item in second]
+    assert next(item for item in second if item["seq"] == first[0]["seq"])["attempts"] == 1
+
+    assert queue.complete(job_id, first[0]["seq"], "worker-b", {"predicted": "b"})
+    assert not queue.complete(job_id, first[0]["seq"], "worker-a", {"predicted": "a"})
+    records = queue.results(job_id)
+    assert [record["predicted"] for record in records.values()] == ["b"]
+    queue.close()
+
+
+def test_item_fails_after_max_attempts(tmp_path):
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue("routing", ["mock"], sample_size=1)[0]
+
+    for attempt in range(MAX_ATTEMPTS):
+        (item,) = queue.lease("worker", 1)
+        queue.fail(job_id, item["seq"], "worker", f"errore {attempt}")
+
+    assert queue.lease("worker", 1) == []
+    assert queue.counts(job_id)["failed"] == 1
+    assert queue.claim_finalize(job_id)
+    queue.close()
+
+
+def test_worker_runs_every_consistency_attempt(tmp_path, monkeypatch, fake_client):
+    # I risultati della run finalizzata vanno in tmp_path/results
+    (tmp_path / "tasks").symlink_to(REPO_ROOT / "tasks")
+    monkeypatch.chdir(tmp_path)
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue("judge", ["mock"])[0]
+    spec = get_task_spec("judge")
+    expected = {
+        (str(test_case["id"]), attempt)
+        for test_case in spec.load_test_cases()
+        for attempt in range(spec.runs_for(test_case))
+    }
+    assert len(expected) > len(spec.load_test_cases())
+
+    worker = QueueWorker(queue, "worker", concurrency=4, cost_ledger=CostLedger(path=str(tmp_path / "ledger.json")))
+    worker._clients["mock"] = fake_client()
+    assert worker.run() == len(expected)
+
+    assert set(queue.results(job_id)) == expected
+    assert queue.job(job_id)["status"] == "done"
+    queue.close()
+
+
+def test_finalized_run_goes_to_the_shared_store(tmp_path, monkeypatch, fake_client):
+    (tmp_path / "tasks").symlink_to(REPO_ROOT / "tasks")
+    monkeypatch.chdir(tmp_path)
+    shared_store = tmp_path / "shared" / "verabench.db"
+    queue = _queue(tmp_path)
+    job_id = queue.enqueue("routing", ["mock"], sample_size=3)[0]
+
+    worker = QueueWorker(queue, "worker", cost_ledger=CostLedger(path=str(tmp_path / "ledger.json")),
+                         store_path=str(shared_store))
+    worker._clients["mock"] = fake_client()
+    worker.run()
+
+    assert queue.job(job_id)["status"] == "done"
+    assert Path(queue.job(job_id)["results_dir"]).parent == shared_store.parent / "routing"
+    # Niente archivio locale della macchina che ha finalizzato
+    assert not (tmp_path / "results").exists()
+    store = ResultsStore(str(shared_store))
+    (run,) = store.query_runs(task="routing", model="mock")
+    assert len(store.get_records(run["run_id"])) == 3
+    store.close()
+    queue.close()